@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import hashlib
+import datetime
+import threading
+import traceback
+import pandas as pd
+
+from ..Utiltity.time_utility import *
+
+# pyarrow is optional. The responses are stored as compressed pickle if it's not installed.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet
+except Exception:
+    pa = None
+finally:
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                CollectorResponseCache
+# The local cache of the raw DataFrame returned by collector plugins.
+# One file per (plugin, uri, normalized params): <root>/<plugin>/<uri>/<sha1 of params>.parquet
+#
+#   MODE_OFF    : Not used
+#   MODE_CACHE  : Use the cached response if it's not expired, else fetch and cache it
+#   MODE_RECORD : Always fetch and cache the response
+#   MODE_REPLAY : Only use the cached response (ignore expiration). Nothing goes to the network.
+#
+# The response of a closed period (e.g. daily data before today) never expires. See ttl_of().
+# ----------------------------------------------------------------------------------------------------------------------
+
+MODE_OFF = 'off'
+MODE_CACHE = 'cache'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+CACHE_MODES = [MODE_OFF, MODE_CACHE, MODE_RECORD, MODE_REPLAY]
+
+# The params which do not affect the response
+VOLATILE_PARAMS = ['test_flag', 'dump_flag']
+
+
+class CollectorResponseCache:
+    # Time to live (s) of the response of an open period (which may change): duration -> ttl
+    TTL_OPEN_PERIOD = {
+        'default': 24 * 3600,
+        'daily': 3600,
+        'quarter': 24 * 3600,
+    }
+    # The quarter data of a period older than this (days) is treated as closed (all reports are published)
+    QUARTER_CLOSED_DAYS = 365
+
+    def __init__(self, root_path: str, mode: str = MODE_CACHE):
+        self.__root_path = root_path
+        self.__mode = mode if mode in CACHE_MODES else MODE_OFF
+        self.__lock = threading.Lock()
+        # uri prefix -> ttl (s), overrides the default rules
+        self.__ttl_rules = {}
+
+        self.__hit = 0
+        self.__miss = 0
+        self.__expired = 0
+        self.__saved = 0
+
+    def mode(self) -> str:
+        return self.__mode
+
+    def set_mode(self, mode: str):
+        self.__mode = mode if mode in CACHE_MODES else MODE_OFF
+
+    def available(self) -> bool:
+        return self.__mode != MODE_OFF and isinstance(self.__root_path, str) and self.__root_path != ''
+
+    def offline(self) -> bool:
+        return self.__mode == MODE_REPLAY
+
+    def set_ttl(self, uri_prefix: str, ttl: int or None):
+        """
+        Specify the time to live (s) of the uri which starts with uri_prefix. None means never expire.
+        """
+        with self.__lock:
+            self.__ttl_rules[uri_prefix] = ttl
+
+    def statistics(self) -> dict:
+        with self.__lock:
+            return {
+                'hit': self.__hit,
+                'miss': self.__miss,
+                'expired': self.__expired,
+                'saved': self.__saved,
+            }
+
+    # ------------------------------------------------------------------------------------------
+
+    def ttl_of(self, uri: str, duration: str, until: datetime.datetime or None) -> int or None:
+        """
+        :param duration: 'daily', 'quarter' or others
+        :param until: The end of queried period. None if the query has no period.
+        :return: Time to live (s). None means never expire.
+        """
+        with self.__lock:
+            prefixes = [prefix for prefix in self.__ttl_rules.keys() if uri.startswith(prefix)]
+            if len(prefixes) > 0:
+                return self.__ttl_rules[max(prefixes, key=len)]
+        if until is not None:
+            if duration == 'daily' and until < today():
+                return None
+            if duration == 'quarter' and until < today() - datetime.timedelta(
+                    days=CollectorResponseCache.QUARTER_CLOSED_DAYS):
+                return None
+        return CollectorResponseCache.TTL_OPEN_PERIOD.get(duration, CollectorResponseCache.TTL_OPEN_PERIOD['default'])
+
+    def file_path(self, plugin: str, uri: str, params: dict) -> str:
+        key = hashlib.sha1(self.normalize_params(params).encode('utf-8')).hexdigest()
+        return os.path.join(self.__root_path, plugin, uri.replace('.', '_'),
+                            key + ('.parquet' if pa is not None else '.pkl.gz'))
+
+    @staticmethod
+    def normalize_params(params: dict) -> str:
+        def normalize(value: any) -> any:
+            if isinstance(value, (datetime.datetime, datetime.date)):
+                return value.isoformat()
+            if isinstance(value, (list, tuple)):
+                return [normalize(v) for v in value]
+            if isinstance(value, dict):
+                return {str(k): normalize(v) for k, v in value.items()}
+            return value
+        return json.dumps({k: normalize(v) for k, v in params.items() if k not in VOLATILE_PARAMS},
+                          sort_keys=True, default=str)
+
+    # ------------------------------------------------------------------------------------------
+
+    def load(self, plugin: str, uri: str, params: dict, ttl: int or None) -> pd.DataFrame or None:
+        """
+        :return: The cached response. None if not cached or expired (except replay mode).
+        """
+        if not self.available() or self.__mode == MODE_RECORD:
+            return None
+        file_path = self.file_path(plugin, uri, params)
+        if not os.path.isfile(file_path):
+            with self.__lock:
+                self.__miss += 1
+            return None
+        if ttl is not None and not self.offline() and time.time() - os.path.getmtime(file_path) > ttl:
+            with self.__lock:
+                self.__expired += 1
+            return None
+        try:
+            df = pd.read_parquet(file_path) if file_path.endswith('.parquet') else pd.read_pickle(file_path)
+        except Exception as e:
+            print('Load response cache %s fail: %s' % (file_path, str(e)))
+            return None
+        finally:
+            pass
+        with self.__lock:
+            self.__hit += 1
+        return df
+
+    def save(self, plugin: str, uri: str, params: dict, df: pd.DataFrame) -> bool:
+        if not self.available() or self.offline() or not isinstance(df, pd.DataFrame):
+            return False
+        file_path = self.file_path(plugin, uri, params)
+        temp_path = file_path + '.%d.tmp' % threading.get_ident()
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if pa is not None:
+                df.to_parquet(temp_path, compression='zstd', index=False)
+            else:
+                df.reset_index(drop=True).to_pickle(temp_path, compression='gzip')
+            os.replace(temp_path, file_path)
+        except Exception as e:
+            print('Save response cache %s fail: %s' % (file_path, str(e)))
+            print(traceback.format_exc())
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            return False
+        finally:
+            pass
+        with self.__lock:
+            self.__saved += 1
+        return True
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def test_record_replay():
+    import tempfile
+    df = pd.DataFrame({'ts_code': ['000001.SZ', '000002.SZ'], 'close': [1.1, 2.2],
+                       'trade_date': pd.to_datetime(['2020-01-02', '2020-01-02'])})
+    params = {'uri': 'TradeData.Stock.Daily', 'stock_identity': '000001.SZSE',
+              'trade_date': (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 3))}
+    cache = CollectorResponseCache(tempfile.mkdtemp(), MODE_RECORD)
+
+    assert cache.load('plugin', 'TradeData.Stock.Daily', params, None) is None
+    assert cache.save('plugin', 'TradeData.Stock.Daily', params, df)
+
+    cache.set_mode(MODE_REPLAY)
+    # The order of params and volatile params do not affect the key
+    same_params = dict(reversed(list(params.items())), dump_flag=False)
+    assert cache.load('plugin', 'TradeData.Stock.Daily', same_params, 1).equals(df)
+    assert cache.load('plugin', 'TradeData.Stock.Daily', dict(params, stock_identity='000002.SZSE'), None) is None
+    assert not cache.save('plugin', 'TradeData.Stock.Daily', params, df)
+    assert cache.statistics()['hit'] == 1
+
+
+def test_ttl():
+    cache = CollectorResponseCache('', MODE_CACHE)
+    assert cache.ttl_of('TradeData.Stock.Daily', 'daily', datetime.datetime(2020, 1, 3)) is None
+    assert cache.ttl_of('TradeData.Stock.Daily', 'daily', today()) == CollectorResponseCache.TTL_OPEN_PERIOD['daily']
+    assert cache.ttl_of('Finance.Audit', 'quarter', today() - datetime.timedelta(days=30)) is not None
+    assert cache.ttl_of('Finance.Audit', 'quarter', datetime.datetime(2015, 12, 31)) is None
+    assert cache.ttl_of('Market.SecuritiesInfo', '', None) == CollectorResponseCache.TTL_OPEN_PERIOD['default']
+
+    cache.set_ttl('Market', 60)
+    cache.set_ttl('Market.SecuritiesInfo', 0)
+    assert cache.ttl_of('Market.SecuritiesInfo', '', None) == 0
+    assert cache.ttl_of('Market.TradeCalender', '', None) == 60
+
+
+def test_entry():
+    test_record_replay()
+    test_ttl()
@@ -1,11 +1,15 @@
 import datetime
+import threading
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 from ..Utiltity.common import *
 from ..Utiltity.df_utility import *
 from ..Utiltity.time_utility import *
+from ..Utiltity.date_parser import parse_time
 from ..Database.NoSqlRw import ItkvTable
-from ..Database.DatabaseEntry import DatabaseEntry
+from ..Database.BucketItkvTable import BucketItkvTable, migrate_to_bucket_table, BUCKET_MONTH, BUCKET_YEAR
+from ..Database.DatabaseEntry import DatabaseEntry, LAYOUT_DOCUMENT, LAYOUT_BUCKET
 from ..StockAnalysisSystem import StockAnalysisSystem
 
 logger = logging.getLogger('')
@@ -65,7 +69,21 @@ class DataAgentUtility:
 
     @staticmethod
     def latest_trade_day() -> datetime.datetime:
-        return today()
+        """
+        The last trading day until today (include today). Today if the trade calendar is not available.
+        """
+        trade_calendar = DataAgentUtility.trade_calendar()
+        latest = trade_calendar.previous_trading_day(today(), inclusive=True) if trade_calendar is not None else None
+        return latest if latest is not None else today()
+
+    @staticmethod
+    def trade_calendar():
+        """
+        :return: The TradeCalendar of A-Share market. None if not available.
+        """
+        data_utility = DataAgentUtility.data_utility()
+        trade_calendar = data_utility.get_trade_calendar() if data_utility is not None else None
+        return trade_calendar if trade_calendar is not None and trade_calendar.available() else None
 
 
 # -------------------------------------------------- ParameterChecker --------------------------------------------------
@@ -113,6 +131,25 @@ class ParameterChecker:
             return True
         return ParameterChecker.check_dataframe_field(df, self.__df_param_info)
 
+    @staticmethod
+    def declare_to_dtypes(field_info: dict) -> dict:
+        """
+        Pick the DataFrame dtype of the fields which declare only one type.
+        :param field_info: The definition of fields info
+        :return: The dict of field -> dtype
+        """
+        dtypes = {}
+        if field_info is None:
+            return dtypes
+        for field, info in field_info.items():
+            types = info[0]
+            if len(types) != 1:
+                continue
+            df_type = ParameterChecker.PYTHON_DATAFRAME_TYPE_MAPPING.get(types[0])
+            if df_type is not None and df_type != 'object':
+                dtypes[field] = df_type
+        return dtypes
+
     @staticmethod
     def check_dict_param(argv: dict, param_info: dict) -> bool:
         if argv is None or len(argv) == 0:
@@ -245,8 +282,13 @@ class DataAgent:
         self.__datetime_field = datetime_field
         self.__candidate_fields = candidate_fields
         self.__checker = None
+        self.__result_dtypes = {}
         self.__extra = kwargs
 
+        # The range index: table name -> {identity: [since, until, count]}
+        self.__range_index = {}
+        self.__range_lock = threading.Lock()
+
         self.config_field_checker(kwargs.get('query_declare', None), kwargs.get('result_declare', None))
 
     # ---------------------------------- Constant ----------------------------------
@@ -275,15 +317,77 @@ class DataAgent:
     def data_table(self, uri: str, identity: str or [str],
                    time_serial: tuple, extra: dict, fields: list) -> ItkvTable:
         table_name = self.table_name(uri, identity, time_serial, extra, fields)
-        return self.__database_entry.query_nosql_table(self.__depot_name, table_name,
-                                                       self.__identity_field, self.__datetime_field)
-        
+        table = self.__database_entry.query_nosql_table(self.__depot_name, table_name,
+                                                        self.__identity_field, self.__datetime_field,
+                                                        self.storage_layout(), self.extra_param('bucket', BUCKET_YEAR))
+        if table is not None and self.append_mode_available():
+            table.set_unique_index(self.extra_param('extra_key', []) + list(self.__candidate_fields or []))
+        return table
+
+    def migrate_to_unique_index(self, uri: str, identities: [str] = None, dry_run: bool = True) -> int:
+        """
+        Migrate the legacy tables of append mode to the unique index. See ItkvTable.migrate_to_unique_index().
+        :param identities: None to migrate the tables of all identities in update list
+        :param dry_run: True to only report the duplicated records that would be removed
+        :return: The count of duplicated records removed (or would be removed)
+        """
+        if not self.append_mode_available():
+            return 0
+        identities = identities if identities is not None else (self.update_list() or [None])
+        tables = {}
+        for identity in identities:
+            tables.setdefault(self.table_name(uri, identity, (None, None), {}, []), identity)
+        count = 0
+        for identity in tables.values():
+            table = self.data_table(uri, identity, (None, None), {}, [])
+            if table is not None and hasattr(table, 'migrate_to_unique_index'):
+                count += table.migrate_to_unique_index(dry_run)
+        return count
+
+    def storage_layout(self) -> str:
+        """
+        LAYOUT_DOCUMENT (default): One document per record.
+        LAYOUT_BUCKET: One document per identity-year or identity-month (specified by bucket=BUCKET_YEAR/MONTH).
+            It requires both identity field and datetime field.
+        """
+        layout = self.extra_param('layout', LAYOUT_DOCUMENT)
+        return layout if layout != LAYOUT_BUCKET or \
+            (str_available(self.__identity_field) and str_available(self.__datetime_field)) else LAYOUT_DOCUMENT
+
+    def content_diff_available(self) -> bool:
+        """
+        Content diff: Compare the merged data with local data and only write the new or changed records.
+        Enabled by default for the data with identity field and datetime field. Disable it by content_diff=False.
+        """
+        return self.extra_param('content_diff', True) and \
+            str_available(self.__identity_field) and str_available(self.__datetime_field)
+
+    def local_tier_available(self) -> bool:
+        """
+        Local tier: Keep a local columnar copy of each identity's data. Enable it by specifying local_tier=True.
+        It requires both identity field and datetime field.
+        """
+        return self.extra_param('local_tier', False) and \
+            str_available(self.__identity_field) and str_available(self.__datetime_field)
+
+    def append_mode_available(self) -> bool:
+        """
+        Append mode: The records newer than the latest local record are inserted directly instead of upsert.
+        It requires both identity field and datetime field. Disable it by specifying append_mode=False.
+        """
+        return self.extra_param('append_mode', True) and \
+            str_available(self.__identity_field) and str_available(self.__datetime_field)
+
     def get_field_checker(self) -> ParameterChecker:
         return self.__checker
 
+    def get_result_dtypes(self) -> dict:
+        return self.__result_dtypes
+
     def config_field_checker(self, query_declare: dict, result_declare: dict):
         if query_declare is not None or result_declare is not None:
             self.__checker = ParameterChecker(result_declare, query_declare)
+        self.__result_dtypes = ParameterChecker.declare_to_dtypes(result_declare)
 
     # ------------------------------- Overrideable -------------------------------
 
@@ -298,16 +402,120 @@ class DataAgent:
         nop(self, uri, identity)
         return None, None
 
-    def data_range(self, uri: str, identity: str) -> (datetime.datetime, datetime.datetime):
-        table = self.data_table(uri, identity, (None, None), {}, [])
-        return (table.min_of(self.datetime_field(), identity), table.max_of(self.datetime_field(), identity)) \
-            if str_available(self.datetime_field()) else (None, None)
+    def data_range(self, uri: str, identity: str or [str]) -> (datetime.datetime, datetime.datetime):
+        identities = list(identity) if isinstance(identity, (list, tuple)) else [identity]
+        ranges = [r for r in self.data_ranges(uri, identities).values() if r[0] is not None and r[1] is not None]
+        return (min([r[0] for r in ranges]), max([r[1] for r in ranges])) if len(ranges) > 0 else (None, None)
 
     def update_range(self, uri: str, identity: str) -> (datetime.datetime, datetime.datetime):
         local_since, local_until = self.data_range(uri, identity)
         ref_since, ref_until = self.ref_range(uri, identity)
         return local_until, ref_until
 
+    # --------------------------------- Range Index ---------------------------------
+
+    def data_ranges(self, uri: str, identities: [str], with_count: bool = False) -> dict:
+        """
+        Get the local datetime range of identities from range index.
+        The range index of a table is built by one aggregation when it's accessed at the first time,
+            then it's updated by update_range_index() when new data is merged.
+        :param identities: The identities. The range of None identity is the range of whole table.
+        :param with_count: If True, the value is (since, until, count). Else (since, until)
+        :return: dict - identity -> (since, until) or (since, until, count)
+        """
+        result = {}
+        if not str_available(self.__datetime_field):
+            return {identity: ((None, None, 0) if with_count else (None, None)) for identity in identities}
+        existing_tables = self.__existing_tables(uri, identities)
+        for identity in identities:
+            index = self.__load_range_index(uri, identity, existing_tables)
+            with self.__range_lock:
+                if identity is None or not str_available(self.__identity_field):
+                    ranges = list(index.values())
+                else:
+                    ranges = [index[identity]] if identity in index else []
+                ranges = [r for r in ranges if r[0] is not None and r[1] is not None]
+                since = min([r[0] for r in ranges]) if len(ranges) > 0 else None
+                until = max([r[1] for r in ranges]) if len(ranges) > 0 else None
+                count = sum([r[2] for r in ranges])
+            result[identity] = (since, until, count) if with_count else (since, until)
+        return result
+
+    def update_range_index(self, uri: str, df: pd.DataFrame):
+        """
+        Update the range index by the merged data. Only the loaded index will be updated.
+        The records out of the indexed range are counted as new records,
+            the records inside the indexed range are treated as updating of existing records.
+        """
+        if not isinstance(df, pd.DataFrame) or len(df) == 0 or self.__datetime_field not in df.columns:
+            return
+        times = pd.to_datetime(df[self.__datetime_field], errors='coerce')
+        if str_available(self.__identity_field) and self.__identity_field in df.columns:
+            groups = times.groupby(df[self.__identity_field])
+        else:
+            groups = [(None, times)]
+        with self.__range_lock:
+            for identity, sub_times in groups:
+                table_name = self.table_name(uri, identity, (None, None), {}, [])
+                index = self.__range_index.get(table_name, None)
+                sub_times = sub_times.dropna()
+                if index is None or len(sub_times) == 0:
+                    continue
+                since, until, count = index.get(identity, (None, None, 0))
+                if since is None or until is None:
+                    index[identity] = (sub_times.min().to_pydatetime(), sub_times.max().to_pydatetime(),
+                                       count + len(sub_times))
+                else:
+                    new_count = int(((sub_times < since) | (sub_times > until)).sum())
+                    index[identity] = (min(since, sub_times.min().to_pydatetime()),
+                                       max(until, sub_times.max().to_pydatetime()), count + new_count)
+
+    def reset_range_index(self):
+        with self.__range_lock:
+            self.__range_index.clear()
+
+    def cross_section_ready(self, uri: str) -> bool:
+        """
+        Whether the derived cross section view can serve the query. No cross section by default.
+        """
+        nop(self, uri)
+        return False
+
+    def update_cross_section(self, uri: str, df: pd.DataFrame):
+        """
+        Maintain the derived views of merged data. Nothing by default.
+        """
+        nop(self, uri, df)
+
+    def __existing_tables(self, uri: str, identities: [str]) -> set or None:
+        """
+        List the existing tables by one query if the index of many tables are not loaded.
+        So the range of identity without table is known without accessing (and creating) its table.
+        """
+        with self.__range_lock:
+            table_names = set([self.table_name(uri, identity, (None, None), {}, []) for identity in identities])
+            not_loaded = len(table_names.difference(self.__range_index.keys()))
+        if not_loaded <= 1:
+            return None
+        existing_tables = self.__database_entry.list_nosql_tables(self.__depot_name)
+        if existing_tables is None:
+            return None
+        return existing_tables
+
+    def __load_range_index(self, uri: str, identity: str, existing_tables: set = None) -> dict:
+        table_name = self.table_name(uri, identity, (None, None), {}, [])
+        with self.__range_lock:
+            index = self.__range_index.get(table_name, None)
+        if index is None:
+            table = self.data_table(uri, identity, (None, None), {}, []) \
+                if existing_tables is None or table_name in existing_tables else None
+            index = table.ranges_of(self.__datetime_field) if table is not None else {}
+            with self.__range_lock:
+                index = self.__range_index.setdefault(table_name, index)
+        return index
+
+    # ------------------------------------------------------------------------------
+
     def merge_on(self) -> list:
         on_column = []
         if str_available(self.__identity_field):
@@ -331,10 +539,19 @@ class DataAgent:
               extra: dict, fields: list) -> pd.DataFrame or None:
         table = self.data_table(uri, identity, time_serial, extra, fields)
         since, until = normalize_time_serial(time_serial)
-        result = table.query(identity, since, until, extra, fields)
-        df = pd.DataFrame(result)
+        df = table.query_dataframe(identity, since, until, extra, fields, self.get_result_dtypes())
         return df
 
+    def query_iter(self, uri: str, identity: str or [str], time_serial: tuple,
+                   extra: dict, fields: list, chunk_rows: int):
+        """
+        The generator version of query(). Yields DataFrame chunks of at most chunk_rows rows.
+        """
+        table = self.data_table(uri, identity, time_serial, extra, fields)
+        since, until = normalize_time_serial(time_serial)
+        yield from table.query_iter(identity, since, until, extra, fields, self.get_result_dtypes(),
+                                    chunk_rows=chunk_rows)
+
     def merge(self, uri: str, identity: str, df: pd.DataFrame):
         table = self.data_table(uri, identity, (None, None), {}, [])
         identity_field, datetime_field = table.identity_field(), table.datetime_field()
@@ -342,8 +559,6 @@ class DataAgent:
         identity_field_available = str_available(identity_field)
         datetime_field_available = str_available(datetime_field)
 
-        table.set_connection_threshold(1)
-
         # for index, row in df.iterrows():
         # for row in df.to_dict(orient='records'):
         # https://stackoverflow.com/a/46098323/12929244
@@ -357,33 +572,55 @@ class DataAgent:
 
             datetime_value = row.get(datetime_field, None) if datetime_field_available else None
             if isinstance(datetime_value, str):
-                datetime_value = text_auto_time(datetime_value)
+                datetime_value = parse_time(datetime_value)
             if datetime_field_available and datetime_value is None:
                 print('Warning: datetime field "' + datetime_field + '" of <' + uri + '> missing.')
                 continue
             table.bulk_upsert(identity_value, datetime_value, row)          # row.dropna().to_dict())
         table.bulk_flush()
 
-    def merge2(self, uri: str, identity: str, _data: pd.DataFrame or dict or [dict]):
+    def merge2(self, uri: str, identity: str, _data: pd.DataFrame or dict or [dict],
+               table: ItkvTable = None) -> (int, int):
+        """
+        Persistence data to table.
+        If append mode is available, the records newer than the latest local record are inserted in bulk,
+            other records (overlapped with local data) are upserted.
+        If content diff is available, the records which are the same as local are not written.
+        :param table: The table to write. None to use the data table of (uri, identity).
+        :return: (Count of inserted records, Count of upserted records)
+        """
+        if table is None:
+            table = self.data_table(uri, identity, (None, None), {}, [])
+        if table is None:
+            return 0, 0
+        identity_field, datetime_field = table.identity_field(), table.datetime_field()
+
+        # The latest record of local. If the data is for multiple identities, use the latest of whole table.
+        append_mode = self.append_mode_available()
+        content_diff = self.content_diff_available() and isinstance(_data, pd.DataFrame)
+        local_until = table.max_of(datetime_field, identity if str_available(identity) else None) \
+            if append_mode or content_diff else None
+
+        if content_diff:
+            _data = self.__drop_unchanged(uri, identity, table, _data, local_until)
+
         if isinstance(_data, pd.DataFrame):
             clock = Clock()
-            data_dict = _data.T.apply(lambda x: x.dropna().to_dict()).tolist()
-            # data_dict = _data.T.to_dict().values()
+            # The datetime column is parsed once here, so the text_auto_time() below is skipped
+            data_dict = dataframe_to_records(_data, [datetime_field] if str_available(datetime_field) else None)
             print('Convert DataFrame size(%d) time spending: %s' % (len(_data), clock.elapsed_s()))
         elif isinstance(_data, dict):
             data_dict = [_data]
         elif isinstance(_data, (list, tuple)):
             data_dict = _data
         else:
-            return
-        
-        table = self.data_table(uri, identity, (None, None), {}, [])
-        if table is None:
-            return
-        identity_field, datetime_field = table.identity_field(), table.datetime_field()
+            return 0, 0
+
+        appended_keys = set()
 
         bulk_count = 0
-        table.set_connection_threshold(1)
+        insert_count = 0
+        upsert_count = 0
         for ddict in data_dict:
             identity_value = ddict.pop(identity_field, None) if str_available(identity_field) else None
             if str_available(identity_field) and identity_value is None:
@@ -396,7 +633,7 @@ class DataAgent:
                 continue
 
             if str_available(datetime_value):
-                datetime_value = text_auto_time(datetime_value)
+                datetime_value = parse_time(datetime_value)
 
             extra_spec = {}
             if isinstance(self.__candidate_fields, (tuple, list)):
@@ -409,7 +646,20 @@ class DataAgent:
                 if None in extra_spec.values():
                     continue
 
-            table.bulk_upsert(identity_value, datetime_value, ddict, extra_spec)
+            if append_mode and isinstance(datetime_value, datetime.datetime) and \
+                    (local_until is None or datetime_value > local_until):
+                # The duplicated records in patch should be merged by upsert
+                key = (identity_value, datetime_value, tuple(extra_spec.values()))
+                if key not in appended_keys:
+                    appended_keys.add(key)
+                    table.bulk_insert(identity_value, datetime_value, ddict, extra_spec)
+                    insert_count += 1
+                else:
+                    table.bulk_upsert(identity_value, datetime_value, ddict, extra_spec)
+                    upsert_count += 1
+            else:
+                table.bulk_upsert(identity_value, datetime_value, ddict, extra_spec)
+                upsert_count += 1
             bulk_count += 1
 
             if bulk_count > 5000:
@@ -417,6 +667,65 @@ class DataAgent:
                 bulk_count = 0
 
         table.bulk_flush()
+        print('%s: [%s] - Merged: %d inserted, %d upserted' % (uri, str(identity), insert_count, upsert_count))
+        return insert_count, upsert_count
+
+    def __drop_unchanged(self, uri: str, identity: str, table: ItkvTable, df: pd.DataFrame,
+                         local_until: datetime.datetime or None) -> pd.DataFrame:
+        """
+        Compare the rows with local by row hash, drop the rows which are the same as local.
+        The local rows overlapped with df are loaded by one query.
+        """
+        identity_field, datetime_field = table.identity_field(), table.datetime_field()
+        if len(df) == 0 or local_until is None or identity_field not in df.columns or datetime_field not in df.columns:
+            return df
+        times = pd.to_datetime(df[datetime_field], errors='coerce')
+        overlapped = times.notna() & (times <= local_until)
+        if not overlapped.any():
+            return df
+
+        clock = Clock()
+        columns = list(df.columns)
+        key_fields = [identity_field, datetime_field] + \
+                     [field for field in (self.__candidate_fields or []) if field in columns]
+        identities = df.loc[overlapped, identity_field].dropna().unique().tolist()
+        local = table.query_dataframe(identities[0] if len(identities) == 1 else identities,
+                                     times[overlapped].min().to_pydatetime(), times[overlapped].max().to_pydatetime(),
+                                     None, columns)
+        if local is None or len(local) == 0:
+            return df
+
+        patch = df.loc[overlapped, columns].copy()
+        patch[datetime_field] = times[overlapped]
+        local = local.reindex(columns=columns)
+        local[datetime_field] = pd.to_datetime(local[datetime_field], errors='coerce')
+        for column in columns:
+            if patch[column].dtype == local[column].dtype:
+                continue
+            # noinspection PyBroadException
+            try:
+                local[column] = local[column].astype(patch[column].dtype)
+            except Exception:
+                # Compare as text. A false difference only causes an unnecessary write.
+                patch[column] = patch[column].astype(str)
+                local[column] = local[column].astype(str)
+            finally:
+                pass
+
+        patch_keys = patch[key_fields].assign(_row_hash=pd.util.hash_pandas_object(patch, index=False).values)
+        local_keys = local[key_fields].assign(_row_hash=pd.util.hash_pandas_object(local, index=False).values)
+        matched = patch_keys.merge(local_keys.drop_duplicates(), how='left', on=key_fields + ['_row_hash'],
+                                   indicator=True)['_merge'].values == 'both'
+        existing = patch_keys[key_fields].merge(local_keys[key_fields].drop_duplicates(), how='left', on=key_fields,
+                                                indicator=True)['_merge'].values == 'both'
+
+        unchanged = np.zeros(len(df), dtype=bool)
+        unchanged[np.flatnonzero(overlapped.values)[matched]] = True
+        changed_count = int((existing & ~matched).sum())
+        print('%s: [%s] - Diff: %d unchanged, %d new, %d changed, time spending: %sms' %
+              (uri, str(identity), int(matched.sum()), len(df) - int(matched.sum()) - changed_count,
+               changed_count, clock.elapsed_ms()))
+        return df[~unchanged]
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -477,6 +786,8 @@ class DataAgentStockQuarter(DataAgent):
 class DataAgentSecurityDaily(DataAgent):
     def __init__(self, **kwargs):
         super(DataAgentSecurityDaily, self).__init__(**kwargs)
+        # The uris whose cross section is rebuilt completely
+        self.__cross_section_ready = set()
 
     # ------------------------------------
 
@@ -485,31 +796,256 @@ class DataAgentSecurityDaily(DataAgent):
         return DATA_DURATION_DAILY
 
     def table_name(self, uri: str, identity: str, time_serial: tuple, extra: dict, fields: list) -> str:
+        if self.storage_layout() == LAYOUT_BUCKET:
+            # All identities in one collection
+            return uri.replace('.', '_') + '_Bucket'
         name = (uri + '_' + identity) if str_available(identity) else uri
         return name.replace('.', '_')
 
+    def migrate_to_bucket_layout(self, uri: str, identities: [str] = None) -> int:
+        """
+        Copy the data from the per-identity collections (document layout) to the bucket layout collection.
+        The source collections are kept. Drop them manually after checking.
+        :return: The count of records migrated
+        """
+        if self.storage_layout() != LAYOUT_BUCKET:
+            print('The storage layout of %s is not bucket.' % uri)
+            return 0
+        target = self.data_table(uri, '', (None, None), {}, [])
+        if identities is None:
+            identities = self.update_list()
+        count = 0
+        for identity in identities:
+            source = self.database_entry().query_nosql_table(self.depot_name(), (uri + '_' + identity).replace('.', '_'),
+                                                             self.identity_field(), self.datetime_field())
+            if source is not None:
+                count += migrate_to_bucket_table(source, target, identity)
+        return count
+
+    def ref_range(self, uri: str, identity: str) -> (datetime.datetime, datetime.datetime):
+        nop(self, uri, identity)
+        # The data of closed days never comes. Do not update after the last trading day.
+        return None, DataAgentUtility.latest_trade_day()
+
     def update_list(self) -> [str]:
         nop(self)
         return DataAgentUtility.a_stock_list()
 
     # ------------------------------------
 
+    def cross_section_available(self) -> bool:
+        """
+        Enabled by cross_section=True. Keep a copy of all securities in one collection, indexed by date,
+            so the query of all securities on some days does not touch every per-security collection.
+        The copy is written with each update, but it's served only after rebuild_cross_section() is completed once.
+        """
+        return self.extra_param('cross_section', False) and \
+            str_available(self.identity_field()) and str_available(self.datetime_field())
+
+    def cross_section_table(self, uri: str) -> ItkvTable:
+        table = self.database_entry().query_nosql_table(self.depot_name(), uri.replace('.', '_') + '_CrossSection',
+                                                        self.identity_field(), self.datetime_field())
+        if table is not None and self.append_mode_available():
+            table.set_unique_index(self.extra_param('extra_key', []))
+        return table
+
+    def cross_section_ready(self, uri: str) -> bool:
+        """
+        Whether the cross section has all existing data: a complete rebuild is recorded in the update table.
+        """
+        if not self.cross_section_available():
+            return False
+        if uri in self.__cross_section_ready:
+            return True
+        update_table = self.database_entry().get_update_table()
+        if update_table is None or update_table.get_last_update_time(self.__cross_section_tags(uri)) is None:
+            return False
+        self.__cross_section_ready.add(uri)
+        return True
+
+    def update_cross_section(self, uri: str, df: pd.DataFrame):
+        if not self.cross_section_available() or not isinstance(df, pd.DataFrame) or len(df) == 0:
+            return
+        table = self.cross_section_table(uri)
+        if table is not None:
+            self.merge2(uri, None, df, table)
+
+    def rebuild_cross_section(self, uri: str, identities: [str] = None) -> int:
+        """
+        Fill the cross section collection with the existing per-security data.
+        :param identities: None to rebuild all securities of update list. Only the complete rebuild is recorded
+                            and makes the cross section served by query().
+        :return: The count of records written
+        """
+        if not self.cross_section_available():
+            print('The cross section of %s is not enabled.' % uri)
+            return 0
+        table = self.cross_section_table(uri)
+        complete = identities is None
+        if identities is None:
+            identities = self.update_list()
+        count = 0
+        for identity in identities:
+            df = super(DataAgentSecurityDaily, self).query(uri, identity, (None, None), {}, None)
+            if df is not None and len(df) > 0:
+                inserted, upserted = self.merge2(uri, identity, df, table)
+                count += inserted + upserted
+        update_table = self.database_entry().get_update_table()
+        if complete and update_table is not None:
+            update_table.update_latest_update_time(self.__cross_section_tags(uri))
+            self.__cross_section_ready.add(uri)
+        return count
+
+    @staticmethod
+    def __cross_section_tags(uri: str) -> [str]:
+        return uri.split('.') + ['__CrossSection']
+
+    # ------------------------------------
+
+    def market_wide_available(self) -> bool:
+        """
+        Enabled by market_wide=True. The plugin can fetch the data of all securities on one trade date.
+        """
+        return self.extra_param('market_wide', False) and \
+            str_available(self.identity_field()) and str_available(self.datetime_field())
+
+    def plan_market_update(self, uri: str, identities: [str],
+                           until: datetime.datetime = None) -> ([datetime.datetime], [str], [str]):
+        """
+        Plan the incremental update with the fewest fetches: per security or per trade date.
+        The securities whose local data ends before a cutoff date are updated per security,
+            the others are updated per trade date from the cutoff date. The cutoff minimises the fetch count.
+        The trade dates come from the trade calendar. If it's not available, they're estimated by business days
+            and the plugin skips the closed days.
+        :return: (trade dates, identities updated by trade dates, identities updated per security)
+        """
+        if not self.market_wide_available():
+            return [], [], list(identities)
+        until = date2datetime(until.date()) if until is not None else today()
+
+        per_security = []
+        stale = []
+        for identity, (_, local_until) in self.data_ranges(uri, identities).items():
+            if local_until is None:
+                # No local history, the trade date data is not enough
+                per_security.append(identity)
+            elif date2datetime(local_until.date()) < until:
+                stale.append((date2datetime(local_until.date()), identity))
+        if len(stale) == 0:
+            return [], [], per_security
+        stale.sort()
+
+        trade_calendar = DataAgentUtility.trade_calendar()
+        if trade_calendar is not None and not (trade_calendar.covers(stale[0][0]) and trade_calendar.covers(until)):
+            trade_calendar = None
+
+        # Cost of cutoff at stale[i]: i securities per security + trading days after the cutoff date
+        best_cost, best_index = len(stale), len(stale)
+        end = np.datetime64(tomorrow_of(until).date())
+        for i, (local_until, _) in enumerate(stale):
+            if i > 0 and local_until == stale[i - 1][0]:
+                continue
+            cost = i + (trade_calendar.count(tomorrow_of(local_until), until) if trade_calendar is not None else
+                        int(np.busday_count(np.datetime64(tomorrow_of(local_until).date()), end)))
+            if cost < best_cost:
+                best_cost, best_index = cost, i
+
+        per_security.extend([identity for _, identity in stale[:best_index]])
+        if best_index == len(stale):
+            return [], [], per_security
+        if trade_calendar is not None:
+            trade_dates = trade_calendar.trading_days(tomorrow_of(stale[best_index][0]), until)
+        else:
+            trade_dates = [d.to_pydatetime() for d in pd.bdate_range(tomorrow_of(stale[best_index][0]), until)]
+        if len(trade_dates) == 0:
+            # All stale securities are updated to the last business day
+            return [], [], per_security
+        return trade_dates, [identity for _, identity in stale[best_index:]], per_security
+
+    # The identities of a batch query are processed in chunks to limit the peak memory
+    BATCH_QUERY_CHUNK = 200
+    # The max concurrent collection queries of document layout
+    BATCH_QUERY_WORKERS = 8
+
     def query(self, uri: str, identity: str or [str], time_serial: tuple,
               extra: dict, fields: list) -> pd.DataFrame or None:
-        result = None
-        if not isinstance(identity, (list, tuple)):
-            identity = [identity]
-        for _id in identity:
-            df = super(DataAgentSecurityDaily, self).query(uri, _id, time_serial, extra, fields)
+        if isinstance(identity, (list, tuple)):
+            return self.query_batch(uri, identity, time_serial, extra, fields)
+        if not str_available(identity) and self.cross_section_ready(uri):
+            since, until = normalize_time_serial(time_serial)
+            if since is not None and until is not None:
+                # All securities in a date range: query from the cross section if it's rebuilt
+                table = self.cross_section_table(uri)
+                return table.query_dataframe(None, since, until, extra, fields, self.get_result_dtypes())
+        return super(DataAgentSecurityDaily, self).query(uri, identity, time_serial, extra, fields)
+
+    def query_iter(self, uri: str, identity: str or [str], time_serial: tuple,
+                   extra: dict, fields: list, chunk_rows: int):
+        if isinstance(identity, (list, tuple)):
+            # Yields the result of each identity chunk
+            identities = list(dict.fromkeys(identity))
+            for i in range(0, len(identities), DataAgentSecurityDaily.BATCH_QUERY_CHUNK):
+                df = self.__query_chunk(uri, identities[i:i + DataAgentSecurityDaily.BATCH_QUERY_CHUNK],
+                                        time_serial, extra, fields)
+                if df is not None and len(df) > 0:
+                    yield df
+            return
+        if not str_available(identity) and self.cross_section_ready(uri):
+            since, until = normalize_time_serial(time_serial)
+            if since is not None and until is not None:
+                table = self.cross_section_table(uri)
+                yield from table.query_iter(None, since, until, extra, fields, self.get_result_dtypes(),
+                                            chunk_rows=chunk_rows)
+                return
+        yield from super(DataAgentSecurityDaily, self).query_iter(uri, identity, time_serial,
+                                                                  extra, fields, chunk_rows)
+
+    def query_batch(self, uri: str, identities: [str], time_serial: tuple,
+                    extra: dict, fields: list, pivot: str = None) -> pd.DataFrame or None:
+        """
+        Query the data of multiple securities.
+        :param pivot: None to return the long format (rows of all identities are concatenated).
+                      Or a field name to return the wide format of this field: datetime as index, identity as columns.
+        :return: The DataFrame, None if no data
+        """
+        identity_field, datetime_field = self.identity_field(), self.datetime_field()
+        if pivot is not None and fields is not None and len(fields) > 0:
+            fields = list(set(fields) | {identity_field, datetime_field, pivot})
+
+        results = []
+        identities = list(dict.fromkeys(identities))
+        for i in range(0, len(identities), DataAgentSecurityDaily.BATCH_QUERY_CHUNK):
+            chunk = identities[i:i + DataAgentSecurityDaily.BATCH_QUERY_CHUNK]
+            df = self.__query_chunk(uri, chunk, time_serial, extra, fields)
             if df is None or len(df) == 0:
                 continue
-            result = df if result is None else pd.merge(result, df, on=self.merge_on())
-        return result
+            if pivot is not None:
+                # Pivot each chunk so the long format of all identities is never held at once
+                df = df.pivot_table(index=datetime_field, columns=identity_field, values=pivot, aggfunc='last')
+            results.append(df)
+
+        if len(results) == 0:
+            return None
+        if pivot is not None:
+            return pd.concat(results, axis=1).sort_index()
+        return pd.concat(results, ignore_index=True)
+
+    def __query_chunk(self, uri: str, identities: [str], time_serial: tuple,
+                      extra: dict, fields: list) -> pd.DataFrame or None:
+        if self.storage_layout() == LAYOUT_BUCKET:
+            # All identities in one collection, one $in query
+            return super(DataAgentSecurityDaily, self).query(uri, identities, time_serial, extra, fields)
+
+        # One collection per identity, query them concurrently
+        def query_one(_id: str) -> pd.DataFrame or None:
+            return super(DataAgentSecurityDaily, self).query(uri, _id, time_serial, extra, fields)
+
+        with ThreadPoolExecutor(max_workers=DataAgentSecurityDaily.BATCH_QUERY_WORKERS) as executor:
+            dfs = [df for df in executor.map(query_one, identities) if df is not None and len(df) > 0]
+        return pd.concat(dfs, ignore_index=True) if len(dfs) > 0 else None
 
     def merge(self, uri: str, identity: str, df: pd.DataFrame):
-        grouped = df.groupby(df[self.identity_field()])
-        for sub_identity in grouped.groups:
-            sub_dataframe = grouped.get_group(sub_identity)
+        for sub_identity, sub_dataframe in df.groupby(self.identity_field()):
             super(DataAgentSecurityDaily, self).merge2(uri, sub_identity, sub_dataframe)
 
 
@@ -517,6 +1053,8 @@ class DataAgentSecurityDaily(DataAgent):
 
 class DataAgentSecurityInDay(DataAgentSecurityDaily):
     def __init__(self, **kwargs):
+        # In day data is much more than daily data, use one bucket per month by default.
+        kwargs.setdefault('bucket', BUCKET_MONTH)
         super(DataAgentSecurityInDay, self).__init__(**kwargs)
 
 
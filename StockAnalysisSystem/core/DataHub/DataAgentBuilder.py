@@ -298,12 +298,15 @@ def build_data_agent(database_entry: DatabaseEntry):
             datetime_field='trade_date',
 
             query_declare={
-                'stock_identity': ([str], [],           True,  ''),
+                'stock_identity': ([str], [],           False, ''),
                 'trade_date':     ([tuple, None], [],   False, ''),
             },
             result_declare={
                 'trade_date':     (['datetime'], [],    True, ''),
             },
+
+            local_tier=True,
+            market_wide=True,
         ),
 
         # DataAgentSecurityInDay(
@@ -323,6 +326,9 @@ def build_data_agent(database_entry: DatabaseEntry):
         #     result_declare={
         #         'trade_datetime': (['datetime'], [],    True, ''),
         #     },
+        #
+        #     layout='bucket',
+        #     bucket='month',
         # ),
 
         DataAgentIndexDaily(
@@ -342,6 +348,8 @@ def build_data_agent(database_entry: DatabaseEntry):
             result_declare={
                 'trade_date':     (['datetime'], [],    True, ''),
             },
+
+            local_tier=True,
         ),
 
         DataAgentFactorQuarter(
@@ -1,5 +1,8 @@
+import asyncio
+
 from ..Utiltity.common import *
 from ..Utiltity.time_utility import *
+from .TradeCalendar import TradeCalendar
 from .UniversalDataCenter import UniversalDataCenter
 
 
@@ -127,6 +130,9 @@ class DataUtility:
         self.__index_cache_ready = False
         # self.__index_cache = IdentityNameInfoCache()
 
+        self.__trade_calendar = TradeCalendar([])
+        self.__trade_calendar_ready = False
+
     # ------------------------------- General -------------------------------
 
     def get_support_exchange(self) -> dict:
@@ -150,6 +156,38 @@ class DataUtility:
         return self.get_stock_listing_date(securities, default_val) if securities in self.__stock_id_name.keys() else \
                self.get_index_listing_date(securities, default_val)
 
+    def get_securities_life_time(self) -> pd.DataFrame:
+        """
+        Get the listing date and delisting date (NaT if not delisted) of all stocks and indexes.
+        :return: DataFrame with columns: identity, listing_date, delisting_date
+        """
+        dfs = []
+        for uri, identity_field in [('Market.SecuritiesInfo', 'stock_identity'),
+                                    ('Market.IndexInfo', 'index_identity')]:
+            df = self.__data_center.query(uri, fields=[identity_field, 'listing_date', 'delist_date'])
+            if df is None or len(df) == 0 or identity_field not in df.columns:
+                continue
+            dfs.append(pd.DataFrame({
+                'identity': df[identity_field],
+                'listing_date': pd.to_datetime(df['listing_date'], errors='coerce')
+                if 'listing_date' in df.columns else pd.NaT,
+                'delisting_date': pd.to_datetime(df['delist_date'], errors='coerce')
+                if 'delist_date' in df.columns else pd.NaT,
+            }))
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=['identity', 'listing_date', 'delisting_date'])
+        return pd.concat(dfs, ignore_index=True).drop_duplicates('identity', keep='first')
+
+    # ----------------------------- Trade Calendar -----------------------------
+
+    def get_trade_calendar(self) -> TradeCalendar:
+        """
+        The trading days of A-Share market. Built once from Market.TradeCalender, rebuilt by refresh_cache().
+        :return: TradeCalendar. Check available() before using it.
+        """
+        self.__check_refresh_trade_calendar()
+        return self.__trade_calendar
+
     # -------------------------------- Stock --------------------------------
 
     def stock_cache_ready(self) -> bool:
@@ -204,16 +242,53 @@ class DataUtility:
 
     def auto_query(self, identity: str or [str], time_serial: tuple, fields: [str],
                    join_on: [str] = None) -> pd.DataFrame or [pd.DataFrame]:
+        queries = self.__pack_auto_query(identity, time_serial, fields, join_on)
+        return self.__join_auto_query(self.__data_center.query_batch(queries), join_on)
+
+    async def auto_query_async(self, identity: str or [str], time_serial: tuple, fields: [str],
+                               join_on: [str] = None) -> pd.DataFrame or [pd.DataFrame]:
+        queries = self.__pack_auto_query(identity, time_serial, fields, join_on)
+        dfs = await asyncio.gather(*[self.__data_center.query_async(uri, _identity, _time_serial, **extra)
+                                     for uri, _identity, _time_serial, extra in queries])
+        return self.__join_auto_query(list(dfs), join_on)
+
+    def auto_query_iter(self, identity: str or [str], time_serial: tuple, fields: [str],
+                        join_on: [str] = None, chunk_identities: int = 200):
+        """
+        The chunked version of auto_query(). The identities are queried and joined chunk by chunk.
+        :param identity: The identities. Empty for all stocks.
+        :param chunk_identities: The count of identities in each chunk
+        :return: The generator of auto_query() result of each chunk
+        """
+        if isinstance(identity, (list, tuple)):
+            identities = list(identity)
+        elif str_available(identity):
+            identities = [identity]
+        else:
+            identities = self.get_stock_identities()
+        for i in range(0, len(identities), chunk_identities):
+            result = self.auto_query(identities[i:i + chunk_identities], time_serial, fields, join_on)
+            if result is not None:
+                yield result
+
+    def __pack_auto_query(self, identity: str or [str], time_serial: tuple, fields: [str],
+                          join_on: [str] or None) -> [tuple]:
         group = self.__data_center.readable_to_uri(fields)
         if 'None' in group.keys():
             print('Warning: Unknown fields in auto_query() : ' + str(group['None']))
             del group['None']
-        result = None
+        queries = []
         for uri, fields in group.items():
             if join_on is not None:
                 fields.extend(join_on)
                 fields = list(set(fields))
-            df = self.__data_center.query(uri, identity, time_serial, fields=fields, readable=True)
+            queries.append((uri, identity, time_serial, {'fields': fields, 'readable': True}))
+        return queries
+
+    @staticmethod
+    def __join_auto_query(dfs: [pd.DataFrame], join_on: [str] or None) -> pd.DataFrame or [pd.DataFrame]:
+        result = None
+        for df in dfs:
             if join_on is not None:
                 result = df if result is None else pd.merge(result, df, how='left', on=join_on)
             else:
@@ -245,6 +320,7 @@ class DataUtility:
         self.__lock.acquire()
         self.__refresh_stock_cache()
         self.__refresh_index_cache()
+        self.__refresh_trade_calendar()
         self.__lock.release()
 
     # -------------------------- Stock --------------------------
@@ -318,6 +394,33 @@ class DataUtility:
         self.__index_name_id = name_id_dict
         self.__index_cache_ready = True
 
+    # ---------------------- Trade Calendar ----------------------
+
+    def __check_refresh_trade_calendar(self):
+        if not self.__trade_calendar_ready:
+            self.__lock.acquire()
+            if not self.__trade_calendar_ready:
+                self.__refresh_trade_calendar()
+            self.__lock.release()
+
+    def __refresh_trade_calendar(self):
+        clock = Clock()
+        df = None
+        # All exchanges of A-Share share the same calendar. Use the first one which has data.
+        for exchange in ['SSE', 'SZSE', 'A-SHARE']:
+            df = self.__data_center.query('Market.TradeCalender', exchange, fields=['trade_date', 'status'])
+            if df is not None and len(df) > 0:
+                break
+        trade_calendar = TradeCalendar.from_dataframe(df)
+        print('Build trade calendar time spending: %sms' % clock.elapsed_ms())
+
+        if not trade_calendar.available():
+            print('No trade calendar. Please Update Market.TradeCalender first.')
+
+        # Assignment at last to make access lock free. Not retry if no data until refresh_cache().
+        self.__trade_calendar = trade_calendar
+        self.__trade_calendar_ready = True
+
     # --------------------------------------- Assistance ---------------------------------------
 
     def __query_identity_filed_value(self, uri: str, identity: str, field: str, default_val: any) -> any:
@@ -0,0 +1,176 @@
+import threading
+import collections
+import pandas as pd
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                   QueryResultCache
+# LRU cache of query result (DataFrame), bounded by the memory of cached DataFrames.
+# Each entry belongs to a group (the data agent) and a set of identities (None means all identities).
+# The write of (group, identities) invalidates the entries that may contain these identities.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class QueryResultCache:
+    def __init__(self, budget_bytes: int = 256 * 1024 * 1024):
+        self.__lock = threading.Lock()
+        self.__budget = budget_bytes
+        self.__used = 0
+        # key -> (group, identities, DataFrame, size). The order is LRU order, the last one is the newest.
+        self.__entries = collections.OrderedDict()
+        # group -> set of keys
+        self.__group_keys = {}
+        # group -> generation, increased by each invalidation
+        self.__generations = {}
+
+        self.__hit = 0
+        self.__miss = 0
+        self.__eviction = 0
+        self.__invalidation = 0
+
+    def set_budget(self, budget_bytes: int):
+        with self.__lock:
+            self.__budget = budget_bytes
+            self.__evict()
+
+    def enabled(self) -> bool:
+        return self.__budget > 0
+
+    # ------------------------------------------------------------------------------------------
+
+    def generation(self, group: str) -> int:
+        """
+        Get it before query and pass it to put(). So the result which is queried before a write will not be cached.
+        """
+        with self.__lock:
+            return self.__generations.get(group, 0)
+
+    def get(self, key: tuple) -> pd.DataFrame or None:
+        """
+        :return: The copy of cached DataFrame, None if not cached
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.__miss += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__hit += 1
+            df = entry[2]
+        return df.copy()
+
+    def put(self, key: tuple, group: str, identities: tuple or None, df: pd.DataFrame, generation: int) -> bool:
+        if not self.enabled() or not isinstance(df, pd.DataFrame):
+            return False
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.__budget:
+            return False
+        df = df.copy()
+        with self.__lock:
+            if self.__generations.get(group, 0) != generation:
+                return False
+            self.__remove(key)
+            self.__entries[key] = (group, identities, df, size)
+            self.__group_keys.setdefault(group, set()).add(key)
+            self.__used += size
+            self.__evict()
+        return True
+
+    def invalidate(self, group: str, identities: [str] or None = None):
+        """
+        Remove the entries which may contain the data of identities.
+        :param group: The group of entries
+        :param identities: The identities of written data. None to invalidate whole group.
+        """
+        with self.__lock:
+            self.__generations[group] = self.__generations.get(group, 0) + 1
+            identities = set(identities) if identities is not None else None
+            for key in list(self.__group_keys.get(group, [])):
+                entry_identities = self.__entries[key][1]
+                if identities is None or entry_identities is None or \
+                        len(identities.intersection(entry_identities)) > 0:
+                    self.__remove(key)
+                    self.__invalidation += 1
+
+    def clear(self):
+        with self.__lock:
+            for group in self.__group_keys.keys():
+                self.__generations[group] = self.__generations.get(group, 0) + 1
+            self.__entries.clear()
+            self.__group_keys.clear()
+            self.__used = 0
+
+    def statistics(self) -> dict:
+        with self.__lock:
+            return {
+                'hit': self.__hit,
+                'miss': self.__miss,
+                'eviction': self.__eviction,
+                'invalidation': self.__invalidation,
+                'entries': len(self.__entries),
+                'used_bytes': self.__used,
+                'budget_bytes': self.__budget,
+            }
+
+    # ------------------------------------------------------------------------------------------
+
+    def __remove(self, key: tuple):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            group, _, _, size = entry
+            self.__used -= size
+            self.__group_keys.get(group, set()).discard(key)
+
+    def __evict(self):
+        while self.__used > self.__budget and len(self.__entries) > 0:
+            self.__remove(next(iter(self.__entries)))
+            self.__eviction += 1
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def test_lru_and_budget():
+    df = pd.DataFrame({'identity': ['000001.SZSE'] * 100, 'value': range(100)})
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    cache = QueryResultCache(size * 2)
+
+    assert cache.put(('k1', ), 'Uri', ('000001.SZSE', ), df, cache.generation('Uri'))
+    assert cache.put(('k2', ), 'Uri', ('000001.SZSE', ), df, cache.generation('Uri'))
+    assert cache.get(('k1', )) is not None
+    # k2 is the least recently used one
+    assert cache.put(('k3', ), 'Uri', ('000001.SZSE', ), df, cache.generation('Uri'))
+    assert cache.get(('k2', )) is None
+    assert cache.get(('k1', )) is not None
+
+    # The cached DataFrame is not affected by the modification of caller
+    cached = cache.get(('k1', ))
+    cached['value'] = 0
+    assert cache.get(('k1', ))['value'].sum() == sum(range(100))
+
+    statistics = cache.statistics()
+    assert statistics['hit'] == 4 and statistics['miss'] == 1 and statistics['eviction'] == 1
+
+
+def test_invalidate():
+    df = pd.DataFrame({'value': range(10)})
+    cache = QueryResultCache()
+
+    cache.put(('a', ), 'Uri', ('000001.SZSE', ), df, cache.generation('Uri'))
+    cache.put(('b', ), 'Uri', ('000002.SZSE', ), df, cache.generation('Uri'))
+    cache.put(('all', ), 'Uri', None, df, cache.generation('Uri'))
+    cache.put(('other', ), 'Uri2', None, df, cache.generation('Uri2'))
+
+    cache.invalidate('Uri', ['000001.SZSE'])
+    assert cache.get(('a', )) is None
+    assert cache.get(('all', )) is None
+    assert cache.get(('b', )) is not None
+    assert cache.get(('other', )) is not None
+
+    # The result queried before the write is dropped
+    generation = cache.generation('Uri')
+    cache.invalidate('Uri', ['000002.SZSE'])
+    assert not cache.put(('c', ), 'Uri', ('000003.SZSE', ), df, generation)
+
+
+def test_entry():
+    test_lru_and_budget()
+    test_invalidate()
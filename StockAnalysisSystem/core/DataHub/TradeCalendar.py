@@ -0,0 +1,134 @@
+import bisect
+import datetime
+import pandas as pd
+
+from ..Utiltity.time_utility import *
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                    TradeCalendar
+# The sorted trading days in memory. All lookups are bisect on the sorted list.
+# The days out of the calendar range are unknown: the lookups return None for them.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class TradeCalendar:
+    def __init__(self, trading_days: [datetime.datetime], since: datetime.datetime = None,
+                 until: datetime.datetime = None):
+        """
+        :param trading_days: The trading days (open sessions)
+        :param since: The first day of the calendar (include the closed days). None to use the first trading day.
+        :param until: The last day of the calendar (include the closed days). None to use the last trading day.
+        """
+        self.__days = sorted(set([self.__to_date(day) for day in trading_days if day is not None]))
+        self.__since = self.__to_date(since) if since is not None else (self.__days[0] if self.__days else None)
+        self.__until = self.__to_date(until) if until is not None else (self.__days[-1] if self.__days else None)
+
+    @staticmethod
+    def from_dataframe(df: pd.DataFrame, date_field: str = 'trade_date', status_field: str = 'status'):
+        """
+        Build from the data of Market.TradeCalender. The status of trading day is 1.
+        """
+        if df is None or len(df) == 0 or date_field not in df.columns:
+            return TradeCalendar([])
+        dates = pd.to_datetime(df[date_field], errors='coerce')
+        opened = pd.to_numeric(df[status_field], errors='coerce') == 1 if status_field in df.columns else True
+        return TradeCalendar(dates[opened].dropna().dt.to_pydatetime().tolist(),
+                             dates.min().to_pydatetime(), dates.max().to_pydatetime())
+
+    def available(self) -> bool:
+        return len(self.__days) > 0
+
+    def covers(self, day: datetime.datetime) -> bool:
+        return self.available() and self.__since <= self.__to_date(day) <= self.__until
+
+    # ------------------------------------------------------------------------------------------
+
+    def is_trading_day(self, day: datetime.datetime) -> bool or None:
+        """
+        :return: None if the day is out of calendar
+        """
+        if not self.covers(day):
+            return None
+        day = self.__to_date(day)
+        index = bisect.bisect_left(self.__days, day)
+        return index < len(self.__days) and self.__days[index] == day
+
+    def next_trading_day(self, day: datetime.datetime, inclusive: bool = False) -> datetime.datetime or None:
+        """
+        :param inclusive: True to return the day itself if it's a trading day
+        :return: None if the day is out of calendar or there's no trading day after it in calendar
+        """
+        if not self.covers(day):
+            return None
+        day = self.__to_date(day)
+        index = bisect.bisect_left(self.__days, day) if inclusive else bisect.bisect_right(self.__days, day)
+        return self.__days[index] if index < len(self.__days) else None
+
+    def previous_trading_day(self, day: datetime.datetime, inclusive: bool = False) -> datetime.datetime or None:
+        """
+        :param inclusive: True to return the day itself if it's a trading day
+        :return: None if the day is out of calendar or there's no trading day before it in calendar
+        """
+        if not self.covers(day):
+            return None
+        day = self.__to_date(day)
+        index = bisect.bisect_right(self.__days, day) if inclusive else bisect.bisect_left(self.__days, day)
+        return self.__days[index - 1] if index > 0 else None
+
+    def trading_days(self, since: datetime.datetime, until: datetime.datetime) -> [datetime.datetime]:
+        """
+        The trading days in [since, until] which are in calendar.
+        """
+        lower = bisect.bisect_left(self.__days, self.__to_date(since))
+        upper = bisect.bisect_right(self.__days, self.__to_date(until))
+        return self.__days[lower:upper]
+
+    def count(self, since: datetime.datetime, until: datetime.datetime) -> int:
+        lower = bisect.bisect_left(self.__days, self.__to_date(since))
+        upper = bisect.bisect_right(self.__days, self.__to_date(until))
+        return max(upper - lower, 0)
+
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def __to_date(day: datetime.datetime) -> datetime.datetime:
+        return date2datetime(day.date()) if isinstance(day, datetime.datetime) else date2datetime(day)
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def __build_test_calendar() -> TradeCalendar:
+    # 2020-01-01 is holiday. 2020-01-04 and 2020-01-05 are weekend.
+    df = pd.DataFrame({
+        'exchange': 'SSE',
+        'trade_date': pd.date_range('2020-01-01', '2020-01-10'),
+        'status': [0, 1, 1, 0, 0, 1, 1, 1, 1, 1],
+    })
+    return TradeCalendar.from_dataframe(df)
+
+
+def test_lookup():
+    calendar = __build_test_calendar()
+    friday, saturday, sunday, monday = [datetime.datetime(2020, 1, d) for d in (3, 4, 5, 6)]
+
+    assert calendar.is_trading_day(friday) and not calendar.is_trading_day(saturday)
+    assert calendar.is_trading_day(datetime.datetime(2021, 1, 1)) is None
+
+    assert calendar.next_trading_day(friday) == monday
+    assert calendar.next_trading_day(friday, inclusive=True) == friday
+    assert calendar.next_trading_day(saturday, inclusive=True) == monday
+    assert calendar.next_trading_day(datetime.datetime(2020, 1, 10)) is None
+
+    assert calendar.previous_trading_day(sunday, inclusive=True) == friday
+    assert calendar.previous_trading_day(monday) == friday
+    assert calendar.previous_trading_day(datetime.datetime(2020, 1, 2)) is None
+    # The time part is ignored
+    assert calendar.previous_trading_day(datetime.datetime(2020, 1, 6, 15, 30), inclusive=True) == monday
+
+    assert calendar.trading_days(datetime.datetime(2020, 1, 1), sunday) == \
+        [datetime.datetime(2020, 1, 2), friday]
+    assert calendar.count(saturday, sunday) == 0
+
+
+def test_entry():
+    test_lookup()
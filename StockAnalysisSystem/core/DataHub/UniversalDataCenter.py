@@ -1,4 +1,10 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
 from .DataAgent import *
+from .QueryResultCache import QueryResultCache
+from .CollectorResponseCache import CollectorResponseCache
 from ..Utiltity.common import *
 from ..Utiltity.df_utility import *
 from ..Utiltity.time_utility import *
@@ -13,15 +19,34 @@ from ..Utiltity.plugin_manager import PluginManager
 # ----------------------------------------------------------------------------------------------------------------------
 
 class UniversalDataCenter:
+    # The max thread count for concurrent query (query_async and query_batch)
+    QUERY_WORKERS = 8
+    # The default max concurrent calls of each collector plugin
+    PLUGIN_CONCURRENCY = 2
+    # The trading days passed after the update range, before the missing daily data is confirmed empty
+    EMPTY_SETTLE_TRADE_DAYS = 1
+
     def __init__(self, database_entry: DatabaseEntry, collector_plugin: PluginManager):
         self.__database_entry = database_entry
         self.__plugin_manager = collector_plugin
 
+        self.__query_executor = None
+        self.__query_executor_lock = threading.Lock()
+        self.__query_cache = QueryResultCache()
+        self.__response_cache = None
+
+        # Plugin name -> max concurrent calls, and the semaphores created by these limits
+        self.__plugin_concurrency = {}
+        self.__plugin_semaphores = {}
+        self.__plugin_semaphore_lock = threading.Lock()
+
         # self.__data_source = []
         self.__factor_center = None
 
         self.__last_error = ''
         self.__data_agent = []
+        # uri -> agent, the cache of get_data_agent()
+        self.__uri_agent_dict = {}
         self.__field_uri_dict = {}
         self.__field_readable_dict = {}
         self.__readable_field_dict = {}
@@ -39,8 +64,12 @@ class UniversalDataCenter:
         return self.__data_agent
 
     def get_data_agent(self, uri: str) -> DataAgent or None:
+        agent = self.__uri_agent_dict.get(uri)
+        if agent is not None:
+            return agent
         for agent in self.__data_agent:
             if agent.adapt(uri):
+                self.__uri_agent_dict[uri] = agent
                 return agent
         return None
 
@@ -59,6 +88,39 @@ class UniversalDataCenter:
     def register_data_agent(self, agent: DataAgent):
         if agent not in self.__data_agent:
             self.__data_agent.append(agent)
+            self.__uri_agent_dict.clear()
+
+    def set_plugin_concurrency(self, limit: int, plugin: str = None):
+        """
+        Limit the concurrent calls to a collector plugin, for the endpoint which limits the connections or frequency.
+        :param limit: The max concurrent calls
+        :param plugin: The plugin (module) name. None to set the default limit of all plugins.
+        """
+        with self.__plugin_semaphore_lock:
+            self.__plugin_concurrency[plugin] = max(limit, 1)
+            # The new limit takes effect for the later calls
+            if plugin is None:
+                self.__plugin_semaphores.clear()
+            else:
+                self.__plugin_semaphores.pop(plugin, None)
+
+    def get_query_cache(self) -> QueryResultCache:
+        return self.__query_cache
+
+    def get_response_cache(self) -> CollectorResponseCache or None:
+        return self.__response_cache
+
+    def set_response_cache(self, response_cache: CollectorResponseCache or None):
+        """
+        Cache the responses of collector plugins. None to disable.
+        """
+        self.__response_cache = response_cache
+
+    def set_query_cache_budget(self, budget_bytes: int):
+        """
+        Set the max memory of cached query results. 0 to disable the cache.
+        """
+        self.__query_cache.set_budget(budget_bytes)
 
     # ------------------------------------------------ Data Management -------------------------------------------------
 
@@ -72,6 +134,84 @@ class UniversalDataCenter:
         #     result = self.query_from_plugin(uri, identity, time_serial, **extra)
         return result
 
+    async def query_async(self, uri: str, identity: str or [str] = None,
+                          time_serial: tuple = None, **extra) -> pd.DataFrame or None:
+        """
+        The awaitable version of query(). The query runs in the query thread pool,
+            so the queries gathered by asyncio overlap their database I/O.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__get_query_executor(),
+                                          functools.partial(self.query, uri, identity, time_serial, **extra))
+
+    def query_batch(self, queries: [tuple]) -> [pd.DataFrame or None]:
+        """
+        Execute multiple queries concurrently in the query thread pool. For the caller without event loop.
+        :param queries: The list of (uri, identity, time_serial, extra dict)
+        :return: The results in the same order of queries
+        """
+        if len(queries) == 0:
+            return []
+        if len(queries) == 1:
+            uri, identity, time_serial, extra = queries[0]
+            return [self.query(uri, identity, time_serial, **extra)]
+        executor = self.__get_query_executor()
+        futures = [executor.submit(self.query, uri, identity, time_serial, **extra)
+                   for uri, identity, time_serial, extra in queries]
+        return [future.result() for future in futures]
+
+    def query_iter(self, uri: str, identity: str or [str] = None,
+                   time_serial: tuple = None, chunk_rows: int = 50000, **extra):
+        """
+        The generator version of query(). Yields DataFrame chunks which are read from the database cursor,
+            so the whole result is never held in memory. The query result cache and local tier are not used.
+        :param chunk_rows: The max row count of each chunk
+        """
+        extra_param = extra.copy() if extra is not None else {}
+        agent = self.get_data_agent(uri)
+        if agent is None:
+            self.log_error('Cannot find data table for : ' + uri)
+            return
+        if not self.check_query_params(uri, identity, time_serial, **extra_param):
+            return
+
+        fields = extra_param.pop('fields', None)
+        readable = extra_param.pop('readable', False)
+        if fields is not None and readable:
+            fields = self.readable_to_fields(fields)
+        columns_mapping = None
+
+        for df in agent.query_iter(uri, identity, time_serial, extra_param, fields, chunk_rows):
+            if fields is not None:
+                df = df.reindex(columns=fields)
+                if readable:
+                    if columns_mapping is None:
+                        columns_mapping = self.field_map_readable(list(df.columns))
+                    df.rename(columns=columns_mapping, inplace=True)
+            yield df
+
+    def query_pivot(self, uri: str, identities: [str], field: str,
+                    time_serial: tuple = None, **extra) -> pd.DataFrame or None:
+        """
+        Query one field of multiple securities in wide format: datetime as index, identity as columns.
+        Only for the per-security daily data (DataAgentSecurityDaily).
+        """
+        agent = self.get_data_agent(uri)
+        if not isinstance(agent, DataAgentSecurityDaily):
+            self.log_error('Pivot query is not supported for : ' + uri)
+            return None
+        if not self.check_query_params(uri, identities, time_serial, **extra):
+            return None
+        fields = [agent.identity_field(), agent.datetime_field(), field]
+        return agent.query_batch(uri, identities, time_serial, extra, fields, pivot=field)
+
+    def __get_query_executor(self) -> ThreadPoolExecutor:
+        with self.__query_executor_lock:
+            if self.__query_executor is None:
+                self.__query_executor = ThreadPoolExecutor(max_workers=UniversalDataCenter.QUERY_WORKERS,
+                                                           thread_name_prefix='DataCenterQuery')
+            return self.__query_executor
+
     def query_from_local(self, uri: str, identity: str or [str] = None,
                          time_serial: tuple = None, **extra) -> pd.DataFrame or None:
         extra_param = extra.copy() if extra is not None else {}
@@ -93,10 +233,20 @@ class UniversalDataCenter:
         else:
             readable = False
 
+        cache_key = self.__query_cache_key(agent, uri, identity, time_serial, fields, readable, extra_param) \
+            if self.__query_cache.enabled() else None
+        if cache_key is not None:
+            result = self.__query_cache.get(cache_key)
+            if result is not None:
+                return result
+            cache_generation = self.__query_cache.generation(agent.base_uri())
+
         if fields is not None and readable:
             fields = self.readable_to_fields(fields)
 
-        result = agent.query(uri, identity, time_serial, extra_param, fields)
+        result = self.__query_from_local_tier(agent, uri, identity, time_serial, extra_param, fields)
+        if result is None:
+            result = agent.query(uri, identity, time_serial, extra_param, fields)
 
         if fields is not None:
             # Fill the missing columns
@@ -105,8 +255,54 @@ class UniversalDataCenter:
                 columns = list(result.columns)
                 columns_mapping = self.field_map_readable(columns)
                 result.rename(columns=columns_mapping, inplace=True)
+
+        if cache_key is not None:
+            self.__query_cache.put(cache_key, agent.base_uri(), cache_key[2], result, cache_generation)
         return result
 
+    @staticmethod
+    def __query_cache_key(agent: DataAgent, uri: str, identity: str or [str], time_serial: tuple,
+                          fields: [str] or None, readable: bool, extra: dict) -> tuple or None:
+        """
+        :return: (group, uri, identities, since, until, fields, readable, extra). None if it cannot be cached.
+            The identities is None if it queries all identities.
+        """
+        if isinstance(identity, (list, tuple)):
+            identities = tuple(sorted(set(identity)))
+        else:
+            identities = (identity, ) if str_available(identity) else None
+        since, until = normalize_time_serial(time_serial, None, None)
+        # noinspection PyBroadException
+        try:
+            extra_key = tuple(sorted((key, repr(value)) for key, value in extra.items()))
+        except Exception:
+            return None
+        finally:
+            pass
+        return agent.base_uri(), uri.lower(), identities, since, until, \
+            tuple(fields) if fields is not None else None, bool(readable), extra_key
+
+    def __invalidate_query_cache(self, agent: DataAgent, identity: str or [str],
+                                 data: pd.DataFrame or dict or [dict]):
+        identity_field = agent.identity_field()
+        if isinstance(data, dict):
+            data = [data]
+        if not str_available(identity_field):
+            identities = None
+        elif isinstance(data, pd.DataFrame):
+            identities = set(data[identity_field].dropna().unique()) if identity_field in data.columns else None
+        elif isinstance(data, (list, tuple)):
+            identities = set([record.get(identity_field) for record in data if isinstance(record, dict)])
+            identities = None if None in identities else identities
+        else:
+            identities = set()
+        if identities is not None:
+            if str_available(identity):
+                identities.add(identity)
+            elif isinstance(identity, (list, tuple)):
+                identities.update(identity)
+        self.__query_cache.invalidate(agent.base_uri(), identities)
+
     def query_from_plugin(self, uri: str, identity: str or [str] = None,
                           time_serial: tuple = None, **extra) -> pd.DataFrame or None:
         extra_param = extra.copy()
@@ -127,14 +323,69 @@ class UniversalDataCenter:
 
     def query_from_collector(self, uri: str, identity: str or [str] = None,
                              time_serial: tuple = None, **extra) -> pd.DataFrame or None:
+        return self.__query_collector(uri, identity, time_serial, **extra)[0]
+
+    def __fetch_for_update(self, uri: str, identity: str or [str],
+                           time_serial: tuple, **extra) -> (pd.DataFrame or None, bool):
+        """
+        :return: (The fetched data, True if the collector responded an empty result)
+        """
+        if not self.check_query_params(uri, identity, time_serial, **extra):
+            return None, False
+        if 'Factor' in uri:
+            return self.query_from_factor(uri, identity, time_serial, **extra), False
+        df, responded = self.__query_collector(uri, identity, time_serial, **extra)
+        return df, df is None and responded
+
+    def __query_collector(self, uri: str, identity: str or [str] = None,
+                          time_serial: tuple = None, **extra) -> (pd.DataFrame or None, bool):
+        """
+        :return: (The first non-empty result, True if any plugin responded a DataFrame even it's empty)
+        """
+        responded = False
         argv = self.pack_query_params(uri, identity, time_serial, **extra)
         plugins = self.get_plugin_manager().find_module_has_capacity(uri)
+        response_cache = self.__response_cache \
+            if self.__response_cache is not None and self.__response_cache.available() else None
+        ttl = self.__response_ttl(uri, time_serial) if response_cache is not None else None
         for plugin in plugins:
-            result = self.get_plugin_manager().execute_module_function(plugin, 'query', argv)
-            df = result[0] if len(result) > 0 else None
-            if df is not None and isinstance(df, pd.DataFrame) and len(df) > 0:
-                return df
-        return None
+            plugin_name = getattr(plugin, '__name__', str(plugin))
+            df = response_cache.load(plugin_name, uri, argv, ttl) if response_cache is not None else None
+            if df is None:
+                if response_cache is not None and response_cache.offline():
+                    continue
+                with self.__plugin_semaphore(plugin):
+                    result = self.get_plugin_manager().execute_module_function(plugin, 'query', argv)
+                df = result[0] if len(result) > 0 else None
+                if response_cache is not None and isinstance(df, pd.DataFrame) and len(df) > 0:
+                    response_cache.save(plugin_name, uri, argv, df)
+            if df is not None and isinstance(df, pd.DataFrame):
+                if len(df) > 0:
+                    return df, True
+                responded = True
+        return None, responded
+
+    def __response_ttl(self, uri: str, time_serial: tuple) -> int or None:
+        agent = self.get_data_agent(uri)
+        duration = agent.data_duration() if agent is not None else DATA_DURATION_AUTO
+        if duration == DATA_DURATION_DAILY:
+            duration_name = 'daily'
+        elif duration in [DATA_DURATION_QUARTER, DATA_DURATION_ANNUAL]:
+            duration_name = 'quarter'
+        else:
+            duration_name = ''
+        _, until = normalize_time_serial(time_serial)
+        return self.__response_cache.ttl_of(uri, duration_name, until)
+
+    def __plugin_semaphore(self, plugin: object) -> threading.BoundedSemaphore:
+        name = getattr(plugin, '__name__', str(plugin))
+        with self.__plugin_semaphore_lock:
+            semaphore = self.__plugin_semaphores.get(name)
+            if semaphore is None:
+                limit = self.__plugin_concurrency.get(name, self.__plugin_concurrency.get(
+                    None, UniversalDataCenter.PLUGIN_CONCURRENCY))
+                semaphore = self.__plugin_semaphores[name] = threading.BoundedSemaphore(limit)
+            return semaphore
 
     # -----------------------------------------------------------------------------------------
 
@@ -144,6 +395,11 @@ class UniversalDataCenter:
             return False
         clock = Clock()
         agent.merge2(uri, identity, data)
+        if isinstance(data, pd.DataFrame):
+            agent.update_range_index(uri, data)
+            agent.update_cross_section(uri, data)
+            self.__patch_local_tier(agent, uri, data)
+        self.__invalidate_query_cache(agent, identity, data)
         print('%s: [%s] - Persistence finished, time spending: %sms' % (uri, str(identity), clock.elapsed_ms()))
         return True
 
@@ -153,9 +409,12 @@ class UniversalDataCenter:
             self.build_local_data_patch(uri, identity, time_serial, force, **extra))
 
     def build_local_data_patch(self, uri: str, identity: str or [str] = None,
-                               time_serial: tuple = None, force: bool = False, **extra) -> tuple:
+                               time_serial: tuple = None, force: bool = False, refresh: bool = False,
+                               **extra) -> tuple:
         """
         Calculate update range and fetch from plug-in, then pack for local persistence.
+        :param refresh: The range is re-fetched on purpose (e.g. the planned range of a forced update).
+                        The existing data fetched is kept, not taken as "no newer data".
         """
         agent = self.get_data_agent(uri)
         checker = agent.get_field_checker() if agent is not None else None
@@ -176,7 +435,19 @@ class UniversalDataCenter:
         print('%s: [%s] -> Update range: %s - %s' % (uri, str(identity), date2text(since), date2text(until)))
 
         # ------------------------- Fetch -------------------------
-        result = self.query_from_plugin(uri, identity, (min(since, until), max(since, until)), **extra)
+        result, empty = self.__fetch_for_update(uri, identity, (min(since, until), max(since, until)), **extra)
+        if not empty and not force and not refresh and self.__no_newer_data(agent, uri, identity, result):
+            # The daily update starts from the end of local data (inclusive), so the last local bar always comes back.
+            # Nothing after it is the same as an empty response, but only if the data of until should be published.
+            if not self.__settled(until):
+                print('%s: [%s] - No newer data yet' % (uri, str(identity)))
+                return True, (uri, identity, since, until, agent), None
+            empty = True
+        if empty and str_available(identity):
+            # Confirmed no data (suspended, delisted or not reported yet). Record it to skip the next update.
+            print('%s: [%s] - No data in update range' % (uri, str(identity)))
+            self.get_update_table().mark_empty(uri.split('.') + [identity.replace('.', '_')], since, until)
+            return True, (uri, identity, since, until, agent), None
         if result is None or not isinstance(result, pd.DataFrame):
             self.log_error('Cannot fetch data from plugin for : ' + uri)
             return False, (uri, identity, since, until, agent), result
@@ -188,6 +459,72 @@ class UniversalDataCenter:
                 return False, (uri, identity, since, until, agent), result
         return True, (uri, identity, since, until, agent), result
 
+    @staticmethod
+    def __no_newer_data(agent: DataAgent, uri: str, identity: str, result: pd.DataFrame) -> bool:
+        """
+        :return: True if the daily data of identity fetched has no day after the end of local data
+        """
+        if not str_available(identity) or agent.data_duration() != DATA_DURATION_DAILY:
+            return False
+        datetime_field = agent.datetime_field()
+        if not isinstance(result, pd.DataFrame) or len(result) == 0 or datetime_field not in result.columns:
+            return False
+        _, local_until = agent.data_range(uri, identity)
+        if local_until is None:
+            return False
+        times = pd.to_datetime(result[datetime_field], errors='coerce')
+        return not (times.dt.normalize() > pd.Timestamp(local_until).normalize()).any()
+
+    @staticmethod
+    def __settled(until: datetime.datetime) -> bool:
+        """
+        :return: True if EMPTY_SETTLE_TRADE_DAYS trading days passed after until (include today)
+        """
+        begin, end = tomorrow_of(date2datetime(until.date())), today()
+        if begin > end:
+            return False
+        trade_calendar = DataAgentUtility.trade_calendar()
+        if trade_calendar is not None and trade_calendar.covers(begin) and trade_calendar.covers(end):
+            passed = trade_calendar.count(begin, end)
+        else:
+            passed = int(np.busday_count(np.datetime64(begin.date()), np.datetime64(tomorrow_of(end).date())))
+        return passed >= UniversalDataCenter.EMPTY_SETTLE_TRADE_DAYS
+
+    def build_market_data_patch(self, uri: str, trade_date: datetime.datetime,
+                                identities: [str] = None, **extra) -> tuple:
+        """
+        Fetch the data of all securities on one trade date, then pack for local persistence.
+        :param identities: Only keep the data of these identities. None to keep all.
+        """
+        agent = self.get_data_agent(uri)
+        checker = agent.get_field_checker() if agent is not None else None
+
+        if agent is None:
+            self.log_error('Cannot find data table for : ' + uri)
+            return False, (uri, None, trade_date, trade_date, agent), None
+        print('%s: [%s] -> Update trade date' % (uri, date2text(trade_date)))
+
+        # ------------------------- Fetch -------------------------
+        result, empty = self.__fetch_for_update(uri, None, (trade_date, trade_date), **extra)
+        if empty:
+            # No data on closed days. Nothing is recorded, so a trading day not published yet is fetched next time.
+            print('%s: [%s] - No data on this trade date' % (uri, date2text(trade_date)))
+            return True, (uri, None, trade_date, trade_date, agent), None
+        if result is None or not isinstance(result, pd.DataFrame):
+            self.log_error('Cannot fetch data from plugin for : %s [%s]' % (uri, date2text(trade_date)))
+            return False, (uri, None, trade_date, trade_date, agent), None
+        if identities is not None:
+            result = result[result[agent.identity_field()].isin(identities)]
+            if len(result) == 0:
+                return True, (uri, None, trade_date, trade_date, agent), None
+
+        # ------------------------- Check -------------------------
+        if checker is not None:
+            if not checker.check_dataframe(result):
+                self.log_error('Result format error: ' + uri)
+                return False, (uri, None, trade_date, trade_date, agent), result
+        return True, (uri, None, trade_date, trade_date, agent), result
+
     def apply_local_data_patch(self, patch: tuple) -> bool:
         """
         Merge and persistence the patch data.
@@ -208,6 +545,12 @@ class UniversalDataCenter:
         table.merge(uri, identity, result)
         print('%s: [%s] - Persistence finished, time spending: %sms' % (uri, str(identity), clock.elapsed_ms()))
 
+        table.update_range_index(uri, result)
+        table.update_cross_section(uri, result)
+        self.__patch_local_tier(table, uri, result)
+        # Invalidate last: A query before this may cache the result from the derived data not updated yet
+        self.__invalidate_query_cache(table, identity, result)
+
         # ----------------------- Update Table ----------------------
 
         # Cache the update range in Update Table
@@ -218,13 +561,67 @@ class UniversalDataCenter:
         self.get_update_table().update_update_range(update_tags, since, until)
 
         # 2.Update of each identity
-        if str_available(identity):
-            update_tags.append(identity.replace('.', '_'))
-            self.get_update_table().update_latest_update_time(update_tags)
-            self.get_update_table().update_update_range(update_tags, since, until)
+        for sub_identity in self.__identities_of_patch(table, identity, result):
+            identity_tags = update_tags + [sub_identity.replace('.', '_')]
+            self.get_update_table().update_latest_update_time(identity_tags)
+            self.get_update_table().update_update_range(identity_tags, since, until)
 
         return True
 
+    @staticmethod
+    def __identities_of_patch(agent: DataAgent, identity: str or None, result: pd.DataFrame) -> [str]:
+        """
+        The identities updated by the patch. The patch of a trade date (market wide) has no identity
+            but the data of all securities on that date.
+        """
+        if str_available(identity):
+            return [identity]
+        if not hasattr(agent, 'market_wide_available') or not agent.market_wide_available():
+            return []
+        identity_field = agent.identity_field()
+        if not isinstance(result, pd.DataFrame) or identity_field not in result.columns:
+            return []
+        return [_id for _id in result[identity_field].dropna().unique().tolist() if str_available(_id)]
+
+    # --------------------------------------------------- Local Tier ---------------------------------------------------
+
+    def __query_from_local_tier(self, agent: DataAgent, uri: str, identity: str or [str],
+                                time_serial: tuple, extra: dict, fields: list) -> pd.DataFrame or None:
+        local_tier = self.__database_entry.get_local_tier()
+        if local_tier is None or not agent.local_tier_available():
+            return None
+        if not str_available(identity) or len(extra) > 0:
+            return None
+        # Build the local file from the system of record (NoSql database) on the first read
+        if not local_tier.build(uri, identity, lambda: agent.query(uri, identity, None, {}, None)):
+            return None
+        df = local_tier.load(uri, identity)
+        if df is None:
+            return None
+        datetime_field = agent.datetime_field()
+        since, until = normalize_time_serial(time_serial)
+        if datetime_field in df.columns:
+            if since is not None:
+                df = df[df[datetime_field] >= since]
+            if until is not None:
+                df = df[df[datetime_field] <= until]
+        if fields is not None:
+            df = df[[field for field in fields if field in df.columns]]
+        return df.reset_index(drop=True)
+
+    def __patch_local_tier(self, agent: DataAgent, uri: str, patch: pd.DataFrame):
+        local_tier = self.__database_entry.get_local_tier()
+        if local_tier is None or not agent.local_tier_available() or not isinstance(patch, pd.DataFrame):
+            return
+        identity_field, datetime_field = agent.identity_field(), agent.datetime_field()
+        if identity_field not in patch.columns or datetime_field not in patch.columns:
+            return
+        patch = patch.copy()
+        patch[datetime_field] = pd.to_datetime(patch[datetime_field])
+        for identity, sub_patch in patch.groupby(identity_field):
+            # The missing file is not created here: a patch is not the full history. It's built on the first read.
+            local_tier.patch(uri, identity, sub_patch, agent.merge_on(), create=False)
+
     # ------------------------------------------------- Calc and Check -------------------------------------------------
 
     def calc_update_range(self, uri: str, identity: str or [str] = None,
@@ -242,6 +639,7 @@ class UniversalDataCenter:
 
         since, until = normalize_time_serial(time_serial, None, None)
         update_since, update_until = agent.update_range(uri, identity)
+        since_is_local = since is None and update_since is not None
 
         # Guess the update date time range
         # If the parameter user specified. Just use user specified.
@@ -260,8 +658,26 @@ class UniversalDataCenter:
                 until = update_until
             else:
                 until = today()
+        if agent.data_duration() == DATA_DURATION_DAILY:
+            since, until = self.__clip_to_trading_days(since, until, since_is_local)
         return since, until
 
+    @staticmethod
+    def __clip_to_trading_days(since: datetime.datetime, until: datetime.datetime,
+                               since_is_local: bool) -> (datetime.datetime, datetime.datetime):
+        """
+        Clip the until to the last trading day. If there's no trading day to fetch, return (until, until).
+        :param since_is_local: The since is the end of local data, which is already fetched.
+        """
+        trade_calendar = DataAgentUtility.trade_calendar()
+        if trade_calendar is None or not trade_calendar.covers(since) or not trade_calendar.covers(until):
+            return since, until
+        last_trading_day = trade_calendar.previous_trading_day(until, inclusive=True)
+        first_trading_day = trade_calendar.next_trading_day(since, inclusive=not since_is_local)
+        if last_trading_day is None or first_trading_day is None or first_trading_day > last_trading_day:
+            return until, until
+        return since, max(last_trading_day, since)
+
     def pack_query_params(self, uri: str, identity: str or [str], time_serial: tuple, **extra) -> dict:
         agent = self.get_data_agent(uri)
 
@@ -291,6 +707,9 @@ class UniversalDataCenter:
         checker = agent.get_field_checker() if agent is not None else None
 
         if checker is not None:
+            # The identities of batch query are the same type, check the first one as the declaration is for one
+            if isinstance(identity, (list, tuple)) and len(identity) > 0:
+                identity = identity[0]
             argv = self.pack_query_params(uri, identity, time_serial, **extra)
             if not checker.check_dict(argv):
                 self.log_error('Query format error: ' + uri)
@@ -366,12 +785,17 @@ class UniversalDataCenter:
             return
         field_probs = self.get_plugin_manager().execute_module_function(
             self.get_plugin_manager().all_modules(), 'fields', {}, False)
+        # Build in local then assign, the concurrent queries never see a partial mapping.
+        field_uri_dict, field_readable_dict, readable_field_dict = {}, {}, {}
         for field_prob in field_probs:
             for uri, field_declare in field_prob.items():
                 for field, readable in field_declare.items():
-                    self.__field_uri_dict[field] = uri
-                    self.__field_readable_dict[field] = readable
-                    self.__readable_field_dict[readable] = field
+                    field_uri_dict[field] = uri
+                    field_readable_dict[field] = readable
+                    readable_field_dict[readable] = field
+        self.__field_uri_dict = field_uri_dict
+        self.__field_readable_dict = field_readable_dict
+        self.__readable_field_dict = readable_field_dict
 
 
 
@@ -0,0 +1,342 @@
+import queue
+import threading
+import traceback
+
+from ..Utiltity.common import *
+from ..Utiltity.time_utility import *
+from .DataAgent import DataAgent
+from .UpdatePlanner import UpdatePlanner
+from .UniversalDataCenter import UniversalDataCenter
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                     UpdateEngine
+# Update the data of an agent for multiple identities. Headless, can be used by UI, script or service.
+#
+#   identities -> [planner] -> [fetch workers] -> bounded patch queue -> [persist workers] -> database
+#
+# The planner calculates the update ranges and drops the identities which do not need update.
+# The fetch workers build the patches from plugins. The concurrency of each plugin is also limited by the data center.
+# For the agent which can fetch by trade date, the incremental update fetches per trade date if it needs fewer fetches.
+# The persist workers apply the patches. The bounded queue blocks the fetch workers if persistence is slower.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class UpdateEngine:
+    FETCH_WORKERS = 4
+    PERSIST_WORKERS = 2
+    PATCH_QUEUE_SIZE = 20
+
+    # The timeout (s) of blocking queue operations, to check the quit flag periodically
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, data_center: UniversalDataCenter, data_utility=None,
+                 fetch_workers: int = FETCH_WORKERS, persist_workers: int = PERSIST_WORKERS,
+                 queue_size: int = PATCH_QUEUE_SIZE, planner: UpdatePlanner = None):
+        """
+        :param data_utility: The DataUtility to get the listing date of securities. None to skip this optimization.
+        :param planner: The planner of update ranges. None to use the UpdatePlanner with data_utility.
+        """
+        self.__data_center = data_center
+        self.__planner = planner if planner is not None else UpdatePlanner(data_center, data_utility)
+        self.__fetch_workers = max(fetch_workers, 1)
+        self.__persist_workers = max(persist_workers, 1)
+        self.__queue_size = max(queue_size, 1)
+
+        self.__quit = threading.Event()
+        self.__lock = threading.Lock()
+
+        self.__fetch_count = 0
+        self.__persist_count = 0
+        self.__fail_count = 0
+
+    def quit(self):
+        self.__quit.set()
+
+    def is_quit(self) -> bool:
+        return self.__quit.is_set()
+
+    def statistics(self) -> dict:
+        with self.__lock:
+            return {
+                'fetch': self.__fetch_count,
+                'persist': self.__persist_count,
+                'fail': self.__fail_count,
+            }
+
+    # ------------------------------------------------------------------------------------------
+
+    def update(self, agent: DataAgent, identities: [str] or str or None = None,
+               force: bool = False, progress: ProgressRate = None) -> bool:
+        """
+        Update the data of agent. Block until finished or quit.
+        :param agent: The data agent to update
+        :param identities: The identities to update. None to use the update list of agent.
+        :param force: Fetch data from the listing date (or default since) to now
+        :param progress: Report progress as [uri] (total) and [uri, identity] (per identity)
+        :return: True if all identities are processed. False if quit.
+        """
+        uri = agent.base_uri()
+        if isinstance(identities, str):
+            identities = [identities]
+        # Get identities here to ensure we can get the new list after stock info updated
+        update_list = identities if identities is not None and len(identities) > 0 else agent.update_list()
+        if update_list is None or len(update_list) == 0:
+            update_list = [None]
+
+        # Work item: (identity, None, time serial) fetches per identity,
+        #            (None, trade date, None) fetches all identities on the trade date
+        day_identities = None
+        if None in update_list:
+            work_items = [(identity, None, None) for identity in update_list]
+        else:
+            plan = self.__planner.plan(uri, update_list, force)
+            print('%s: Update plan - %s' % (uri, str(self.__planner.statistics())))
+            time_serials = dict(zip(plan['identity'], zip(plan['since'], plan['until'])))
+            work_items = [(identity, None, time_serials[identity]) for identity in plan['identity']]
+            if not force and len(time_serials) > 0 and hasattr(agent, 'plan_market_update'):
+                trade_dates, day_identities, per_identity = agent.plan_market_update(uri, list(time_serials.keys()))
+                if len(trade_dates) > 0:
+                    print('%s: Update %d identities by %d trade dates, %d identities one by one' %
+                          (uri, len(day_identities), len(trade_dates), len(per_identity)))
+                    work_items = [(identity, None, time_serials[identity]) for identity in per_identity] + \
+                                 [(None, trade_date, None) for trade_date in trade_dates]
+
+        with self.__lock:
+            self.__fetch_count = 0
+            self.__persist_count = 0
+            self.__fail_count = 0
+        if progress is not None:
+            progress.set_progress(uri, 0, len(work_items))
+
+        work_queue = queue.Queue()
+        for item in work_items:
+            work_queue.put(item)
+        patch_queue = queue.Queue(maxsize=self.__queue_size)
+
+        fetchers = [threading.Thread(target=self.__fetch_worker,
+                                     args=(uri, work_queue, patch_queue, force, day_identities),
+                                     name='UpdateFetch%d' % i, daemon=True) for i in range(self.__fetch_workers)]
+        persisters = [threading.Thread(target=self.__persist_worker, args=(uri, patch_queue, progress),
+                                       name='UpdatePersist%d' % i, daemon=True)
+                      for i in range(self.__persist_workers)]
+        # Coalesce the update records of this task and write them in batches
+        update_table = self.__data_center.get_update_table()
+        if update_table is not None:
+            update_table.begin_write_behind()
+        try:
+            for thread in fetchers + persisters:
+                thread.start()
+
+            for thread in fetchers:
+                thread.join()
+            # Fetch finished (or quit). Notify persist workers to exit after the queued patches are applied.
+            for _ in persisters:
+                patch_queue.put(None)
+            for thread in persisters:
+                thread.join()
+        finally:
+            if update_table is not None:
+                update_table.end_write_behind()
+
+        statistics = self.statistics()
+        print('%s: Update %s - fetched %d, persisted %d, failed %d' %
+              (uri, 'canceled' if self.is_quit() else 'finished',
+               statistics['fetch'], statistics['persist'], statistics['fail']))
+        return not self.is_quit()
+
+    # ------------------------------------------------------------------------------------------
+
+    def __fetch_worker(self, uri: str, work_queue: queue.Queue, patch_queue: queue.Queue,
+                       force: bool, day_identities: [str] or None):
+        while not self.is_quit():
+            try:
+                identity, trade_date, time_serial = work_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if trade_date is not None:
+                    patch = self.__data_center.build_market_data_patch(uri, trade_date, day_identities)
+                elif time_serial is not None:
+                    # The planned range, which has considered the force flag. A forced range re-fetches existing data.
+                    patch = self.__data_center.build_local_data_patch(uri, identity, time_serial,
+                                                                      force=False, refresh=force)
+                else:
+                    patch = self.__data_center.build_local_data_patch(uri, identity, None, force=force)
+            except Exception as e:
+                # e.g. "pymongo.errors.ServerSelectionTimeoutError: No servers found yet". Continue with others.
+                print('%s: [%s] - Fetch got exception: %s' %
+                      (uri, str(identity) if trade_date is None else date2text(trade_date), str(e)))
+                print(traceback.format_exc())
+                with self.__lock:
+                    self.__fail_count += 1
+                continue
+            with self.__lock:
+                self.__fetch_count += 1
+            # Block if persistence is slower, but keep checking the quit flag
+            while True:
+                try:
+                    patch_queue.put((identity, patch), timeout=UpdateEngine.POLL_INTERVAL)
+                    break
+                except queue.Full:
+                    if self.is_quit():
+                        return
+
+    def __persist_worker(self, uri: str, patch_queue: queue.Queue, progress: ProgressRate):
+        while True:
+            item = patch_queue.get()
+            if item is None:
+                break
+            identity, patch = item
+            try:
+                self.__data_center.apply_local_data_patch(patch)
+                with self.__lock:
+                    self.__persist_count += 1
+            except Exception as e:
+                print('%s: [%s] - Persistence got exception: %s' % (uri, str(identity), str(e)))
+                print(traceback.format_exc())
+                with self.__lock:
+                    self.__fail_count += 1
+            finally:
+                if progress is not None:
+                    with self.__lock:
+                        if identity is not None:
+                            progress.set_progress([uri, identity], 1, 1)
+                        progress.increase_progress(uri)
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+class __TestDataCenter:
+    def __init__(self, fail_identity: str = None):
+        self.fetched = []
+        self.applied = []
+        self.fail_identity = fail_identity
+        self.refreshed = []
+        self.lock = threading.Lock()
+
+    def get_update_table(self):
+        return None
+
+    def build_local_data_patch(self, uri: str, identity: str, time_serial: tuple, force: bool,
+                               refresh: bool = False) -> tuple:
+        if identity == self.fail_identity:
+            raise ValueError('Test fetch exception')
+        with self.lock:
+            self.fetched.append(identity)
+            if refresh:
+                self.refreshed.append(identity)
+        return True, (uri, identity, None, None, None), identity
+
+    def apply_local_data_patch(self, patch: tuple) -> bool:
+        with self.lock:
+            self.applied.append(patch[2])
+        return True
+
+
+    def build_market_data_patch(self, uri: str, trade_date: datetime.datetime, identities: [str]) -> tuple:
+        with self.lock:
+            self.fetched.append(trade_date)
+        return True, (uri, None, trade_date, trade_date, None), trade_date
+
+
+class __TestTableDataCenter(__TestDataCenter):
+    # Persist the patches into one table object, like the data agent does
+    def __init__(self, table):
+        super().__init__()
+        self.table = table
+
+    def apply_local_data_patch(self, patch: tuple) -> bool:
+        identity = patch[2]
+        for i in range(20):
+            self.table.bulk_upsert(identity, datetime.datetime(2020, 1, 1) + datetime.timedelta(days=i), {'value': i})
+        self.table.bulk_flush()
+        return True
+
+
+class __TestPlanner:
+    def __init__(self, up_to_date: [str] = None):
+        self.up_to_date = up_to_date if up_to_date is not None else []
+
+    def plan(self, uri: str, identities: [str], force: bool) -> pd.DataFrame:
+        identities = [identity for identity in identities if identity not in self.up_to_date]
+        return pd.DataFrame({'identity': identities, 'since': default_since(), 'until': now()})
+
+    def statistics(self) -> dict:
+        return {}
+
+
+class __TestAgent:
+    def base_uri(self) -> str:
+        return 'Test.Uri'
+
+    def update_list(self) -> [str]:
+        return ['%06d.SSE' % i for i in range(100)]
+
+
+class __TestMarketAgent(__TestAgent):
+    def plan_market_update(self, uri: str, identities: [str]) -> ([datetime.datetime], [str], [str]):
+        return [text2date('2020-01-02'), text2date('2020-01-03')], identities[2:], identities[:2]
+
+
+def test_update_all():
+    data_center = __TestDataCenter('000050.SSE')
+    engine = UpdateEngine(data_center, fetch_workers=4, persist_workers=2, queue_size=5,
+                          planner=__TestPlanner(['000099.SSE']))
+    progress = ProgressRate()
+
+    assert engine.update(__TestAgent(), None, False, progress)
+    # One is up to date, one fails
+    assert len(data_center.fetched) == 98 and sorted(data_center.applied) == sorted(data_center.fetched)
+    assert '000099.SSE' not in data_center.fetched
+    assert engine.statistics() == {'fetch': 98, 'persist': 98, 'fail': 1}
+    assert progress.get_progress_rate('Test.Uri') == 98 / 99
+    assert progress.get_progress_rate(['Test.Uri', '000001.SSE']) == 1
+
+
+def test_quit():
+    data_center = __TestDataCenter()
+    engine = UpdateEngine(data_center, fetch_workers=2, persist_workers=1, queue_size=1, planner=__TestPlanner())
+    engine.quit()
+    assert not engine.update(__TestAgent(), ['000001.SSE', '000002.SSE'])
+    assert len(data_center.applied) == 0
+
+
+def test_market_update():
+    data_center = __TestDataCenter()
+    engine = UpdateEngine(data_center, fetch_workers=2, persist_workers=1, planner=__TestPlanner())
+    progress = ProgressRate()
+
+    assert engine.update(__TestMarketAgent(), None, False, progress)
+    assert sorted(data_center.applied, key=str) == \
+        sorted(['000000.SSE', '000001.SSE', text2date('2020-01-02'), text2date('2020-01-03')], key=str)
+    assert progress.get_progress_rate('Test.Uri') == 1
+
+    # Force update fetches per identity
+    data_center = __TestDataCenter()
+    engine = UpdateEngine(data_center, fetch_workers=2, persist_workers=1, planner=__TestPlanner())
+    assert engine.update(__TestMarketAgent(), None, True)
+    assert len(data_center.applied) == 100
+    # The forced ranges re-fetch the existing data
+    assert len(data_center.refreshed) == 100
+
+
+def test_persist_same_table():
+    import tempfile
+    from ..Database.SqliteItkvTable import SqliteClient, SqliteItkvTable
+    client = SqliteClient(tempfile.mkdtemp())
+    table = SqliteItkvTable(client, 'TestDatabase', 'TestTable')
+    try:
+        data_center = __TestTableDataCenter(table)
+        engine = UpdateEngine(data_center, fetch_workers=4, persist_workers=2, planner=__TestPlanner())
+        assert engine.update(__TestAgent(), None)
+        # 100 identities x 20 records, none is lost by the concurrent persistence
+        assert table.count() == 2000
+    finally:
+        client.close()
+
+
+def test_entry():
+    test_update_all()
+    test_quit()
+    test_market_update()
+    test_persist_same_table()
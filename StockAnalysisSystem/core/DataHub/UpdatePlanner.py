@@ -0,0 +1,262 @@
+from ..Utiltity.common import *
+from ..Utiltity.time_utility import *
+from .DataAgent import DataAgent, DataAgentUtility, DATA_DURATION_DAILY, DATA_DURATION_QUARTER, DATA_DURATION_ANNUAL
+from .UniversalDataCenter import UniversalDataCenter
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                    UpdatePlanner
+# Calculate the update ranges of all identities of an uri in one pass, before any network work starts.
+#
+#   local ranges    : one range index lookup of the agent
+#   update table    : one bulk read of the last update time
+#   listing date    : one query of the securities info
+#
+# The identities which are already up to date or delisted are dropped from the plan.
+# So are the identities confirmed empty by collector (see UpdateTableEx.mark_empty()) for the whole planned range
+#   and not expired:
+#   the empty mark of a delisted security never expires, others expire by EMPTY_MARK_TTL of data duration.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class UpdatePlanner:
+    PLAN_COLUMNS = ['identity', 'since', 'until']
+
+    # The time (s) to trust the empty mark: data duration -> ttl
+    EMPTY_MARK_TTL = {
+        DATA_DURATION_DAILY: 7 * 24 * 3600,
+        DATA_DURATION_QUARTER: 30 * 24 * 3600,
+        DATA_DURATION_ANNUAL: 90 * 24 * 3600,
+        None: 24 * 3600,
+    }
+
+    def __init__(self, data_center: UniversalDataCenter, data_utility=None):
+        """
+        :param data_utility: The DataUtility to get the listing and delisting date. None to skip this optimization.
+        """
+        self.__data_center = data_center
+        self.__data_utility = data_utility
+        self.__statistics = {}
+
+    def statistics(self) -> dict:
+        """
+        :return: The identity count of the last plan - 'update', 'up_to_date', 'delisted', 'empty'
+        """
+        return self.__statistics.copy()
+
+    def plan(self, uri: str, identities: [str] = None, force: bool = False,
+             until: datetime.datetime = None) -> pd.DataFrame:
+        """
+        Plan the update of identities.
+        :param identities: The identities to update. None to use the update list of agent.
+        :param force: Update from the listing date (or default since) to now
+        :param until: The end of update range. None to use the reference range of agent or today.
+        :return: DataFrame with columns: identity, since, until. Only the identities need update are included.
+        """
+        agent = self.__data_center.get_data_agent(uri)
+        if agent is None:
+            self.__data_center.log_error('Cannot find data table for : ' + uri)
+            return pd.DataFrame(columns=UpdatePlanner.PLAN_COLUMNS)
+        if identities is None:
+            identities = agent.update_list()
+        identities = list(dict.fromkeys([identity for identity in identities if str_available(identity)]))
+        if len(identities) == 0:
+            self.__statistics = {'update': 0, 'up_to_date': 0, 'delisted': 0, 'empty': 0}
+            return pd.DataFrame(columns=UpdatePlanner.PLAN_COLUMNS)
+
+        plan = pd.DataFrame({'identity': identities})
+        life_time = self.__life_time(plan['identity'])
+        listing_date = life_time['listing_date'].fillna(default_since())
+
+        if force:
+            plan['since'] = listing_date
+            plan['until'] = now()
+            self.__statistics = {'update': len(plan), 'up_to_date': 0, 'delisted': 0, 'empty': 0}
+            return plan
+
+        # ----------------------- Since -----------------------
+        # The end of local data, or the last update time, or the market start. Not earlier than listing date.
+
+        ranges = agent.data_ranges(uri, identities)
+        local_until = pd.to_datetime(pd.Series([ranges[identity][1] for identity in identities]), errors='coerce')
+
+        update_table = self.__data_center.get_update_table()
+        uri_tags = uri.split('.')
+        tags_list = [uri_tags + [identity.replace('.', '_')] for identity in identities]
+        last_update = update_table.get_last_update_times(tags_list)
+        last_update = pd.to_datetime(pd.Series(
+            [last_update.get(update_table.normalize_tags(tags)) for tags in tags_list], dtype=object), errors='coerce')
+
+        since = local_until.fillna(last_update).fillna(DataAgentUtility.a_share_market_start())
+        plan['since'] = np.maximum(since, listing_date)
+
+        # ----------------------- Until -----------------------
+
+        if until is not None:
+            plan['until'] = to_py_datetime(until)
+        else:
+            ref_until = [agent.ref_range(uri, identity)[1] for identity in identities]
+            plan['until'] = pd.to_datetime(pd.Series(ref_until, dtype=object), errors='coerce').fillna(today())
+
+        # ------------------------ Drop ------------------------
+
+        up_to_date = plan['since'].dt.normalize() >= plan['until'].dt.normalize()
+        delisted = life_time['delisting_date'].notna() & (plan['since'] >= life_time['delisting_date']) & ~up_to_date
+        empty = self.__confirmed_empty(agent, update_table, tags_list, plan['since'], plan['until'],
+                                       life_time['delisting_date']) & ~up_to_date & ~delisted
+        self.__statistics = {
+            'update': int((~up_to_date & ~delisted & ~empty).sum()),
+            'up_to_date': int(up_to_date.sum()),
+            'delisted': int(delisted.sum()),
+            'empty': int(empty.sum()),
+        }
+        return plan[~up_to_date & ~delisted & ~empty].reset_index(drop=True)
+
+    # ------------------------------------------------------------------------------------------
+
+    def __confirmed_empty(self, agent: DataAgent, update_table, tags_list: [[str]],
+                          since: pd.Series, until: pd.Series, delisting_date: pd.Series) -> pd.Series:
+        """
+        :return: True if the range from since to until is covered by an empty mark which is not expired or outdated.
+                    The mark of a delisted security which covers the delisting date covers any later until.
+        """
+        marks = update_table.get_empty_marks(tags_list)
+        empty = pd.Series(False, index=since.index)
+        if len(marks) == 0:
+            return empty
+        ttl = UpdatePlanner.EMPTY_MARK_TTL.get(agent.data_duration(), UpdatePlanner.EMPTY_MARK_TTL[None])
+        current = now()
+        for i, tags in enumerate(tags_list):
+            mark = marks.get(update_table.normalize_tags(tags))
+            if mark is None or mark['empty_since'] is None or mark['empty_until'] is None:
+                continue
+            if mark['last_update'] is not None and mark['last_update'] > mark['empty_at']:
+                # New data came after the mark
+                continue
+            delisted = pd.notna(delisting_date.iloc[i])
+            if not delisted and (current - mark['empty_at']).total_seconds() > ttl:
+                continue
+            empty_until = pd.Timestamp(mark['empty_until']).normalize()
+            covers_until = empty_until >= pd.Timestamp(until.iloc[i]).normalize() or \
+                (delisted and empty_until >= pd.Timestamp(delisting_date.iloc[i]).normalize())
+            empty.iloc[i] = covers_until and \
+                pd.Timestamp(mark['empty_since']).normalize() <= since.iloc[i].normalize()
+        return empty
+
+    def __life_time(self, identities: pd.Series) -> pd.DataFrame:
+        life_time = self.__data_utility.get_securities_life_time() if self.__data_utility is not None else None
+        if life_time is None or len(life_time) == 0:
+            return pd.DataFrame({'listing_date': pd.Series(pd.NaT, index=identities.index),
+                                 'delisting_date': pd.Series(pd.NaT, index=identities.index)})
+        life_time = life_time.set_index('identity')
+        return pd.DataFrame({
+            'listing_date': identities.map(life_time['listing_date']),
+            'delisting_date': identities.map(life_time['delisting_date']),
+        })
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def __build_test_planner(life_time: pd.DataFrame = None) -> (UpdatePlanner, DataAgent):
+    import tempfile
+    from ..Database.DatabaseEntry import DatabaseEntry
+    from ..Utiltity.plugin_manager import PluginManager
+    from .DataAgent import DataAgentSecurityDaily
+
+    class TestDataUtility:
+        def get_securities_life_time(self) -> pd.DataFrame:
+            return life_time
+
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, PluginManager())
+    agent = DataAgentSecurityDaily(uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+                                   identity_field='stock_identity', datetime_field='trade_date')
+    data_center.register_data_agent(agent)
+    return UpdatePlanner(data_center, TestDataUtility() if life_time is not None else None), agent
+
+
+def test_plan():
+    life_time = pd.DataFrame({
+        'identity': ['000001.SZSE', '000002.SZSE', '000003.SZSE', '000004.SZSE'],
+        'listing_date': pd.to_datetime(['1991-04-03', '1991-01-29', '2019-12-01', '2000-01-01']),
+        'delisting_date': pd.to_datetime([None, None, None, '2019-12-31']),
+    })
+    planner, agent = __build_test_planner(life_time)
+    for identity, last_date in [('000001.SZSE', '2020-01-03'), ('000002.SZSE', '2020-01-08'),
+                                ('000004.SZSE', '2019-12-31')]:
+        agent.merge('Test.Daily', identity, pd.DataFrame({'stock_identity': [identity],
+                                                          'trade_date': pd.to_datetime([last_date])}))
+
+    plan = planner.plan('Test.Daily', ['000001.SZSE', '000002.SZSE', '000003.SZSE', '000004.SZSE'],
+                        until=datetime.datetime(2020, 1, 8))
+    assert plan['identity'].tolist() == ['000001.SZSE', '000003.SZSE']
+    # From the end of local data, or from the listing date if no local data
+    assert plan['since'].tolist() == [pd.Timestamp('2020-01-03'), pd.Timestamp('2019-12-01')]
+    assert planner.statistics() == {'update': 2, 'up_to_date': 1, 'delisted': 1, 'empty': 0}
+
+    plan = planner.plan('Test.Daily', ['000001.SZSE', '000004.SZSE'], force=True)
+    assert plan['since'].tolist() == [pd.Timestamp('1991-04-03'), pd.Timestamp('2000-01-01')]
+
+
+def test_plan_empty():
+    life_time = pd.DataFrame({
+        'identity': ['000001.SZSE', '000002.SZSE', '000003.SZSE'],
+        'listing_date': pd.to_datetime(['1991-04-03', '1991-01-29', '2000-01-01']),
+        'delisting_date': pd.to_datetime([None, None, '2020-06-30']),
+    })
+    planner, agent = __build_test_planner(life_time)
+    identities = ['000001.SZSE', '000002.SZSE', '000003.SZSE']
+    for identity in identities:
+        agent.merge('Test.Daily', identity, pd.DataFrame({'stock_identity': [identity],
+                                                          'trade_date': pd.to_datetime(['2020-01-03'])}))
+    update_table = agent.database_entry().get_update_table()
+    # Suspended and delisted: collector responded empty
+    update_table.mark_empty(['Test', 'Daily', '000001_SZSE'], datetime.datetime(2020, 1, 3),
+                            datetime.datetime(2020, 1, 10))
+    update_table.mark_empty(['Test', 'Daily', '000003_SZSE'], datetime.datetime(2020, 1, 3),
+                            datetime.datetime(2020, 7, 1))
+
+    plan = planner.plan('Test.Daily', identities, until=datetime.datetime(2020, 1, 10))
+    assert plan['identity'].tolist() == ['000002.SZSE']
+    assert planner.statistics() == {'update': 1, 'up_to_date': 0, 'delisted': 0, 'empty': 2}
+
+    # The mark only covers the range it confirmed. The mark of delisted one covers the delisting date.
+    plan = planner.plan('Test.Daily', identities, until=datetime.datetime(2020, 1, 13))
+    assert plan['identity'].tolist() == ['000001.SZSE', '000002.SZSE']
+    update_table.mark_empty(['Test', 'Daily', '000001_SZSE'], datetime.datetime(2020, 1, 3),
+                            datetime.datetime(2020, 1, 8))
+    plan = planner.plan('Test.Daily', identities, until=datetime.datetime(2020, 1, 10))
+    assert plan['identity'].tolist() == ['000001.SZSE', '000002.SZSE']
+    update_table.mark_empty(['Test', 'Daily', '000001_SZSE'], datetime.datetime(2020, 1, 3),
+                            datetime.datetime(2020, 1, 10))
+
+    # Expired, except the delisted one
+    ttl = UpdatePlanner.EMPTY_MARK_TTL[DATA_DURATION_DAILY]
+    UpdatePlanner.EMPTY_MARK_TTL[DATA_DURATION_DAILY] = -1
+    try:
+        plan = planner.plan('Test.Daily', identities, until=datetime.datetime(2020, 1, 10))
+    finally:
+        UpdatePlanner.EMPTY_MARK_TTL[DATA_DURATION_DAILY] = ttl
+    assert plan['identity'].tolist() == ['000001.SZSE', '000002.SZSE']
+
+    # Outdated by new data
+    update_table.update_latest_update_time(['Test', 'Daily', '000001_SZSE'])
+    plan = planner.plan('Test.Daily', identities, until=datetime.datetime(2020, 1, 10))
+    assert plan['identity'].tolist() == ['000001.SZSE', '000002.SZSE']
+
+
+def test_plan_performance():
+    planner, agent = __build_test_planner()
+    identities = ['%06d.SZSE' % i for i in range(5000)]
+    agent.merge('Test.Daily', None, pd.DataFrame({'stock_identity': identities[:2500],
+                                                  'trade_date': pd.Timestamp('2020-01-03')}))
+    clock = Clock()
+    plan = planner.plan('Test.Daily', identities, until=datetime.datetime(2020, 1, 8))
+    print('Plan for %d identities time spending: %sms' % (len(identities), clock.elapsed_ms()))
+    assert len(plan) == 5000
+
+
+def test_entry():
+    test_plan()
+    test_plan_empty()
+    test_plan_performance()
@@ -0,0 +1,509 @@
+import threading
+import pandas as pd
+from datetime import datetime
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReplaceOne, DeleteOne
+
+from .NoSqlRw import ItkvTable, str_available, text_auto_time, documents_to_dataframe, documents_to_dataframes
+
+
+BUCKET_MONTH = 'month'
+BUCKET_YEAR = 'year'
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                   BucketItkvTable
+# The ItkvTable with bucketed time-series layout.
+# All identities are stored in one collection. One document holds one identity-month or identity-year:
+#   {
+#       <identity_field>: identity,
+#       'bucket': The start datetime of this bucket,
+#       'since': The first datetime in this bucket,
+#       'until': The last datetime in this bucket,
+#       'count': The row count of this bucket,
+#       'columns': {<datetime_field>: [datetime, ...], <field>: [value, ...], ...}     # Parallel arrays
+#   }
+# The rows are sorted by datetime and the missing value is None.
+# The update is in bucket granularity: read the buckets, merge the rows, replace the buckets.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class BucketItkvTable:
+    def __init__(self, client: MongoClient, database: str, table: str,
+                 identity_field: str = 'Identity', datetime_field: str = 'DateTime', bucket: str = BUCKET_YEAR):
+        self.__client = client
+        self.__database = database
+        self.__table = table
+        self.__identity_field = identity_field
+        self.__datetime_field = datetime_field
+        self.__bucket = bucket
+        self.__index_checked = False
+        # (identity, bucket) -> {datetime: row}
+        self.__bulk_rows = {}
+        self.__bulk_count = 0
+        # The bulk buffer is shared by threads. Serialize the buffering and the flush (a read-merge-write here).
+        self.__bulk_lock = threading.RLock()
+
+    def identity_field(self) -> str or None:
+        return self.__identity_field
+
+    def datetime_field(self) -> str or None:
+        return self.__datetime_field
+
+    def bucket_of(self, time: datetime) -> datetime:
+        return datetime(time.year, 1, 1) if self.__bucket == BUCKET_YEAR else datetime(time.year, time.month, 1)
+
+    # ---------------------------------- Compatible with ItkvTable ----------------------------------
+
+    def set_key_uniqueness(self, unique: bool):
+        # The (identity, datetime) is always unique in bucket layout
+        pass
+
+    def set_unique_index(self, extra_keys: list = None):
+        # The (identity, bucket) index is always unique
+        pass
+
+    def set_connection_threshold(self, threshold: int):
+        pass
+
+    # -----------------------------------------------------------------
+
+    def drop(self):
+        collection = self.__get_collection()
+        if collection is None:
+            return
+        collection.drop()
+        self.__index_checked = False
+
+    def count(self) -> int:
+        collection = self.__get_collection()
+        if collection is None:
+            return 0
+        result = list(collection.aggregate([{'$group': {'_id': None, 'count': {'$sum': '$count'}}}]))
+        return result[0]['count'] if len(result) > 0 else 0
+
+    def bucket_count(self) -> int:
+        collection = self.__get_collection()
+        return collection.count_documents({}) if collection is not None else 0
+
+    # ------------------------------------------------ Bulk Operations -------------------------------------------------
+
+    def bulk_upsert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None):
+        with self.__bulk_lock:
+            if isinstance(time, str):
+                time = text_auto_time(time)
+            if time is None:
+                print('BucketItkvTable: The record without datetime is not supported.')
+                return
+            rows = self.__bulk_rows.setdefault((identity, self.bucket_of(time)), {})
+            row = rows.setdefault(time, {})
+            row.update(data)
+            if extra_spec is not None:
+                row.update(extra_spec)
+            self.__bulk_count += 1
+            if self.__bulk_count > 5000:
+                self.bulk_flush()
+
+    def bulk_insert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None):
+        # Insert is the same as upsert because the update is in bucket granularity.
+        self.bulk_upsert(identity, time, data, extra_spec)
+
+    def bulk_flush(self) -> dict or None:
+        with self.__bulk_lock:
+            collection = self.__get_collection()
+            if collection is None or len(self.__bulk_rows) == 0:
+                self.__bulk_rows.clear()
+                self.__bulk_count = 0
+                return None
+            bulk_rows = self.__bulk_rows
+            self.__bulk_rows = {}
+            self.__bulk_count = 0
+
+            identities = list(set([identity for identity, _ in bulk_rows.keys()]))
+            buckets = list(set([bucket for _, bucket in bulk_rows.keys()]))
+            spec = {'bucket': {'$in': buckets}}
+            if str_available(self.__identity_field):
+                spec[self.__identity_field] = {'$in': identities}
+            exists = {(document.get(self.__identity_field), document['bucket']): document
+                      for document in collection.find(spec)}
+
+            operations = []
+            for (identity, bucket), rows in bulk_rows.items():
+                document = exists.get((identity, bucket))
+                merged = self.__unpack_rows(document) if document is not None else {}
+                for time, row in rows.items():
+                    merged.setdefault(time, {}).update(row)
+                operations.append(ReplaceOne(self.__bucket_spec(identity, bucket),
+                                             self.__pack_rows(identity, bucket, merged), upsert=True))
+            try:
+                ret = collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                ret = None
+                print('BucketItkvTable.bulk_flush() fail: ')
+                print(e)
+            finally:
+                pass
+            return ret
+
+    # ----------------------------------------------- Single Operations ------------------------------------------------
+
+    def upsert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None) -> dict or None:
+        self.bulk_upsert(identity, time, data, extra_spec)
+        return self.bulk_flush()
+
+    def delete(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+               extra_spec: dict = None, keys: list = None):
+        collection = self.__get_collection()
+        if collection is None:
+            return False
+        since, until = self.__normalize_range(since, until)
+
+        operations = []
+        for document in collection.find(self.__gen_bucket_spec(identity, since, until)):
+            identity_value = document.get(self.__identity_field)
+            rows = {}
+            for time, row in self.__unpack_rows(document).items():
+                if self.__row_match(time, row, since, until, extra_spec):
+                    if keys is None:
+                        continue
+                    for key in keys:
+                        row.pop(key, None)
+                rows[time] = row
+            spec = self.__bucket_spec(identity_value, document['bucket'])
+            if len(rows) == 0:
+                operations.append(DeleteOne(spec))
+            else:
+                operations.append(ReplaceOne(spec, self.__pack_rows(identity_value, document['bucket'], rows)))
+        return collection.bulk_write(operations) if len(operations) > 0 else None
+
+    def query(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+              extra_spec: dict = None, keys: list = None) -> list:
+        """ Query records. The same as ItkvTable.query() except that there's no '_id' in the result. """
+        return list(self.__iter_rows(identity, since, until, extra_spec, keys))
+
+    def query_dataframe(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+                       extra_spec: dict = None, keys: list = None, dtypes: dict = None,
+                       with_id: bool = False, batch_size: int = 5000) -> pd.DataFrame:
+        """ Query records as DataFrame. Use the parallel arrays directly if there's no extra_spec. """
+        if extra_spec is not None and len(extra_spec) > 0:
+            return documents_to_dataframe(self.__iter_rows(identity, since, until, extra_spec, keys), keys, dtypes)
+        frames = list(self.__iter_bucket_frames(identity, since, until, keys, batch_size))
+        if len(frames) == 0:
+            return pd.DataFrame()
+        return self.__typed_frame(pd.concat(frames, ignore_index=True, sort=False), keys, dtypes)
+
+    def query_iter(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+                   extra_spec: dict = None, keys: list = None, dtypes: dict = None,
+                   with_id: bool = False, chunk_rows: int = 5000):
+        """ The same as ItkvTable.query_iter(). The buckets are combined until the chunk reaches chunk_rows. """
+        if extra_spec is not None and len(extra_spec) > 0:
+            yield from documents_to_dataframes(self.__iter_rows(identity, since, until, extra_spec, keys),
+                                               chunk_rows, keys, dtypes)
+            return
+        frames, rows = [], 0
+        for df in self.__iter_bucket_frames(identity, since, until, keys, max(chunk_rows // 100, 10)):
+            frames.append(df)
+            rows += len(df)
+            if rows >= chunk_rows:
+                yield self.__typed_frame(pd.concat(frames, ignore_index=True, sort=False), keys, dtypes)
+                frames, rows = [], 0
+        if len(frames) > 0:
+            yield self.__typed_frame(pd.concat(frames, ignore_index=True, sort=False), keys, dtypes)
+
+    def min_of(self, field: str, identity: str = None) -> any:
+        return self.__extreme_of(field, identity, True)
+
+    def max_of(self, field: str, identity: str = None) -> any:
+        return self.__extreme_of(field, identity, False)
+
+    def ranges_of(self, field: str = None, identity: str or [str] = None) -> dict:
+        """
+        The same as ItkvTable.ranges_of(). Only the datetime field is supported, which is served by bucket header.
+        """
+        collection = self.__get_collection()
+        if collection is None or (str_available(field) and field != self.__datetime_field):
+            return {}
+        group_by = ('$' + self.__identity_field) if str_available(self.__identity_field) else None
+        pipeline = [{'$group': {'_id': group_by,
+                                'min': {'$min': '$since'},
+                                'max': {'$max': '$until'},
+                                'count': {'$sum': '$count'}}}]
+        if identity is not None and str_available(self.__identity_field):
+            identities = list(identity) if isinstance(identity, (list, tuple)) else [identity]
+            pipeline.insert(0, {'$match': {self.__identity_field: {'$in': identities}}})
+        result = collection.aggregate(pipeline, allowDiskUse=True)
+        return {record['_id']: (record.get('min'), record.get('max'), record.get('count', 0)) for record in result}
+
+    def get_all_keys(self) -> [str]:
+        collection = self.__get_collection()
+        if collection is None:
+            return []
+        result = collection.aggregate([
+            {'$project': {'kv': {'$objectToArray': '$columns'}}},
+            {'$unwind': '$kv'},
+            {'$group': {'_id': '$kv.k'}},
+        ])
+        keys = [record['_id'] for record in result]
+        if str_available(self.__identity_field):
+            keys.append(self.__identity_field)
+        return sorted(set(keys))
+
+    def get_distinct_values(self, field: str) -> [str]:
+        collection = self.__get_collection()
+        if collection is None:
+            return []
+        if field == self.__identity_field:
+            return collection.distinct(field)
+        # Distinct on array field returns the distinct elements
+        return collection.distinct('columns.' + field)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __get_collection(self):
+        if self.__client is None:
+            return None
+        collection = self.__client[self.__database][self.__table]
+        if not self.__index_checked:
+            index = [('bucket', ASCENDING)]
+            if str_available(self.__identity_field):
+                index.insert(0, (self.__identity_field, ASCENDING))
+            collection.create_index(index, unique=True, background=True)
+            collection.create_index([('until', ASCENDING)], background=True)
+            self.__index_checked = True
+        return collection
+
+    def __bucket_spec(self, identity: str, bucket: datetime) -> dict:
+        spec = {'bucket': bucket}
+        if str_available(self.__identity_field):
+            spec[self.__identity_field] = identity
+        return spec
+
+    def __gen_bucket_spec(self, identity: str or list, since: datetime, until: datetime) -> dict:
+        spec = {}
+        if str_available(self.__identity_field):
+            if str_available(identity):
+                spec[self.__identity_field] = identity
+            elif isinstance(identity, (list, tuple)):
+                spec[self.__identity_field] = {'$in': list(identity)}
+        # The bucket overlaps with [since, until]
+        if since is not None:
+            spec['until'] = {'$gte': since}
+        if until is not None:
+            spec['since'] = {'$lte': until}
+        return spec
+
+    def __gen_key_select(self, keys: list or None) -> dict or None:
+        key_select = {'_id': 0}
+        if keys is not None:
+            key_select[self.__identity_field] = 1
+            key_select['columns.' + self.__datetime_field] = 1
+            for key in keys:
+                if key != self.__identity_field:
+                    key_select['columns.' + key] = 1
+        return key_select
+
+    def __iter_bucket_frames(self, identity: str or list, since: datetime or str, until: datetime or str,
+                             keys: list, batch_size: int):
+        """ Yield the rows of each bucket as DataFrame """
+        collection = self.__get_collection()
+        if collection is None:
+            return
+        since, until = self.__normalize_range(since, until)
+        cursor = collection.find(self.__gen_bucket_spec(identity, since, until),
+                                 self.__gen_key_select(keys), batch_size=batch_size).sort('since', ASCENDING)
+        for document in cursor:
+            df = pd.DataFrame(document.get('columns', {}))
+            if len(df) == 0:
+                continue
+            if str_available(self.__identity_field):
+                df[self.__identity_field] = document.get(self.__identity_field)
+            if since is not None or until is not None:
+                times = pd.to_datetime(df[self.__datetime_field])
+                df = df[((times >= since) if since is not None else True) &
+                        ((times <= until) if until is not None else True)]
+            yield df
+
+    @staticmethod
+    def __typed_frame(df: pd.DataFrame, keys: list, dtypes: dict) -> pd.DataFrame:
+        columns = [key for key in keys if key in df.columns] if keys is not None else list(df.columns)
+        df = df[columns]
+        for field, dtype in (dtypes or {}).items():
+            if field in df.columns:
+                # noinspection PyBroadException
+                try:
+                    df[field] = df[field].astype(dtype)
+                except Exception:
+                    pass
+        return df
+
+    def __iter_rows(self, identity: str or list, since: datetime or str, until: datetime or str,
+                    extra_spec: dict, keys: list):
+        collection = self.__get_collection()
+        if collection is None:
+            return
+        since, until = self.__normalize_range(since, until)
+        cursor = collection.find(self.__gen_bucket_spec(identity, since, until)).sort('since', ASCENDING)
+        for document in cursor:
+            identity_value = document.get(self.__identity_field)
+            for time, row in self.__unpack_rows(document).items():
+                if not self.__row_match(time, row, since, until, extra_spec):
+                    continue
+                record = {}
+                if str_available(self.__identity_field):
+                    record[self.__identity_field] = identity_value
+                record[self.__datetime_field] = time
+                record.update(row)
+                if keys is not None:
+                    record = {key: record[key] for key in keys if key in record}
+                yield record
+
+    def __extreme_of(self, field: str, identity: str, minimum: bool) -> any:
+        collection = self.__get_collection()
+        if collection is None:
+            return None
+        spec = self.__gen_bucket_spec(identity, None, None)
+        if field == self.__datetime_field:
+            key = 'since' if minimum else 'until'
+            result = list(collection.find(spec, {key: 1}).sort([(key, ASCENDING if minimum else DESCENDING)]).limit(1))
+            return result[0].get(key) if len(result) > 0 else None
+        values = [value for value in collection.distinct('columns.' + field, spec) if value is not None]
+        if len(values) == 0:
+            return None
+        return min(values) if minimum else max(values)
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __unpack_rows(self, document: dict) -> dict:
+        columns = document.get('columns', {})
+        times = columns.get(self.__datetime_field, [])
+        fields = [field for field in columns.keys() if field != self.__datetime_field]
+        rows = {}
+        for index, time in enumerate(times):
+            rows[time] = {field: columns[field][index] for field in fields if columns[field][index] is not None}
+        return rows
+
+    def __pack_rows(self, identity: str, bucket: datetime, rows: dict) -> dict:
+        times = sorted(rows.keys())
+        fields = []
+        for time in times:
+            fields.extend([field for field in rows[time].keys() if field not in fields])
+        columns = {self.__datetime_field: times}
+        for field in fields:
+            columns[field] = [rows[time].get(field) for time in times]
+        document = {
+            'bucket': bucket,
+            'since': times[0],
+            'until': times[-1],
+            'count': len(times),
+            'columns': columns,
+        }
+        if str_available(self.__identity_field):
+            document[self.__identity_field] = identity
+        return document
+
+    @staticmethod
+    def __row_match(time: datetime, row: dict, since: datetime, until: datetime, extra_spec: dict) -> bool:
+        if since is not None and time < since:
+            return False
+        if until is not None and time > until:
+            return False
+        if extra_spec is not None:
+            for key, value in extra_spec.items():
+                if row.get(key) != value:
+                    return False
+        return True
+
+    @staticmethod
+    def __normalize_range(since: datetime or str, until: datetime or str) -> (datetime, datetime):
+        since = text_auto_time(since) if isinstance(since, str) else since
+        until = text_auto_time(until) if isinstance(until, str) else until
+        return since, until
+
+
+# ----------------------------------------------------- Migration ------------------------------------------------------
+
+def migrate_to_bucket_table(source: ItkvTable, target: BucketItkvTable, identity: str = None) -> int:
+    """
+    Copy the records from a document layout table to a bucket layout table.
+    :param source: The ItkvTable (one document per record)
+    :param target: The BucketItkvTable
+    :param identity: The identity of the records in source. Use the identity field of record if None.
+    :return: The count of records migrated
+    """
+    identity_field, datetime_field = target.identity_field(), target.datetime_field()
+    count = 0
+    for record in source.query():
+        record.pop('_id', None)
+        identity_value = record.pop(source.identity_field(), identity) \
+            if str_available(source.identity_field()) else identity
+        datetime_value = record.pop(source.datetime_field(), None)
+        if datetime_value is None:
+            continue
+        record.pop(identity_field, None)
+        record.pop(datetime_field, None)
+        target.bulk_upsert(identity if str_available(identity) else identity_value, datetime_value, record)
+        count += 1
+    target.bulk_flush()
+    return count
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def __prepare_empty_test_table() -> BucketItkvTable:
+    client = MongoClient('localhost', 27017, serverSelectionTimeoutMS=5)
+    table = BucketItkvTable(client, 'TestDatabase', 'TestBucketTable', bucket=BUCKET_MONTH)
+    table.drop()
+    return table
+
+
+def test_bucket_upsert_query():
+    table = __prepare_empty_test_table()
+
+    table.bulk_upsert('identity1', '2000-01-01', {'close': 1.0})
+    table.bulk_upsert('identity1', '2000-01-02', {'close': 2.0})
+    table.bulk_upsert('identity1', '2000-02-01', {'close': 3.0, 'open': 2.5})
+    table.bulk_upsert('identity2', '2000-01-01', {'close': 10.0})
+    table.bulk_flush()
+
+    assert table.count() == 4
+    assert table.bucket_count() == 3
+
+    table.upsert('identity1', '2000-01-02', {'open': 1.5})
+    result = table.query('identity1', '2000-01-02', '2000-01-02')
+    assert len(result) == 1
+    assert result[0]['close'] == 2.0 and result[0]['open'] == 1.5
+
+    df = table.query_dataframe('identity1', '2000-01-02', '2000-12-31', keys=['close'])
+    assert df['close'].tolist() == [2.0, 3.0]
+
+    chunks = list(table.query_iter(keys=['close'], chunk_rows=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2]
+    assert sorted(pd.concat(chunks)['close'].tolist()) == [1.0, 2.0, 3.0, 10.0]
+
+    assert str(table.min_of('DateTime', 'identity1')) == '2000-01-01 00:00:00'
+    assert str(table.max_of('DateTime')) == '2000-02-01 00:00:00'
+    assert sorted(table.get_distinct_values('Identity')) == ['identity1', 'identity2']
+
+    ranges = table.ranges_of()
+    assert str(ranges['identity1'][0]) == '2000-01-01 00:00:00'
+    assert str(ranges['identity1'][1]) == '2000-02-01 00:00:00'
+    assert ranges['identity1'][2] == 3 and ranges['identity2'][2] == 1
+
+    table.delete('identity1', '2000-01-01', '2000-01-31')
+    assert table.count() == 2
+    assert table.bucket_count() == 2
+
+
+def test_migration():
+    client = MongoClient('localhost', 27017, serverSelectionTimeoutMS=5)
+    source = ItkvTable(client, 'TestDatabase', 'TestTable')
+    source.drop()
+    source.upsert('identity1', '2000-05-01', {'close': 1.0})
+    source.upsert('identity1', '2000-05-02', {'close': 2.0})
+
+    target = __prepare_empty_test_table()
+    assert migrate_to_bucket_table(source, target) == 2
+    assert target.query_dataframe('identity1')['close'].tolist() == [1.0, 2.0]
+
+
+def test_entry():
+    test_bucket_upsert_query()
+    test_migration()
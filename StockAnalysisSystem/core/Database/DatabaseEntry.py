@@ -9,14 +9,130 @@ author:Sleepy
 @function:
 @modify:
 """
+import os
+import threading
 import traceback
 from os import path
 from pymongo import MongoClient
 
 from .SqlRw import SqlAccess
-from .NoSqlRw import ItkvTable
+from .NoSqlRw import ItkvTable, rebuild_database_schema
+from .BucketItkvTable import BucketItkvTable, BUCKET_YEAR
+from .SqliteItkvTable import SqliteClient, SqliteItkvTable
+from .LocalColumnarTier import LocalColumnarTier
 from ..Utiltity.common import *
+# After the star import, which brings datetime.time as 'time'
+import time
+
+
+LAYOUT_DOCUMENT = 'document'
+LAYOUT_BUCKET = 'bucket'
+
+NOSQL_BACKEND_MONGODB = 'mongodb'
+NOSQL_BACKEND_SQLITE = 'sqlite'
+
+
+# ------------------------------------------------ MongoClientManager ------------------------------------------------
+
+class MongoClientManager:
+    """
+    Keep one long-lived MongoClient per (url, process).
+    MongoClient is thread-safe and manages its own connection pool, so all tables share it and nobody closes it
+        on the hot path. The idle sockets are reaped by the pool itself (maxIdleTimeMS).
+    The health check is opt-in: ping the server at most once per interval when the client is acquired.
+        If the ping fails, the client is only marked unhealthy. It's never closed here because all tables share it,
+        and MongoClient reconnects by itself when the server is back.
+    If the process is forked, the client is rebuilt because MongoClient is not fork-safe.
+        The generation increases so the tables holding the old client are rebuilt.
+    """
+
+    LOCK = threading.Lock()
+    CLIENTS = {}
+
+    def __init__(self, pool_size: int = 50, idle_ms: int = 60 * 1000, health_check_s: int = 0):
+        self.__url = ''
+        self.__pool_size = pool_size
+        self.__idle_ms = idle_ms
+        self.__health_check_s = health_check_s
+        self.__last_health_check = 0
+        self.__healthy = True
+        self.__generation = 0
+
+    def config(self, pool_size: int = None, idle_ms: int = None, health_check_s: int = None):
+        if pool_size is not None:
+            self.__pool_size = pool_size
+        if idle_ms is not None:
+            self.__idle_ms = idle_ms
+        if health_check_s is not None:
+            self.__health_check_s = health_check_s
+
+    def generation(self) -> int:
+        """
+        Increase when the client is rebuilt. Anything holding the old client should be rebuilt as well.
+        """
+        return self.__generation
+
+    def connect(self, url: str) -> MongoClient:
+        self.__url = url
+        client = self.get_client()
+        client.server_info()
+        return client
+
+    def get_client(self) -> MongoClient or None:
+        if self.__url == '':
+            return None
+        key = (self.__url, os.getpid())
+        with MongoClientManager.LOCK:
+            client = MongoClientManager.CLIENTS.get(key)
+            if client is None:
+                client = self.__build_client(key)
+        if self.__health_check_s > 0 and time.time() - self.__last_health_check > self.__health_check_s:
+            self.__last_health_check = time.time()
+            self.__healthy = self.check_health(client)
+        return client
+
+    def is_healthy(self) -> bool:
+        """
+        The result of the last health check. Always True if the health check is not enabled.
+        """
+        return self.__healthy
+
+    def __build_client(self, key: tuple) -> MongoClient:
+        # Call with LOCK held
+        client = MongoClient(self.__url,
+                             maxPoolSize=self.__pool_size,
+                             maxIdleTimeMS=self.__idle_ms if self.__idle_ms > 0 else None,
+                             serverSelectionTimeoutMS=5000,
+                             waitQueueTimeoutMS=1000)
+        MongoClientManager.CLIENTS[key] = client
+        self.__generation += 1
+        return client
+
+    def check_health(self, client: MongoClient = None) -> bool:
+        client = self.get_client() if client is None else client
+        if client is None:
+            return False
+        try:
+            client.admin.command('ping')
+            return True
+        except Exception as e:
+            print('Mongodb health check fail: ' + str(e))
+            return False
+        finally:
+            pass
 
+    def release(self):
+        """
+        Close the shared client of this process. Only call it when the system quits.
+        """
+        key = (self.__url, os.getpid())
+        with MongoClientManager.LOCK:
+            client = MongoClientManager.CLIENTS.pop(key, None)
+        if client is not None:
+            client.close()
+
+
+# --------------------------------------------------- DatabaseEntry ----------------------------------------------------
 
 class DatabaseEntry:
     def __init__(self):
@@ -29,8 +145,14 @@ class DatabaseEntry:
         self.__mongo_db_url = ''
         self.__sql_db_access = None
         self.__mongo_db_client = None
+        self.__mongo_client_manager = MongoClientManager()
+        self.__mongo_client_generation = 0
+        self.__embedded_client = None
 
+        # db -> table name -> table. The tables are shared by threads, so each table is built only once.
         self.__no_sql_tables = {}
+        self.__no_sql_tables_lock = threading.Lock()
+        self.__local_tier = None
 
         self.__alias_table = None
         self.__update_table = None
@@ -70,7 +192,8 @@ class DatabaseEntry:
 
             return False
 
-    def config_nosql_db(self, host: str, port: str, user: str, password: str) -> bool:
+    def config_nosql_db(self, host: str, port: str, user: str, password: str,
+                        pool_size: int = 50, idle_ms: int = 60 * 1000, health_check_s: int = 0) -> bool:
         self.__mongo_db_host = host
         self.__mongo_db_port = port
         self.__mongo_db_user = user
@@ -83,11 +206,10 @@ class DatabaseEntry:
             url = 'mongodb://%s:%s/' % (self.__mongo_db_host, self.__mongo_db_port)
 
         try:
-            self.__mongo_db_client = MongoClient(url,
-                                                 maxPoolSize=50,
-                                                 serverSelectionTimeoutMS=5000,
-                                                 waitQueueTimeoutMS=1000)
-            self.__mongo_db_client.server_info()
+            self.__mongo_db_url = url
+            self.__mongo_client_manager.config(pool_size, idle_ms, health_check_s)
+            self.__mongo_db_client = self.__mongo_client_manager.connect(url)
+            self.__mongo_client_generation = self.__mongo_client_manager.generation()
 
             from .UpdateTableEx import UpdateTableEx
             self.__update_table = UpdateTableEx(self.__mongo_db_client)
@@ -102,20 +224,84 @@ class DatabaseEntry:
         finally:
             pass
 
+    def config_embedded_db(self, db_path: str) -> bool:
+        """
+        Use embedded sqlite files instead of mongodb service as the NoSql database. One file per database.
+        """
+        try:
+            self.__embedded_client = SqliteClient(db_path)
+            self.__embedded_client.database('StockAnalysisSystem')
+
+            from .UpdateTableEx import UpdateTableEx
+            self.__update_table = UpdateTableEx(self.__embedded_client)
+            with self.__no_sql_tables_lock:
+                self.__no_sql_tables.clear()
+            return True
+        except Exception as e:
+            print('Embedded database config error.')
+            print(e)
+            print(traceback.format_exc())
+            self.__embedded_client = None
+            return False
+        finally:
+            pass
+
+    def config_local_tier(self, tier_path: str) -> bool:
+        self.__local_tier = LocalColumnarTier(tier_path)
+        if not self.__local_tier.available():
+            print('Local columnar tier is not available. Please check the path and whether pyarrow is installed.')
+            self.__local_tier = None
+            return False
+        return True
+
     # ------------------------------------------------- Database Entry -------------------------------------------------
 
     def get_utility_db(self) -> SqlAccess:
         return self.__sql_db_access
 
     def get_mongo_db_client(self) -> MongoClient:
+        if self.__mongo_db_client is not None:
+            self.__check_refresh_mongo_db_client()
         return self.__mongo_db_client
 
+    def get_local_tier(self) -> LocalColumnarTier or None:
+        return self.__local_tier
+
+    def get_mongo_client_manager(self) -> MongoClientManager:
+        return self.__mongo_client_manager
+
+    def get_embedded_db_client(self) -> SqliteClient or None:
+        return self.__embedded_client
+
+    def release(self):
+        """
+        Release the database connections. Only call it when the system quits.
+        """
+        self.__mongo_client_manager.release()
+        if self.__embedded_client is not None:
+            self.__embedded_client.close()
+
+    def __check_refresh_mongo_db_client(self):
+        client = self.__mongo_client_manager.get_client()
+        if self.__mongo_client_manager.generation() == self.__mongo_client_generation:
+            return
+        # The shared client is rebuilt (forked process), the tables holding the old client should be rebuilt.
+        # The update table is kept (it may be captured by others) and only switches client, keeping its buffer.
+        self.__mongo_db_client = client
+        self.__mongo_client_generation = self.__mongo_client_manager.generation()
+        with self.__no_sql_tables_lock:
+            self.__no_sql_tables.clear()
+        if self.__update_table is not None:
+            self.__update_table.rebind_client(self.__mongo_db_client)
+
     # ------------------------------------------------- SQL Table Entry ------------------------------------------------
 
     def get_alias_table(self):
         return self.__alias_table
 
     def get_update_table(self):
+        if self.__mongo_db_client is not None:
+            self.__check_refresh_mongo_db_client()
         return self.__update_table
 
     def get_gray_table(self):
@@ -129,15 +315,58 @@ class DatabaseEntry:
 
     # ------------------------------------------------ NoSQL Table Entry -----------------------------------------------
 
+    def rebuild_nosql_schema(self, db: str) -> int:
+        """
+        Rebuild the schema registry (the keys of each table) of a database from existing data.
+        :return: The count of tables rebuilt
+        """
+        if self.__embedded_client is not None:
+            # The schema of embedded table is its columns
+            return 0
+        client = self.get_mongo_db_client()
+        return rebuild_database_schema(client, db) if client is not None else 0
+
+    def list_nosql_tables(self, db: str) -> set or None:
+        """
+        List the existing tables of a database by one query.
+        :return: The set of table names. None if the database is not available.
+        """
+        if self.__embedded_client is not None:
+            return set(self.__embedded_client.list_tables(db))
+        client = self.get_mongo_db_client()
+        if client is None:
+            return None
+        # noinspection PyBroadException
+        try:
+            return set(client[db].list_collection_names())
+        except Exception as e:
+            print('List tables of %s fail: %s' % (db, str(e)))
+            return None
+        finally:
+            pass
+
     def query_nosql_table(self, db: str, table: str,
                           identity_field: str = 'Identity',
-                          datetime_field: str = 'DateTime') -> ItkvTable or None:
-        if self.get_mongo_db_client() is None:
+                          datetime_field: str = 'DateTime',
+                          layout: str = LAYOUT_DOCUMENT,
+                          bucket: str = BUCKET_YEAR) -> ItkvTable or BucketItkvTable or SqliteItkvTable or None:
+        """
+        :param layout: LAYOUT_DOCUMENT - One document per record. LAYOUT_BUCKET - One document per identity-bucket
+        :param bucket: Only for LAYOUT_BUCKET. The time span of each bucket: 'year' or 'month'
+        If the embedded database is configured, the table is always a SqliteItkvTable (layout is ignored).
+        """
+        client = self.get_mongo_db_client() if self.__embedded_client is None else None
+        if self.__embedded_client is None and client is None:
             return None
-        if db not in self.__no_sql_tables.keys():
-            self.__no_sql_tables[db] = {}
-        database = self.__no_sql_tables.get(db)
-        if table not in database.keys():
-            database[table] = ItkvTable(self.get_mongo_db_client(), db, table, identity_field, datetime_field)
-        return database.get(table, None)
+        with self.__no_sql_tables_lock:
+            database = self.__no_sql_tables.setdefault(db, {})
+            if table not in database.keys():
+                if self.__embedded_client is not None:
+                    database[table] = SqliteItkvTable(self.__embedded_client, db, table,
+                                                      identity_field, datetime_field)
+                elif layout == LAYOUT_BUCKET:
+                    database[table] = BucketItkvTable(client, db, table, identity_field, datetime_field, bucket)
+                else:
+                    database[table] = ItkvTable(client, db, table, identity_field, datetime_field)
+            return database.get(table, None)
 
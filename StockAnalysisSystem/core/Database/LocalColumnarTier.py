@@ -0,0 +1,209 @@
+import os
+import threading
+import traceback
+import pandas as pd
+
+# pyarrow is optional. The tier is disabled if it's not installed.
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except Exception:
+    pa = None
+finally:
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                  LocalColumnarTier
+# A local read-optimized copy of the data in Arrow IPC files. One file per (uri, identity).
+# The NoSql database is still the system of record. This tier is only a cache that can be dropped at any time.
+# A file is built from the system of record on the first read, then kept up to date by patches.
+# Each file has its own lock held across the whole read-modify-write, so concurrent patches don't lose updates.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class LocalColumnarTier:
+    def __init__(self, root_path: str):
+        self.__root_path = root_path
+        self.__lock = threading.Lock()
+        self.__file_locks = {}
+
+    def available(self) -> bool:
+        return pa is not None and isinstance(self.__root_path, str) and self.__root_path != ''
+
+    def file_path(self, uri: str, identity: str) -> str:
+        return os.path.join(self.__root_path, uri.replace('.', '_'), identity.replace('.', '_') + '.arrow')
+
+    def exists(self, uri: str, identity: str) -> bool:
+        return self.available() and os.path.isfile(self.file_path(uri, identity))
+
+    # -------------------------------------------------------------------------------------------------
+
+    def load(self, uri: str, identity: str) -> pd.DataFrame or None:
+        if not self.exists(uri, identity):
+            return None
+        source = None
+        try:
+            source = pa.memory_map(self.file_path(uri, identity), 'r')
+            return pa.ipc.open_file(source).read_all().to_pandas()
+        except Exception as e:
+            print('Load local tier of %s [%s] fail: %s' % (uri, identity, str(e)))
+            return None
+        finally:
+            if source is not None:
+                source.close()
+
+    def save(self, uri: str, identity: str, df: pd.DataFrame) -> bool:
+        if not self.available():
+            return False
+        file_path = self.file_path(uri, identity)
+        temp_path = file_path + '.tmp'
+        with self.__file_lock(file_path):
+            try:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                with pa.OSFile(temp_path, 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                os.replace(temp_path, file_path)
+                return True
+            except Exception as e:
+                print('Save local tier of %s [%s] fail: %s' % (uri, identity, str(e)))
+                print(traceback.format_exc())
+                self.__remove_file(temp_path)
+                # A stale file is worse than no file
+                self.__remove_file(file_path)
+                return False
+            finally:
+                pass
+
+    def build(self, uri: str, identity: str, loader) -> bool:
+        """
+        Build the local file by loader if it does not exist.
+        The loader is called with the file lock held, so a patch that comes meanwhile is applied after the build.
+        :param loader: Callable that returns the full history DataFrame from the system of record.
+        :return: True if the file exists after this call.
+        """
+        if not self.available():
+            return False
+        with self.__file_lock(self.file_path(uri, identity)):
+            if self.exists(uri, identity):
+                return True
+            df = loader()
+            if df is None or not isinstance(df, pd.DataFrame) or len(df) == 0:
+                return False
+            return self.save(uri, identity, df)
+
+    def patch(self, uri: str, identity: str, df: pd.DataFrame, keys: [str], create: bool = True) -> bool:
+        """
+        Merge the patch into local file by keys. The same as the upsert of NoSql database:
+            The new value overwrites the old one, the missing (NaN) value does not.
+        :param create: Save the patch as the file if it does not exist. Otherwise skip it (built later on read).
+        """
+        if not self.available():
+            return False
+        with self.__file_lock(self.file_path(uri, identity)):
+            local = self.load(uri, identity)
+            if local is None or len(local) == 0:
+                return self.save(uri, identity, df) if create else False
+            keys = [key for key in keys if key in df.columns and key in local.columns]
+            if len(keys) == 0:
+                return self.save(uri, identity, pd.concat([local, df], ignore_index=True))
+            patched = df.drop_duplicates(subset=keys, keep='last').set_index(keys).combine_first(
+                local.set_index(keys))
+            return self.save(uri, identity, patched.reset_index())
+
+    def remove(self, uri: str, identity: str):
+        file_path = self.file_path(uri, identity)
+        with self.__file_lock(file_path):
+            self.__remove_file(file_path)
+
+    # -------------------------------------------------------------------------------------------------
+
+    def __file_lock(self, file_path: str) -> threading.RLock:
+        with self.__lock:
+            lock = self.__file_locks.get(file_path)
+            if lock is None:
+                lock = self.__file_locks[file_path] = threading.RLock()
+            return lock
+
+    @staticmethod
+    def __remove_file(file_path: str):
+        # noinspection PyBroadException
+        try:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+        except Exception:
+            pass
+        finally:
+            pass
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def test_patch():
+    import tempfile
+    tier = LocalColumnarTier(tempfile.mkdtemp())
+    if not tier.available():
+        print('pyarrow is not installed, skip the test of local columnar tier.')
+        return
+
+    df = pd.DataFrame({
+        'identity': ['000001.SSE'] * 3,
+        'datetime': pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-03']),
+        'close': [1.0, 2.0, None],
+    })
+    assert tier.save('Test.Daily', '000001.SSE', df)
+    assert tier.exists('Test.Daily', '000001.SSE')
+
+    patch = pd.DataFrame({
+        'identity': ['000001.SSE'] * 2,
+        'datetime': pd.to_datetime(['2020-01-03', '2020-01-04']),
+        'close': [3.0, 4.0],
+        'open': [None, 4.5],
+    })
+    assert tier.patch('Test.Daily', '000001.SSE', patch, ['identity', 'datetime'])
+
+    local = tier.load('Test.Daily', '000001.SSE')
+    assert len(local) == 4
+    assert local['close'].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert local['open'].isna().sum() == 3
+
+    tier.remove('Test.Daily', '000001.SSE')
+    assert not tier.exists('Test.Daily', '000001.SSE')
+    assert tier.load('Test.Daily', '000001.SSE') is None
+
+
+def test_build_and_concurrent_patch():
+    import tempfile
+    tier = LocalColumnarTier(tempfile.mkdtemp())
+    if not tier.available():
+        print('pyarrow is not installed, skip the test of local columnar tier.')
+        return
+
+    def patch_of(day: int) -> pd.DataFrame:
+        return pd.DataFrame({
+            'identity': ['000001.SSE'],
+            'datetime': [pd.Timestamp('2020-01-01') + pd.Timedelta(days=day)],
+            'close': [float(day)],
+        })
+
+    # Not created by patch, built on read
+    assert not tier.patch('Test.Daily', '000001.SSE', patch_of(0), ['identity', 'datetime'], create=False)
+    assert not tier.exists('Test.Daily', '000001.SSE')
+    assert tier.build('Test.Daily', '000001.SSE', lambda: patch_of(0))
+    assert tier.build('Test.Daily', '000001.SSE', lambda: None)
+
+    # The read-modify-write of the same file is serialized, no patch is lost
+    threads = [threading.Thread(target=tier.patch, args=('Test.Daily', '000001.SSE', patch_of(day),
+                                                          ['identity', 'datetime'])) for day in range(1, 21)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    local = tier.load('Test.Daily', '000001.SSE')
+    assert sorted(local['close'].tolist()) == [float(day) for day in range(21)]
+
+
+def test_entry():
+    test_patch()
+    test_build_and_concurrent_patch()
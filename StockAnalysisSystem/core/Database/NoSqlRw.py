@@ -1,8 +1,12 @@
-import json
 import sys
+import json
+import threading
+import functools
+import itertools
 import traceback
-from bson import Code
-from datetime import datetime
+import pandas as pd
+from datetime import datetime, timedelta
+from pymongo.errors import BulkWriteError
 from pymongo import MongoClient, ASCENDING, UpdateOne, UpdateMany, InsertOne, DeleteOne, DeleteMany
 
 
@@ -20,24 +24,27 @@ def text2datetime(text: str) -> datetime:
     return datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
 
 
+# The copy of Utiltity.date_parser.TIME_FORMATS. Keep them the same (pinned by Test/ut/test_date_parser.py).
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%H:%M:%S', '%Y%m%d']
+
+
 def text_auto_time(text: str) -> datetime:
     if isinstance(text, datetime):
         return text
-    # noinspection PyBroadException
-    try:
-        return datetime.strptime(text, '%Y-%m-%d')
-    except Exception:
-        pass
-    # noinspection PyBroadException
-    try:
-        return datetime.strptime(text, '%H:%M:%S')
-    except Exception:
-        pass
-    # noinspection PyBroadException
-    try:
-        return datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
-    except Exception:
-        pass
+    if not isinstance(text, str):
+        return None
+    return __text_auto_time(text)
+
+
+# The same texts (query ranges, record times) are parsed repeatedly. The copy of Utiltity.date_parser.parse_time().
+@functools.lru_cache(maxsize=4096)
+def __text_auto_time(text: str) -> datetime:
+    for time_format in TIME_FORMATS:
+        # noinspection PyBroadException
+        try:
+            return datetime.strptime(text, time_format)
+        except Exception:
+            pass
     return None
 
 
@@ -49,6 +56,74 @@ def datetime2text(time: datetime) -> str:
     return time.strftime('%Y-%m-%d %H:%M:%S')
 
 
+# The collection (in each database) which keeps the keys of each table. {'_id': table name, 'keys': [key]}
+SCHEMA_REGISTRY_TABLE = '__ItkvSchema'
+
+
+def rebuild_collection_schema(collection) -> [str]:
+    """ Scan all keys of the collection and save them to the schema registry of its database. """
+    result = collection.aggregate([
+        {'$project': {'kv': {'$objectToArray': '$$ROOT'}}},
+        {'$unwind': '$kv'},
+        {'$group': {'_id': '$kv.k'}},
+    ])
+    keys = sorted([record['_id'] for record in result if record['_id'] != '_id'])
+    registry = collection.database[SCHEMA_REGISTRY_TABLE]
+    registry.replace_one({'_id': collection.name}, {'_id': collection.name, 'keys': keys}, upsert=True)
+    return keys
+
+
+def rebuild_database_schema(client: MongoClient, database: str) -> int:
+    """ Rebuild the schema registry for all collections in the database. For the data before schema registry. """
+    db = client[database]
+    tables = [name for name in db.list_collection_names() if name != SCHEMA_REGISTRY_TABLE]
+    for table in tables:
+        rebuild_collection_schema(db[table])
+    return len(tables)
+
+
+# ------------------------------------------------- DataFrame Conversion -----------------------------------------------
+
+def documents_to_dataframe(documents, keys: list = None, dtypes: dict = None) -> pd.DataFrame:
+    """ Build a typed DataFrame from documents
+    The DataFrame is built by pandas from the document list, which is faster than scattering the fields in python.
+        See Test/manual/test_nosql_rw_benchmark.py.
+    Args:
+        documents   : Iterable of dict (can be a cursor)
+        keys        : The preferred column order. The fields not in keys are appended by the order of appearance
+        dtypes      : dict, field -> dtype. Convert the column if possible, keep the original column if fail
+    Return value:
+        The DataFrame
+    """
+    df = pd.DataFrame(documents if isinstance(documents, list) else list(documents))
+    if keys is not None:
+        fields = [key for key in keys if key in df.columns]
+        if len(fields) > 0:
+            df = df[fields + [field for field in df.columns if field not in fields]]
+
+    for field, dtype in (dtypes if dtypes is not None else {}).items():
+        if field not in df.columns:
+            continue
+        # noinspection PyBroadException
+        try:
+            df[field] = df[field].astype(dtype)
+        except Exception:
+            pass
+    return df
+
+
+def documents_to_dataframes(documents, chunk_rows: int, keys: list = None, dtypes: dict = None):
+    """ The generator version of documents_to_dataframe(), yields a DataFrame for each chunk_rows documents
+    Only one chunk of documents is held in memory at a time. The index of each chunk starts from 0.
+    """
+    iterator = iter(documents)
+    while True:
+        chunk = list(itertools.islice(iterator, max(chunk_rows, 1)))
+        if len(chunk) == 0:
+            break
+        yield documents_to_dataframe(chunk, keys, dtypes)
+
+
 # ----------------------------------------------------------------------------------------------------------------------
 #                                                     ItkvTable
 # Identity & Time, Key-Value Table
@@ -68,12 +143,19 @@ class ItkvTable:
         self.__client = client
         self.__database = database
         self.__table = table
-        self.__connection_count = -1
-        self.__connection_threshold = 100
+        self.__index_checked = False
         self.__identity_field = identity_field
         self.__datetime_field = datetime_field
         self.__bulk_operations = []
+        self.__bulk_inserts = []
+        # The bulk buffers are shared by threads. Serialize the buffering and the flush of this table.
+        self.__bulk_lock = threading.RLock()
         self.__key_unique = True
+        self.__unique_index_keys = None
+        # The unique index exists. Until then, bulk_insert() falls back to upsert.
+        self.__unique_index_ready = False
+        self.__schema_keys = None
+        self.__schema_pending = set()
 
     def identity_field(self) -> str or None:
         return self.__identity_field
@@ -84,9 +166,55 @@ class ItkvTable:
     def set_key_uniqueness(self, unique: bool):
         self.__key_unique = unique
 
+    def set_unique_index(self, extra_keys: list = None):
+        """
+        Create the index (identity, datetime, extra keys) as unique index when the collection is first accessed.
+        If the unique index cannot be created (e.g. a normal index of the same keys in legacy data), keep the normal
+            index and bulk_insert() falls back to upsert. Use migrate_to_unique_index() to migrate the legacy data.
+        """
+        extra_keys = list(extra_keys) if extra_keys is not None else []
+        if extra_keys == self.__unique_index_keys:
+            return
+        self.__unique_index_keys = extra_keys
+        self.__unique_index_ready = False
+        self.__index_checked = False
+
+    def migrate_to_unique_index(self, dry_run: bool = True) -> int:
+        """
+        Remove the duplicated records of the unique index keys (keep the latest inserted one),
+            then replace the normal index of the same keys by the unique index.
+        :param dry_run: True to only report the duplicated records that would be removed
+        :return: The count of duplicated records removed (or would be removed)
+        """
+        collection = self.__get_collection()
+        if collection is None or self.__unique_index_keys is None:
+            return 0
+        _, unique_index = self.__index_keys()
+        group_id = {key.replace('.', '_'): '$' + key for key, _ in unique_index}
+        duplicates = list(collection.aggregate([
+            {'$group': {'_id': group_id, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}},
+        ], allowDiskUse=True))
+        count = sum([duplicate['count'] - 1 for duplicate in duplicates])
+        print('[%s]: %d duplicated records of %d keys%s.' %
+              (self.__table, count, len(duplicates), ' would be removed' if dry_run else ' removed'))
+        for duplicate in duplicates[:10]:
+            print('    %s x %d' % (str(duplicate['_id']), duplicate['count']))
+        if dry_run:
+            return count
+
+        for duplicate in duplicates:
+            collection.delete_many({'_id': {'$in': sorted(duplicate['ids'])[:-1]}})
+        name, unique = self.__existing_indexes(collection).get(tuple(unique_index), (None, False))
+        if name is not None and not unique:
+            collection.drop_index(name)
+        collection.create_index(unique_index, unique=True, background=True)
+        self.__unique_index_ready = True
+        return count
+
     def set_connection_threshold(self, threshold: int):
-        self.__connection_threshold = threshold
-        self.__check_recycle_connection()
+        # Deprecated: The client is shared by all tables and kept alive by DatabaseEntry. Never close it here.
+        pass
 
     # -----------------------------------------------------------------
 
@@ -95,6 +223,9 @@ class ItkvTable:
         if collection is None:
             return
         collection.drop()
+        self.__reset_schema()
+        self.__unique_index_ready = False
+        self.__index_checked = False
 
     def import_json(self, json_str: str) -> bool:
         try:
@@ -102,6 +233,7 @@ class ItkvTable:
             collection = self.__get_collection()
             collection.drop()
             collection.insert_many(json_data)
+            self.__reset_schema()
             return True
         except Exception as e:
             print('Import json for collection [%s] fail: ' % self.__table)
@@ -119,27 +251,103 @@ class ItkvTable:
     # ------------------------------------------------ Bulk Operations -------------------------------------------------
 
     def bulk_upsert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None):
-        spec, document = self.__gen_upsert_spec_and_document(identity, time, data, extra_spec)
-        self.__bulk_operations.append(UpdateOne(spec, {'$set': document}, upsert=True))
-        if len(self.__bulk_operations) > 950:
-            self.bulk_flush()
+        with self.__bulk_lock:
+            spec, document = self.__gen_upsert_spec_and_document(identity, time, data, extra_spec)
+            self.__bulk_operations.append(UpdateOne(spec, {'$set': document}, upsert=True))
+            self.__collect_schema_keys(spec, document)
+            if len(self.__bulk_operations) > 950:
+                self.bulk_flush()
+
+    def bulk_min_max(self, identity: str, time: datetime or str, min_data: dict, max_data: dict,
+                     extra_spec: dict = None):
+        """
+        Update the fields only if the value is less ($min) or greater ($max) than the existing one.
+        Insert if the record not exists. The comparison is done by database, no read before write.
+        """
+        with self.__bulk_lock:
+            spec, _ = self.__gen_upsert_spec_and_document(identity, time, {}, extra_spec)
+            modifier = {}
+            if len(min_data) > 0:
+                modifier['$min'] = min_data
+            if len(max_data) > 0:
+                modifier['$max'] = max_data
+            if len(modifier) == 0:
+                return
+            self.__bulk_operations.append(UpdateOne(spec, modifier, upsert=True))
+            self.__collect_schema_keys(spec, dict(min_data, **max_data))
+            if len(self.__bulk_operations) > 950:
+                self.bulk_flush()
+
+    def bulk_insert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None):
+        """
+        Insert a record without checking the existing one. Only for the record that's known not in table.
+        The inserts are written unordered. A duplicated record (if unique index exists) falls back to upsert.
+        """
+        with self.__bulk_lock:
+            self.__bulk_inserts.append((identity, time, data, extra_spec))
+            if len(self.__bulk_inserts) > 5000:
+                self.bulk_flush()
 
     def bulk_flush(self) -> dict or None:
-        collection = self.__get_collection()
-        if collection is None:
-            while len(self.__bulk_operations) > 1000:
-                self.__bulk_operations.pop(0)
-            return None
+        with self.__bulk_lock:
+            collection = self.__get_collection()
+            if collection is None:
+                while len(self.__bulk_operations) > 1000:
+                    self.__bulk_operations.pop(0)
+                while len(self.__bulk_inserts) > 5000:
+                    self.__bulk_inserts.pop(0)
+                return None
+            self.__flush_inserts(collection)
+            self.__flush_schema_keys()
+            if len(self.__bulk_operations) == 0:
+                return None
+            try:
+                ret = collection.bulk_write(self.__bulk_operations)
+                self.__bulk_operations.clear()
+            except Exception as e:
+                ret = None
+                print('ItkvTable.bulk_flush() fail: ')
+                print(e)
+            finally:
+                pass
+            return ret
+
+    def __flush_inserts(self, collection):
+        if len(self.__bulk_inserts) == 0:
+            return
+        inserts = self.__bulk_inserts
+        self.__bulk_inserts = []
+        if self.__unique_index_keys is not None and not self.__unique_index_ready:
+            # Without the unique index, the insert may duplicate an existing record
+            for insert in inserts:
+                self.bulk_upsert(*insert)
+            return
+
+        documents = []
+        for identity, time, data, extra_spec in inserts:
+            _, document = self.__gen_upsert_spec_and_document(identity, time, data, extra_spec)
+            if extra_spec is not None:
+                document.update(extra_spec)
+            documents.append(document)
+            self.__collect_schema_keys(None, document)
+        self.__flush_schema_keys()
         try:
-            ret = collection.bulk_write(self.__bulk_operations)
-            self.__bulk_operations.clear()
+            collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            duplicated = [error['index'] for error in write_errors if error.get('code') == 11000]
+            if len(duplicated) != len(write_errors):
+                print('ItkvTable.bulk_flush() insert fail: ')
+                print(e)
+            if len(duplicated) > 0:
+                print('ItkvTable.bulk_flush(): %d duplicated records fall back to upsert.' % len(duplicated))
+                for index in duplicated:
+                    self.bulk_upsert(*inserts[index])
         except Exception as e:
-            ret = None
-            print('ItkvTable.bulk_flush() fail: ')
+            print('ItkvTable.bulk_flush() insert fail: ')
             print(e)
         finally:
-            self.__client.close()
-        return ret
+            pass
 
     # ----------------------------------------------- Single Operations ------------------------------------------------
 
@@ -160,6 +368,8 @@ class ItkvTable:
         if collection is None:
             return None
         spec, document = self.__gen_upsert_spec_and_document(identity, time, data, extra_spec)
+        self.__collect_schema_keys(spec, document)
+        self.__flush_schema_keys()
         try:
             ret = collection.update_many(spec, {'$set': document}, True) \
                 if len(spec) > 0 else collection.insert(document)
@@ -195,6 +405,8 @@ class ItkvTable:
             del_keys = {}
             for key in keys:
                 del_keys[key] = 1
+            # The keys may still exist in other documents. Let the schema rebuild on next get_all_keys().
+            self.__reset_schema()
             return collection.update(spec, {'$unset': del_keys}, False, True, True)
 
     # Query records
@@ -226,6 +438,50 @@ class ItkvTable:
         result = collection.find(spec, key_select)
         return list(result)
 
+    def query_dataframe(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+                       extra_spec: dict = None, keys: list = None, dtypes: dict = None,
+                       with_id: bool = False, batch_size: int = 5000) -> pd.DataFrame:
+        """ Query records as DataFrame
+        The documents are decoded by pymongo then built by pandas, see documents_to_dataframe().
+        Args:
+            identity        : str or list of str, None if you don't want to specify
+            since, until    : datetime or time format str, None if you don't want to specify
+            extra_spec      : dict, to specify the extra conditions, None if you don't want to specify
+            keys            : The keys you want to query, None to query all entries
+            dtypes          : dict, field -> dtype. The column will be converted if the field is in this dict
+            with_id         : True to keep the '_id' column
+            batch_size      : The batch size of cursor
+        Return value:
+            Result as DataFrame, an empty DataFrame if there's no record
+        Raises:
+            None
+        """
+
+        collection = self.__get_collection()
+        if collection is None:
+            return pd.DataFrame()
+        spec = self.__gen_find_spec(identity, since, until, extra_spec)
+        key_select = self.__gen_key_select(keys, with_id)
+        cursor = collection.find(spec, key_select, batch_size=batch_size)
+        return documents_to_dataframe(cursor, keys, dtypes)
+
+    def query_iter(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+                   extra_spec: dict = None, keys: list = None, dtypes: dict = None,
+                   with_id: bool = False, chunk_rows: int = 5000):
+        """ The streaming version of query_dataframe()
+        Args:
+            chunk_rows      : The max row count of each DataFrame, also the batch size of cursor
+        Return value:
+            A generator of DataFrame. The columns of chunks may be different if the documents have different fields.
+        """
+        collection = self.__get_collection()
+        if collection is None:
+            return
+        spec = self.__gen_find_spec(identity, since, until, extra_spec)
+        key_select = self.__gen_key_select(keys, with_id)
+        cursor = collection.find(spec, key_select, batch_size=chunk_rows)
+        yield from documents_to_dataframes(cursor, chunk_rows, keys, dtypes)
+
     def min_of(self, field: str, identity: str = None) -> any:
         collection = self.__get_collection()
         if collection is None:
@@ -244,20 +500,54 @@ class ItkvTable:
         result = list(collection.find(spec).sort([(field, -1)]).limit(1))
         return result[0].get(field, None) if result is not None and len(result) > 0 else None
 
+    def ranges_of(self, field: str = None, identity: str or [str] = None) -> dict:
+        """
+        Get the min, max of field and the record count of each identity in one aggregation.
+        :param field: The field to calculate the range, use datetime field if None
+        :param identity: Limit the identities, None for all identities
+        :return: dict - identity -> (min, max, count). The identity is None if identity field is not specified.
+        """
+        field = field if str_available(field) else self.__datetime_field
+        collection = self.__get_collection()
+        if collection is None or not str_available(field):
+            return {}
+        group_by = ('$' + self.__identity_field) if str_available(self.__identity_field) else None
+        pipeline = [{'$group': {'_id': group_by,
+                                'min': {'$min': '$' + field},
+                                'max': {'$max': '$' + field},
+                                'count': {'$sum': 1}}}]
+        spec = self.__gen_find_spec(identity)
+        if len(spec) > 0:
+            pipeline.insert(0, {'$match': spec})
+        result = collection.aggregate(pipeline, allowDiskUse=True)
+        return {record['_id']: (record.get('min'), record.get('max'), record.get('count', 0)) for record in result}
+
     def get_all_keys(self):
         """
         Get all the keys from the collection.
         Keys is unique. Exclude '_id'.
+        The keys are read from the schema registry, which is maintained incrementally by write operations.
+            If the schema of this table is not registered yet, rebuild it from the whole collection.
+        :return: The list of keys
+        """
+        registry = self.__get_schema_registry()
+        if registry is None:
+            return []
+        record = registry.find_one({'_id': self.__table})
+        if record is None:
+            return self.rebuild_schema()
+        return sorted(record.get('keys', []))
+
+    def rebuild_schema(self) -> [str]:
+        """
+        Scan the whole collection to rebuild the schema record. It's for the existing data or after key deletion.
         :return: The list of keys
         """
         collection = self.__get_collection()
         if collection is None:
             return []
-        _map = Code('function() { for (var key in this) { emit(key, null); } }')
-        _reduce = Code('function(key, stuff) { return null; }')
-        result = collection.map_reduce(_map, _reduce, 'results')
-        keys = result.distinct('_id')
-        keys.remove('_id')
+        keys = rebuild_collection_schema(collection)
+        self.__schema_keys = set(keys)
         return keys
 
     def get_distinct_values(self, field: str) -> [str]:
@@ -268,6 +558,7 @@ class ItkvTable:
         collection = self.__get_collection()
         if collection is None:
             return False
+        self.__update_schema({'$pull': {'keys': key}})
         return collection.update_many(
             {key: {'$exists': True}},   # criteria
             {'$unset': {key: 1}},       # modifier
@@ -278,6 +569,8 @@ class ItkvTable:
         collection = self.__get_collection()
         if collection is None:
             return False
+        self.__update_schema({'$pull': {'keys': key_old}})
+        self.__update_schema({'$addToSet': {'keys': key_new}})
         return collection.update_many(
             {},   # criteria
             {'$rename': {key_old: key_new}},     # modifier
@@ -289,33 +582,123 @@ class ItkvTable:
     def __get_collection(self):
         if self.__client is None:
             return None
-        self.__check_recycle_connection()
         db = self.__client[self.__database]
         if db is None:
             return None
         collection = db[self.__table]
-        if self.__connection_count == -1:
+        if not self.__index_checked:
             self.__check_create_index(collection)
-            self.__connection_count = 0
-        self.__connection_count += 1
+            self.__index_checked = True
         return collection
 
-    def __check_create_index(self, collection):
+    # ----------------------------------------------- Schema Registry ------------------------------------------------
+
+    def __get_schema_registry(self):
+        if self.__client is None:
+            return None
+        return self.__client[self.__database][SCHEMA_REGISTRY_TABLE]
+
+    def __collect_schema_keys(self, spec: dict or None, document: dict):
+        if self.__schema_keys is None:
+            self.__load_schema_keys()
+        for key in document.keys():
+            if key not in self.__schema_keys:
+                self.__schema_pending.add(key)
+        if spec is not None:
+            for key in spec.keys():
+                if key not in self.__schema_keys and not key.startswith('$'):
+                    self.__schema_pending.add(key)
+
+    def __load_schema_keys(self):
+        self.__schema_keys = set()
+        registry = self.__get_schema_registry()
+        collection = self.__get_collection()
+        if registry is None or collection is None:
+            return
+        record = registry.find_one({'_id': self.__table})
+        if record is not None:
+            self.__schema_keys = set(record.get('keys', []))
+        elif collection.estimated_document_count() == 0:
+            # A new table, register it now. For existing table, leave it to get_all_keys() or rebuild_schema().
+            registry.update_one({'_id': self.__table}, {'$setOnInsert': {'keys': []}}, upsert=True)
+
+    def __flush_schema_keys(self):
+        if len(self.__schema_pending) == 0:
+            return
+        keys = list(self.__schema_pending)
+        self.__schema_pending.clear()
+        self.__schema_keys.update(keys)
+        # If the schema is not registered, this update does nothing. The rebuild will collect all keys.
+        self.__update_schema({'$addToSet': {'keys': {'$each': keys}}})
+
+    def __update_schema(self, modifier: dict):
+        registry = self.__get_schema_registry()
+        if registry is None:
+            return
+        # noinspection PyBroadException
+        try:
+            registry.update_one({'_id': self.__table}, modifier)
+        except Exception as e:
+            print('Update schema of [%s] fail: %s' % (self.__table, str(e)))
+        finally:
+            pass
+
+    def __reset_schema(self):
+        self.__schema_keys = None
+        self.__schema_pending.clear()
+        registry = self.__get_schema_registry()
+        if registry is not None:
+            registry.delete_one({'_id': self.__table})
+
+    def __index_keys(self) -> (list, list):
+        # The (identity, datetime) index and the unique index with extra keys
         index = []
         if str_available(self.__identity_field):
             index.append((self.__identity_field, ASCENDING))
         if str_available(self.__datetime_field):
             index.append((self.__datetime_field, ASCENDING))
-        collection.create_index(index, background=True)
+        return index, index + [(key, ASCENDING) for key in (self.__unique_index_keys or [])]
 
-    def __check_recycle_connection(self):
-        if self.__connection_count >= self.__connection_threshold:
-            # Close the previous connections. Avoiding resource and memory leak.
-            # https://api.mongodb.com/python/current/api/pymongo/mongo_client.html#pymongo.mongo_client.MongoClient.close
-            #   Close all sockets in the connection pools and stop the monitor threads. If this instance is used
-            #   again it will be automatically re-opened and the threads restarted unless auto encryption is enabled.
-            self.__client.close()
-            self.__connection_count = 0
+    def __check_create_index(self, collection):
+        index, unique_index = self.__index_keys()
+        existing = self.__existing_indexes(collection)
+        if self.__unique_index_keys is not None:
+            name, unique = existing.get(tuple(unique_index), (None, False))
+            if unique:
+                self.__unique_index_ready = True
+                return
+            if name is not None:
+                print('Warning: [%s] has a normal index of the unique keys, use upsert instead of insert. '
+                      'Call migrate_to_unique_index() to migrate.' % self.__table)
+            else:
+                # noinspection PyBroadException
+                try:
+                    collection.create_index(unique_index, unique=True, background=True)
+                    self.__unique_index_ready = True
+                    return
+                except Exception as e:
+                    print('Warning: Cannot create unique index for [%s], use normal index and upsert: %s' %
+                          (self.__table, str(e)))
+                finally:
+                    pass
+        if tuple(index) not in existing:
+            collection.create_index(index, background=True)
+
+    @staticmethod
+    def __existing_indexes(collection) -> dict:
+        # key pattern tuple -> (index name, is unique)
+        return {tuple(info.get('key', [])): (name, info.get('unique', False))
+                for name, info in collection.index_information().items()}
+
+    def __gen_key_select(self, keys: list or None, with_id: bool) -> dict or None:
+        key_select = {} if keys is not None else None
+        if keys is not None:
+            for key in keys:
+                key_select[key] = 1
+        if not with_id:
+            key_select = {} if key_select is None else key_select
+            key_select['_id'] = 0
+        return key_select
 
     def __gen_find_spec(self, identity: str or list,
                         since: datetime or str = None,
@@ -389,11 +772,17 @@ class ItkvTable:
 
 # ----------------------------------------------------- Test Code ------------------------------------------------------
 
-def __prepare_empty_test_table() -> ItkvTable:
-    client = MongoClient('localhost', 27017, serverSelectionTimeoutMS=5)
-    assert(client is not None)
+# (database, table) -> table. Replace it to run the test cases on other implementation of ItkvTable.
+TEST_TABLE_FACTORY = None
 
-    table = ItkvTable(client, 'TestDatabase', 'TestTable')
+
+def __prepare_empty_test_table() -> ItkvTable:
+    if TEST_TABLE_FACTORY is not None:
+        table = TEST_TABLE_FACTORY('TestDatabase', 'TestTable')
+    else:
+        client = MongoClient('localhost', 27017, serverSelectionTimeoutMS=5)
+        assert(client is not None)
+        table = ItkvTable(client, 'TestDatabase', 'TestTable')
     table.drop()
 
     return table
@@ -478,6 +867,106 @@ def test_query():
     assert(len(result) == 2)
 
 
+def test_query_dataframe():
+    table = __prepare_default_test_data()
+
+    df = table.query_dataframe()
+    assert(len(df) == 2)
+    assert('_id' not in df.columns)
+    assert(df['Author'].tolist() == ['Sleepy', 'Sleepy'])
+
+    df = table.query_dataframe(keys=['Identity', 'A1'], dtypes={'A1': 'float64'}, with_id=True)
+    assert(list(df.columns) == ['Identity', 'A1', '_id'])
+    assert(str(df['A1'].dtype) == 'float64')
+    assert(df['A1'].isna().sum() == 1)
+
+    df = table.query_dataframe(since='2030-01-01')
+    assert(len(df) == 0)
+
+
+def test_query_iter():
+    table = __prepare_empty_test_table()
+    for day in range(1, 11):
+        table.bulk_upsert('identity%d' % (day % 2), '2000-01-%02d' % day, {'Value': day})
+    table.bulk_flush()
+
+    chunks = list(table.query_iter(keys=['Identity', 'Value'], dtypes={'Value': 'float64'}, chunk_rows=4))
+    assert([len(chunk) for chunk in chunks] == [4, 4, 2])
+    assert(all(str(chunk['Value'].dtype) == 'float64' for chunk in chunks))
+    assert(sorted(pd.concat(chunks)['Value'].tolist()) == [float(day) for day in range(1, 11)])
+
+    chunks = list(table.query_iter('identity1', chunk_rows=4))
+    assert(sum([len(chunk) for chunk in chunks]) == 5)
+    assert(len(list(table.query_iter(since='2030-01-01'))) == 0)
+
+
+def test_bulk_insert():
+    table = __prepare_default_test_data()
+
+    table.bulk_insert('identity1', '2001-05-01', {'PI': 3.14})
+    table.bulk_insert('identity1', '2002-05-01', {'PI': 3.1})
+    table.bulk_upsert('identity1', '2000-05-01', {'PI': 3.0})
+    table.bulk_flush()
+
+    result = table.query('identity1')
+    assert(len(result) == 3)
+    assert(table.query('identity1', '2000-05-01', '2000-05-01')[0]['PI'] == 3.0)
+    assert(table.max_of('DateTime', 'identity1') == text_auto_time('2002-05-01'))
+
+
+def test_unique_index_migration():
+    if TEST_TABLE_FACTORY is not None:
+        # The legacy normal index only exists in mongodb
+        return
+    client = MongoClient('localhost', 27017, serverSelectionTimeoutMS=5)
+    collection = client['TestDatabase']['TestTable']
+    collection.drop()
+    collection.create_index([('Identity', ASCENDING), ('DateTime', ASCENDING)], background=True)
+    collection.insert_many([{'Identity': 'identity1', 'DateTime': text_auto_time('2000-01-01'), 'PI': 3.0},
+                            {'Identity': 'identity1', 'DateTime': text_auto_time('2000-01-01'), 'PI': 3.1},
+                            {'Identity': 'identity1', 'DateTime': text_auto_time('2000-01-02'), 'PI': 3.14}])
+
+    table = ItkvTable(client, 'TestDatabase', 'TestTable')
+    table.set_unique_index([])
+
+    # Nothing is removed implicitly. Without the unique index, insert falls back to upsert.
+    table.bulk_insert('identity1', '2000-01-02', {'PI': 3.2})
+    table.bulk_flush()
+    assert(len(table.query('identity1')) == 3)
+    assert(table.query('identity1', '2000-01-02', '2000-01-02')[0]['PI'] == 3.2)
+
+    # Explicit migration: dry run reports only
+    assert(table.migrate_to_unique_index() == 1)
+    assert(len(table.query('identity1')) == 3)
+    assert(table.migrate_to_unique_index(dry_run=False) == 1)
+    result = table.query('identity1', '2000-01-01', '2000-01-01')
+    assert(len(result) == 1 and result[0]['PI'] == 3.1)
+    assert(any(info.get('unique', False) for info in collection.index_information().values()))
+
+    table.bulk_insert('identity1', '2000-01-02', {'PI': 3.3})
+    table.bulk_flush()
+    assert(len(table.query('identity1')) == 2)
+
+
+def test_concurrent_bulk():
+    table = __prepare_empty_test_table()
+
+    def persist(worker: int):
+        for i in range(100):
+            table.bulk_upsert('identity%d' % worker, datetime(2000, 1, 1) + timedelta(days=i), {'value': i})
+            if i % 7 == 0:
+                table.bulk_flush()
+        table.bulk_flush()
+
+    # The threads write the same table object, the buffered operations should not be lost by the other's flush
+    threads = [threading.Thread(target=persist, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(table.query()) == 400
+
+
 def test_delete_document():
     table = __prepare_default_test_data()
     assert(len(table.query()) == 2)
@@ -574,6 +1063,7 @@ def test_get_all_keys():
     print(result)
     assert(result == ['A1', 'Author', 'Author2', 'B1', 'C1', 'D1', 'DateTime', 'Identity', 'PI',
                       'Password', "Schindler's List", 'Speed of Light'])
+    assert(table.rebuild_schema() == result)
 
 
 def test_remove_key():
@@ -619,6 +1109,24 @@ def test_min_max():
     assert str(max_time) == '2200-12-01 00:00:00'
 
 
+def test_ranges_of():
+    table = __prepare_empty_test_table()
+
+    table.upsert('identity1', '1990-12-31', {'Foo': 'bar1'})
+    table.upsert('identity1', '1990-01-01', {'Foo': 'bar2'})
+    table.upsert('identity2', '2000-05-10', {'Foo': 'bar3'})
+
+    ranges = table.ranges_of()
+    assert len(ranges) == 2
+    assert str(ranges['identity1'][0]) == '1990-01-01 00:00:00'
+    assert str(ranges['identity1'][1]) == '1990-12-31 00:00:00'
+    assert ranges['identity1'][2] == 2
+    assert ranges['identity2'][2] == 1
+
+    ranges = table.ranges_of(identity=['identity2'])
+    assert list(ranges.keys()) == ['identity2']
+
+
 def test_upsert_by_identity_and_datetime():
     table = __prepare_empty_test_table()
 
@@ -721,11 +1229,17 @@ def test_upsert_by_identity_or_datetime():
 def test_entry():
     test_basic_update_query_drop()
     test_query()
+    test_query_dataframe()
+    test_query_iter()
+    test_bulk_insert()
+    test_unique_index_migration()
+    test_concurrent_bulk()
     test_delete_document()
     test_delete_key_value()
     test_get_all_keys()
     test_remove_key()
     test_min_max()
+    test_ranges_of()
     test_upsert_by_identity_and_datetime()
     test_upsert_by_identity_or_datetime()
 
@@ -0,0 +1,769 @@
+import os
+import json
+import sqlite3
+import threading
+import traceback
+import numpy as np
+import pandas as pd
+from datetime import datetime, date
+
+from .NoSqlRw import str_available, text_auto_time
+
+
+# The table (in each database file) which keeps the registered keys and their value kind of each table.
+SQLITE_SCHEMA_TABLE = '__ItkvSchema'
+
+# The datetime is stored as fixed width text so that the text order is the same as the time order.
+SQLITE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+KIND_INT = 'int'
+KIND_FLOAT = 'float'
+KIND_BOOL = 'bool'
+KIND_TEXT = 'text'
+KIND_DATETIME = 'datetime'
+KIND_JSON = 'json'
+
+KIND_DECLARE = {
+    KIND_INT: 'INTEGER',
+    KIND_FLOAT: 'REAL',
+    KIND_BOOL: 'INTEGER',
+    KIND_TEXT: 'TEXT',
+    KIND_DATETIME: 'TEXT',
+    KIND_JSON: 'TEXT',
+}
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def encode_value(value: any) -> (str or None, any):
+    """
+    Convert python value to sqlite value.
+    :return: (kind, sqlite value). The kind is None if the value is None or NaN.
+    """
+    if value is None or value is pd.NaT:
+        return None, None
+    if isinstance(value, np.generic):
+        value = pd.Timestamp(value) if isinstance(value, np.datetime64) else value.item()
+    if isinstance(value, datetime):
+        return (KIND_DATETIME, value.strftime(SQLITE_DATETIME_FORMAT)) if value == value else (None, None)
+    if isinstance(value, date):
+        return KIND_DATETIME, datetime(value.year, value.month, value.day).strftime(SQLITE_DATETIME_FORMAT)
+    if isinstance(value, bool):
+        return KIND_BOOL, int(value)
+    if isinstance(value, int):
+        return KIND_INT, value
+    if isinstance(value, float):
+        return (KIND_FLOAT, value) if value == value else (None, None)
+    if isinstance(value, str):
+        return KIND_TEXT, value
+    if isinstance(value, (list, tuple, dict)):
+        return KIND_JSON, json.dumps(value, default=str, ensure_ascii=False)
+    return KIND_TEXT, str(value)
+
+
+def decode_value(kind: str, value: any) -> any:
+    if value is None:
+        return None
+    if kind == KIND_DATETIME and isinstance(value, str):
+        # noinspection PyBroadException
+        try:
+            return datetime.strptime(value, SQLITE_DATETIME_FORMAT)
+        except Exception:
+            time = text_auto_time(value)
+            return time if time is not None else value
+        finally:
+            pass
+    if kind == KIND_BOOL and isinstance(value, int):
+        return bool(value)
+    if kind == KIND_JSON and isinstance(value, str):
+        # noinspection PyBroadException
+        try:
+            return json.loads(value)
+        except Exception:
+            return value
+        finally:
+            pass
+    return value
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                     SqliteClient
+# The embedded replacement of MongoClient. One sqlite file per database under the root path.
+# Each database file has only one connection which is shared by all tables and threads (serialized by lock).
+# The file is in WAL mode so the reader (e.g. another process) does not block the writer.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class SqliteClient:
+    def __init__(self, root_path: str):
+        self.__root_path = root_path
+        self.__lock = threading.Lock()
+        self.__databases = {}
+
+    def root_path(self) -> str:
+        return self.__root_path
+
+    def database(self, database: str) -> (sqlite3.Connection, threading.RLock):
+        with self.__lock:
+            if database not in self.__databases:
+                os.makedirs(self.__root_path, exist_ok=True)
+                connection = sqlite3.connect(os.path.join(self.__root_path, database + '.db'),
+                                             check_same_thread=False, isolation_level=None)
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                connection.execute('CREATE TABLE IF NOT EXISTS %s '
+                                   '(tbl TEXT NOT NULL, col TEXT NOT NULL, kind TEXT, PRIMARY KEY (tbl, col))' %
+                                   quote(SQLITE_SCHEMA_TABLE))
+                self.__databases[database] = (connection, threading.RLock())
+            return self.__databases[database]
+
+    def list_tables(self, database: str) -> [str]:
+        connection, lock = self.database(database)
+        with lock:
+            rows = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.__lock:
+            for connection, lock in self.__databases.values():
+                with lock:
+                    connection.close()
+            self.__databases.clear()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                   SqliteItkvTable
+# The ItkvTable on embedded sqlite. One wide row per record:
+#   _id (rowid) | identity_field | datetime_field | key1 | key2 | ...
+# The new key is added as a new column. The value kind of each key is registered in SQLITE_SCHEMA_TABLE
+#   so the value can be converted back (datetime, bool, list and dict).
+# The missing value is NULL and it's omitted in query result, the same as a missing field of NoSql document.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class SqliteItkvTable:
+    """ The same interface and behaviour as ItkvTable, but the data is in a local sqlite file. """
+
+    def __init__(self, client: SqliteClient, database: str, table: str,
+                 identity_field: str = 'Identity', datetime_field: str = 'DateTime'):
+        self.__client = client
+        self.__database = database
+        self.__table = table
+        self.__identity_field = identity_field
+        self.__datetime_field = datetime_field
+        self.__bulk_upserts = []
+        self.__bulk_inserts = []
+        # The bulk buffers are shared by threads. Serialize the buffering and the flush of this table.
+        self.__bulk_lock = threading.RLock()
+        self.__key_unique = True
+        self.__unique_index_keys = None
+        self.__table_checked = False
+        # Physical columns (ordered) and registered kinds. Reload when an unknown key appears.
+        self.__columns = {}
+        self.__kinds = {}
+
+    def identity_field(self) -> str or None:
+        return self.__identity_field
+
+    def datetime_field(self) -> str or None:
+        return self.__datetime_field
+
+    def set_key_uniqueness(self, unique: bool):
+        self.__key_unique = unique
+
+    def set_unique_index(self, extra_keys: list = None):
+        self.__unique_index_keys = list(extra_keys) if extra_keys is not None else []
+        self.__table_checked = False
+
+    def set_connection_threshold(self, threshold: int):
+        pass
+
+    # -----------------------------------------------------------------
+
+    def drop(self):
+        connection, lock = self.__client.database(self.__database)
+        with lock:
+            connection.execute('DROP TABLE IF EXISTS %s' % quote(self.__table))
+            connection.execute('DELETE FROM %s WHERE tbl = ?' % quote(SQLITE_SCHEMA_TABLE), (self.__table, ))
+            self.__table_checked = False
+            self.__columns = {}
+            self.__kinds = {}
+
+    def import_json(self, json_str: str) -> bool:
+        try:
+            json_data = json.loads(json_str)
+            self.drop()
+            for document in json_data:
+                document.pop('_id', None)
+                self.__bulk_inserts.append((None, None, document, None))
+            self.bulk_flush()
+            return True
+        except Exception as e:
+            print('Import json for table [%s] fail: ' % self.__table)
+            print(e)
+            return False
+        finally:
+            pass
+
+    def count(self) -> int:
+        connection, lock = self.__get_connection()
+        with lock:
+            return connection.execute('SELECT COUNT(*) FROM %s' % quote(self.__table)).fetchone()[0]
+
+    # ------------------------------------------------ Bulk Operations -------------------------------------------------
+
+    def bulk_upsert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None):
+        with self.__bulk_lock:
+            self.__bulk_upserts.append((identity, time, data, extra_spec))
+            if len(self.__bulk_upserts) > 5000:
+                self.bulk_flush()
+
+    def bulk_insert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None):
+        """
+        Insert a record without checking the existing one. Only for the record that's known not in table.
+        A duplicated record (if unique index exists) falls back to upsert.
+        """
+        with self.__bulk_lock:
+            self.__bulk_inserts.append((identity, time, data, extra_spec))
+            if len(self.__bulk_inserts) > 5000:
+                self.bulk_flush()
+
+    def bulk_flush(self) -> dict or None:
+        """
+        Write all the buffered records in one transaction.
+        :return: {'inserted': count, 'upserted': count} or None if nothing to write
+        """
+        with self.__bulk_lock:
+            if len(self.__bulk_inserts) == 0 and len(self.__bulk_upserts) == 0:
+                return None
+            inserts, upserts = self.__bulk_inserts, self.__bulk_upserts
+            self.__bulk_inserts, self.__bulk_upserts = [], []
+
+            connection, lock = self.__get_connection()
+            with lock:
+                try:
+                    connection.execute('BEGIN')
+                    inserted = self.__insert_rows(connection, inserts)
+                    for record in upserts:
+                        self.__upsert_row(connection, *record)
+                    connection.execute('COMMIT')
+                    return {'inserted': inserted, 'upserted': len(upserts) + len(inserts) - inserted}
+                except Exception as e:
+                    connection.execute('ROLLBACK')
+                    print('SqliteItkvTable.bulk_flush() fail: ')
+                    print(e)
+                    print(traceback.format_exc())
+                    return None
+                finally:
+                    pass
+
+    # ----------------------------------------------- Single Operations ------------------------------------------------
+
+    def upsert(self, identity: str, time: datetime or str, data: dict, extra_spec: dict = None) -> dict or None:
+        """ Update a record, insert if not exists. The same as ItkvTable.upsert() """
+        connection, lock = self.__get_connection()
+        with lock:
+            try:
+                connection.execute('BEGIN')
+                count = self.__upsert_row(connection, identity, time, data, extra_spec)
+                connection.execute('COMMIT')
+                return {'n': count}
+            except Exception as e:
+                connection.execute('ROLLBACK')
+                print('SqliteItkvTable.upsert() fail: ')
+                print(e)
+                return None
+            finally:
+                pass
+
+    def delete(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+               extra_spec: dict = None, keys: list = None):
+        """ Delete records or delete key-value in records. The same as ItkvTable.delete() """
+        connection, lock = self.__get_connection()
+        with lock:
+            where, params = self.__gen_where(identity, since, until, extra_spec)
+            if keys is None:
+                return connection.execute('DELETE FROM %s%s' % (quote(self.__table), where), params).rowcount
+            keys = [key for key in keys if key in self.__columns]
+            if len(keys) == 0:
+                return 0
+            sql = 'UPDATE %s SET %s%s' % (quote(self.__table),
+                                          ', '.join(['%s = NULL' % quote(key) for key in keys]), where)
+            count = connection.execute(sql, params).rowcount
+            # The keys may still exist in other records.
+            self.__unregister_unused_keys(connection, keys)
+            return count
+
+    def query(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+              extra_spec: dict = None, keys: list = None) -> list:
+        """ Query records as dict list. The same as ItkvTable.query() """
+        columns, rows = self.__select(identity, since, until, extra_spec, keys, True)
+        kinds = [self.__kinds.get(column) for column in columns]
+        result = []
+        for row in rows:
+            result.append({column: decode_value(kind, value)
+                           for column, kind, value in zip(columns, kinds, row) if value is not None})
+        return result
+
+    def query_dataframe(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+                       extra_spec: dict = None, keys: list = None, dtypes: dict = None,
+                       with_id: bool = False, batch_size: int = 5000) -> pd.DataFrame:
+        """ Query records as DataFrame. The same as ItkvTable.query_dataframe() """
+        columns, rows = self.__select(identity, since, until, extra_spec, keys, with_id)
+        if len(rows) == 0:
+            return pd.DataFrame()
+        return self.__rows_to_dataframe(columns, rows, dtypes)
+
+    def query_iter(self, identity: str or list = None, since: datetime = None, until: datetime = None,
+                   extra_spec: dict = None, keys: list = None, dtypes: dict = None,
+                   with_id: bool = False, chunk_rows: int = 5000):
+        """ The same as ItkvTable.query_iter(). Paged by _id so the database is not locked between chunks. """
+        after_id = None
+        while True:
+            columns, rows = self.__select(identity, since, until, extra_spec, keys, True, after_id, chunk_rows)
+            if len(rows) == 0:
+                break
+            id_index = columns.index('_id')
+            after_id = rows[-1][id_index]
+            if not with_id:
+                columns = columns[:id_index] + columns[id_index + 1:]
+                rows = [row[:id_index] + row[id_index + 1:] for row in rows]
+            yield self.__rows_to_dataframe(columns, rows, dtypes)
+            if len(rows) < chunk_rows:
+                break
+
+    def min_of(self, field: str, identity: str = None) -> any:
+        return self.__aggregate_of('MIN', field, identity)
+
+    def max_of(self, field: str, identity: str = None) -> any:
+        return self.__aggregate_of('MAX', field, identity)
+
+    def ranges_of(self, field: str = None, identity: str or [str] = None) -> dict:
+        """ The same as ItkvTable.ranges_of() """
+        field = field if str_available(field) else self.__datetime_field
+        connection, lock = self.__get_connection()
+        if not str_available(field) or field not in self.__columns:
+            return {}
+        with lock:
+            where, params = self.__gen_where(identity)
+            group_by = quote(self.__identity_field) \
+                if str_available(self.__identity_field) and self.__identity_field in self.__columns else 'NULL'
+            sql = 'SELECT %s, MIN(%s), MAX(%s), COUNT(*) FROM %s%s GROUP BY 1' % \
+                  (group_by, quote(field), quote(field), quote(self.__table), where)
+            rows = connection.execute(sql, params).fetchall()
+        kind = self.__kinds.get(field)
+        return {row[0]: (decode_value(kind, row[1]), decode_value(kind, row[2]), row[3]) for row in rows}
+
+    def get_all_keys(self) -> [str]:
+        self.__get_connection()
+        return sorted(self.__kinds.keys())
+
+    def rebuild_schema(self) -> [str]:
+        connection, lock = self.__get_connection()
+        with lock:
+            self.__unregister_unused_keys(connection, list(self.__kinds.keys()))
+        return self.get_all_keys()
+
+    def get_distinct_values(self, field: str) -> [str]:
+        connection, lock = self.__get_connection()
+        if field not in self.__columns:
+            return []
+        with lock:
+            rows = connection.execute('SELECT DISTINCT %s FROM %s WHERE %s IS NOT NULL' %
+                                      (quote(field), quote(self.__table), quote(field))).fetchall()
+        kind = self.__kinds.get(field)
+        return [decode_value(kind, row[0]) for row in rows]
+
+    def remove_key(self, key: str) -> bool:
+        connection, lock = self.__get_connection()
+        if key not in self.__columns:
+            return False
+        with lock:
+            connection.execute('UPDATE %s SET %s = NULL' % (quote(self.__table), quote(key)))
+            self.__unregister_unused_keys(connection, [key])
+        return True
+
+    def replace_key(self, key_old: str, key_new: str) -> bool:
+        connection, lock = self.__get_connection()
+        if key_old not in self.__columns:
+            return False
+        with lock:
+            kind = self.__kinds.get(key_old)
+            self.__ensure_columns(connection, {key_new: kind})
+            connection.execute('UPDATE %s SET %s = %s WHERE %s IS NOT NULL' %
+                               (quote(self.__table), quote(key_new), quote(key_old), quote(key_old)))
+            connection.execute('UPDATE %s SET %s = NULL' % (quote(self.__table), quote(key_old)))
+            self.__unregister_unused_keys(connection, [key_old])
+        return True
+
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def __get_connection(self) -> (sqlite3.Connection, threading.RLock):
+        connection, lock = self.__client.database(self.__database)
+        if not self.__table_checked:
+            with lock:
+                self.__check_create_table(connection)
+                self.__load_columns(connection)
+                self.__table_checked = True
+        return connection, lock
+
+    def __check_create_table(self, connection: sqlite3.Connection):
+        main_keys = [field for field in [self.__identity_field, self.__datetime_field] if str_available(field)]
+        columns = ['_id INTEGER PRIMARY KEY AUTOINCREMENT'] + ['%s TEXT' % quote(key) for key in main_keys]
+        connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (quote(self.__table), ', '.join(columns)))
+        if len(main_keys) == 0:
+            return
+        index = ', '.join([quote(key) for key in main_keys])
+        if str_available(self.__datetime_field):
+            connection.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' %
+                               (quote(self.__table + '_datetime'), quote(self.__table),
+                                quote(self.__datetime_field)))
+        if self.__unique_index_keys is not None:
+            self.__load_columns(connection)
+            self.__ensure_columns(connection, {key: None for key in self.__unique_index_keys})
+            unique_index = index + ''.join([', ' + quote(key) for key in self.__unique_index_keys])
+            # noinspection PyBroadException
+            try:
+                connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS %s ON %s (%s)' %
+                                   (quote(self.__table + '_unique'), quote(self.__table), unique_index))
+                return
+            except Exception:
+                print('Cannot create unique index for [%s], use normal index.' % self.__table)
+            finally:
+                pass
+        connection.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' %
+                           (quote(self.__table + '_itkv'), quote(self.__table), index))
+
+    def __load_columns(self, connection: sqlite3.Connection):
+        self.__columns = dict.fromkeys([row[1] for row in
+                                        connection.execute('PRAGMA table_info(%s)' % quote(self.__table)).fetchall()])
+        self.__kinds = {row[0]: row[1] for row in
+                        connection.execute('SELECT col, kind FROM %s WHERE tbl = ?' % quote(SQLITE_SCHEMA_TABLE),
+                                           (self.__table, )).fetchall()}
+
+    def __ensure_columns(self, connection: sqlite3.Connection, key_kinds: dict):
+        """
+        Add the missing columns and register the kind of keys.
+        :param key_kinds: key -> kind. The key with None kind is only added as column but not registered.
+        """
+        if any(key not in self.__columns or (kind is not None and key not in self.__kinds)
+               for key, kind in key_kinds.items()):
+            # Maybe updated by other table object of the same table
+            self.__load_columns(connection)
+        for key, kind in key_kinds.items():
+            if key not in self.__columns:
+                connection.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                                   (quote(self.__table), quote(key), KIND_DECLARE.get(kind, '')))
+                self.__columns[key] = None
+            if kind is None:
+                continue
+            registered = self.__kinds.get(key)
+            if registered is None or (registered == KIND_INT and kind == KIND_FLOAT):
+                connection.execute('INSERT OR REPLACE INTO %s (tbl, col, kind) VALUES (?, ?, ?)' %
+                                   quote(SQLITE_SCHEMA_TABLE), (self.__table, key, kind))
+                self.__kinds[key] = kind
+
+    def __unregister_unused_keys(self, connection: sqlite3.Connection, keys: [str]):
+        for key in keys:
+            if key not in self.__columns:
+                continue
+            used = connection.execute('SELECT 1 FROM %s WHERE %s IS NOT NULL LIMIT 1' %
+                                      (quote(self.__table), quote(key))).fetchone()
+            if used is None:
+                connection.execute('DELETE FROM %s WHERE tbl = ? AND col = ?' % quote(SQLITE_SCHEMA_TABLE),
+                                   (self.__table, key))
+                self.__kinds.pop(key, None)
+
+    # -------------------------------------------------- Read --------------------------------------------------
+
+    def __select(self, identity: str or list, since: datetime or str, until: datetime or str,
+                 extra_spec: dict, keys: list or None, with_id: bool,
+                 after_id: int = None, limit: int = None) -> ([str], [tuple]):
+        connection, lock = self.__get_connection()
+        with lock:
+            if keys is not None and any(key not in self.__columns for key in keys):
+                self.__load_columns(connection)
+            if keys is None:
+                columns = [column for column in self.__columns.keys() if column != '_id']
+                columns = (['_id'] if with_id else []) + columns
+            else:
+                columns = [key for key in keys if key in self.__columns and key != '_id']
+                columns += ['_id'] if with_id else []
+            if len(columns) == 0:
+                return [], []
+            where, params = self.__gen_where(identity, since, until, extra_spec)
+            if after_id is not None:
+                where = (where + ' AND ' if where != '' else ' WHERE ') + '_id > ?'
+                params = list(params) + [after_id]
+            sql = 'SELECT %s FROM %s%s ORDER BY _id' % \
+                  (', '.join([quote(column) for column in columns]), quote(self.__table), where)
+            if limit is not None:
+                sql += ' LIMIT %d' % limit
+            return columns, connection.execute(sql, params).fetchall()
+
+    def __rows_to_dataframe(self, columns: [str], rows: [tuple], dtypes: dict) -> pd.DataFrame:
+        data = {}
+        dtypes = dtypes if dtypes is not None else {}
+        for index, column in enumerate(columns):
+            values = [row[index] for row in rows]
+            if all(value is None for value in values):
+                # The same as document: The field does not exist
+                continue
+            series = self.__decode_series(self.__kinds.get(column), values)
+            dtype = dtypes.get(column)
+            if dtype is not None:
+                # noinspection PyBroadException
+                try:
+                    series = series.astype(dtype)
+                except Exception:
+                    pass
+            data[column] = series
+        return pd.DataFrame(data, index=range(len(rows)), columns=list(data.keys()))
+
+    def __aggregate_of(self, function: str, field: str, identity: str or list) -> any:
+        connection, lock = self.__get_connection()
+        if field not in self.__columns:
+            return None
+        with lock:
+            where, params = self.__gen_where(identity)
+            where = (where + ' AND ' if where != '' else ' WHERE ') + '%s IS NOT NULL' % quote(field)
+            row = connection.execute('SELECT %s(%s) FROM %s%s' %
+                                     (function, quote(field), quote(self.__table), where), params).fetchone()
+        return decode_value(self.__kinds.get(field), row[0]) if row is not None else None
+
+    def __decode_series(self, kind: str, values: list) -> pd.Series:
+        if kind == KIND_DATETIME:
+            # noinspection PyBroadException
+            try:
+                return pd.Series(pd.to_datetime(values, format=SQLITE_DATETIME_FORMAT))
+            except Exception:
+                pass
+            finally:
+                pass
+        if kind in (KIND_DATETIME, KIND_BOOL, KIND_JSON):
+            values = [decode_value(kind, value) for value in values]
+        return pd.Series(values)
+
+    # ------------------------------------------------- Write --------------------------------------------------
+
+    def __gen_document(self, identity: str, time: datetime or str, data: dict, extra_spec: dict) -> dict:
+        if isinstance(time, str):
+            time = text_auto_time(time)
+        document = {}
+        if str_available(self.__identity_field) and str_available(identity):
+            document[self.__identity_field] = identity
+        if str_available(self.__datetime_field) and time is not None:
+            document[self.__datetime_field] = time
+        document.update(data)
+        if extra_spec is not None:
+            # The same as the upsert of NoSql: The equality conditions are the fields of the new document.
+            document.update({key: value for key, value in extra_spec.items() if not isinstance(value, dict)})
+        return document
+
+    def __encode_document(self, connection: sqlite3.Connection, document: dict) -> dict:
+        encoded = {}
+        key_kinds = {}
+        for key, value in document.items():
+            if key == '_id':
+                continue
+            kind, value = encode_value(value)
+            key_kinds[key] = kind
+            encoded[key] = value
+        self.__ensure_columns(connection, key_kinds)
+        return encoded
+
+    def __insert_rows(self, connection: sqlite3.Connection, records: list) -> int:
+        """
+        Insert the records in groups of the same keys. Fall back to upsert if the group violates the unique index.
+        :return: The count of inserted records
+        """
+        groups = {}
+        for record in records:
+            document = self.__encode_document(connection, self.__gen_document(*record))
+            groups.setdefault(tuple(document.keys()), []).append((record, document))
+        inserted = 0
+        for keys, group in groups.items():
+            sql = 'INSERT INTO %s (%s) VALUES (%s)' % \
+                  (quote(self.__table), ', '.join([quote(key) for key in keys]), ', '.join(['?'] * len(keys))) \
+                if len(keys) > 0 else 'INSERT INTO %s DEFAULT VALUES' % quote(self.__table)
+            connection.execute('SAVEPOINT itkv_insert')
+            try:
+                connection.executemany(sql, [tuple(document.values()) for _, document in group])
+                connection.execute('RELEASE itkv_insert')
+                inserted += len(group)
+            except sqlite3.IntegrityError:
+                connection.execute('ROLLBACK TO itkv_insert')
+                connection.execute('RELEASE itkv_insert')
+                print('SqliteItkvTable.bulk_flush(): duplicated records fall back to upsert.')
+                for record, _ in group:
+                    self.__upsert_row(connection, *record)
+            finally:
+                pass
+        return inserted
+
+    def __upsert_row(self, connection: sqlite3.Connection, identity: str, time: datetime or str,
+                     data: dict, extra_spec: dict = None) -> int:
+        if self.__key_unique:
+            where, params = self.__gen_where(identity, time, time, extra_spec)
+        else:
+            where, params = '', []
+        document = self.__encode_document(connection, self.__gen_document(identity, time, data, extra_spec))
+        if where != '' and len(document) > 0:
+            sql = 'UPDATE %s SET %s%s' % (quote(self.__table),
+                                          ', '.join(['%s = ?' % quote(key) for key in document.keys()]), where)
+            count = connection.execute(sql, list(document.values()) + params).rowcount
+            if count > 0:
+                return count
+        elif where != '':
+            if connection.execute('SELECT 1 FROM %s%s LIMIT 1' % (quote(self.__table), where), params).fetchone():
+                return 0
+        if len(document) == 0:
+            connection.execute('INSERT INTO %s DEFAULT VALUES' % quote(self.__table))
+        else:
+            connection.execute('INSERT INTO %s (%s) VALUES (%s)' %
+                               (quote(self.__table), ', '.join([quote(key) for key in document.keys()]),
+                                ', '.join(['?'] * len(document))), list(document.values()))
+        return 1
+
+    # ------------------------------------------------- Where --------------------------------------------------
+
+    def __gen_where(self, identity: str or list,
+                    since: datetime or str = None,
+                    until: datetime or str = None,
+                    extra_spec: dict = None) -> (str, list):
+        """ Generate the where clause which has the same meaning as the find spec of ItkvTable.
+        Return value:
+            (' WHERE ...', params) or ('', []) if no condition
+        """
+        conditions = []
+        params = []
+        if str_available(self.__identity_field):
+            if str_available(identity):
+                conditions.append('%s = ?' % quote(self.__identity_field))
+                params.append(identity)
+            elif isinstance(identity, (list, tuple)):
+                # No limit of variable count
+                conditions.append('%s IN (SELECT value FROM json_each(?))' % quote(self.__identity_field))
+                params.append(json.dumps(list(identity)))
+
+        since = text_auto_time(since) if isinstance(since, str) else since
+        until = text_auto_time(until) if isinstance(until, str) else until
+        if str_available(self.__datetime_field):
+            if since is not None and since == until:
+                conditions.append('%s = ?' % quote(self.__datetime_field))
+                params.append(encode_value(since)[1])
+            else:
+                if since is not None:
+                    conditions.append('%s >= ?' % quote(self.__datetime_field))
+                    params.append(encode_value(since)[1])
+                if until is not None:
+                    conditions.append('%s <= ?' % quote(self.__datetime_field))
+                    params.append(encode_value(until)[1])
+
+        if extra_spec is not None:
+            for key, value in extra_spec.items():
+                self.__gen_field_condition(key, value, conditions, params)
+
+        return (' WHERE ' + ' AND '.join(conditions), params) if len(conditions) > 0 else ('', [])
+
+    def __gen_field_condition(self, key: str, value: any, conditions: list, params: list):
+        operators = value if isinstance(value, dict) and all(str(k).startswith('$') for k in value.keys()) \
+            else {'$eq': value}
+        if key not in self.__columns:
+            # The field does not exist in any record: Only the negative conditions match
+            match = all((op == '$exists' and not v) or op in ('$ne', '$nin') or (op == '$eq' and v is None)
+                        for op, v in operators.items())
+            conditions.append('1' if match else '0')
+            return
+        column = quote(key)
+        for op, v in operators.items():
+            if op == '$exists':
+                conditions.append('%s IS %sNULL' % (column, 'NOT ' if v else ''))
+            elif op in ('$in', '$nin'):
+                values = [encode_value(item)[1] for item in v]
+                conditions.append('%s %sIN (%s)' % (column, 'NOT ' if op == '$nin' else '', ', '.join(['?'] * len(values)))
+                                  if len(values) > 0 else ('0' if op == '$in' else '1'))
+                params.extend(values)
+            elif op in ('$eq', '$ne') and v is None:
+                conditions.append('%s IS %sNULL' % (column, 'NOT ' if op == '$ne' else ''))
+            elif op in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte'):
+                sql_op = {'$eq': '=', '$ne': '!=', '$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}[op]
+                conditions.append('%s %s ?' % (column, sql_op))
+                params.append(encode_value(v)[1])
+            else:
+                print('SqliteItkvTable: Operator %s is not supported.' % op)
+                conditions.append('0')
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def __prepare_test_client() -> SqliteClient:
+    import tempfile
+    return SqliteClient(tempfile.mkdtemp())
+
+
+def test_nosql_rw_cases():
+    from . import NoSqlRw
+    client = __prepare_test_client()
+    NoSqlRw.TEST_TABLE_FACTORY = lambda database, table: SqliteItkvTable(client, database, table)
+    try:
+        NoSqlRw.test_entry()
+    finally:
+        NoSqlRw.TEST_TABLE_FACTORY = None
+        client.close()
+
+
+def test_value_kinds():
+    client = __prepare_test_client()
+    table = SqliteItkvTable(client, 'TestDatabase', 'TestTable')
+    table.bulk_upsert('identity1', '2000-01-01', {'int': 1, 'float': 1.5, 'bool': True,
+                                                  'time': datetime(2000, 1, 2, 3, 4, 5), 'list': [1, 'a']})
+    table.bulk_insert('identity1', '2000-01-02', {'int': 2, 'float': np.float64(2.5), 'bool': np.bool_(False)})
+    table.bulk_flush()
+
+    result = table.query('identity1', '2000-01-01', '2000-01-01')
+    assert result[0]['int'] == 1 and result[0]['float'] == 1.5 and result[0]['bool'] is True
+    assert result[0]['time'] == datetime(2000, 1, 2, 3, 4, 5)
+    assert result[0]['list'] == [1, 'a']
+
+    df = table.query_dataframe('identity1', keys=['DateTime', 'float', 'bool'])
+    assert list(df.columns) == ['DateTime', 'float', 'bool']
+    assert str(df['DateTime'].dtype).startswith('datetime64')
+    assert sorted(df['float'].tolist()) == [1.5, 2.5]
+
+    assert len(table.query(extra_spec={'int': {'$in': [2, 3]}})) == 1
+    assert len(table.query(extra_spec={'float': {'$gt': 1.0, '$lt': 2.0}})) == 1
+    assert len(table.query(extra_spec={'time': {'$exists': True}})) == 1
+    assert len(table.query(extra_spec={'not_exists': 1})) == 0
+    assert table.max_of('DateTime', 'identity1') == datetime(2000, 1, 2)
+
+    # The new table object of the same table sees the new columns
+    table2 = SqliteItkvTable(client, 'TestDatabase', 'TestTable')
+    table2.upsert('identity2', '2000-01-01', {'new_key': 'value'})
+    table.upsert('identity2', '2000-01-01', {'new_key': 'value2'})
+    assert table.query('identity2')[0]['new_key'] == 'value2'
+
+    connection, _ = client.database('TestDatabase')
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    client.close()
+
+
+def test_unique_index():
+    client = __prepare_test_client()
+    table = SqliteItkvTable(client, 'TestDatabase', 'TestTable')
+    table.set_unique_index([])
+    table.bulk_insert('identity1', '2000-01-01', {'close': 1.0})
+    table.bulk_flush()
+    # Duplicated insert falls back to upsert
+    table.bulk_insert('identity1', '2000-01-01', {'close': 2.0})
+    table.bulk_insert('identity1', '2000-01-02', {'close': 3.0})
+    table.bulk_flush()
+    assert table.count() == 2
+    assert table.query('identity1', '2000-01-01', '2000-01-01')[0]['close'] == 2.0
+    client.close()
+
+
+def test_entry():
+    test_nosql_rw_cases()
+    test_value_kinds()
+    test_unique_index()
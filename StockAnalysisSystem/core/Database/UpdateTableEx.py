@@ -1,38 +1,214 @@
 import traceback
+import threading
 from pymongo import MongoClient
 
 from .NoSqlRw import *
+from .SqliteItkvTable import SqliteClient, SqliteItkvTable
 from ..Utiltity.time_utility import *
+from ..Utiltity.date_parser import parse_time
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+# Write-behind: Between begin_write_behind() and end_write_behind(), the updates are coalesced in memory
+#   (min of since, max of until and last_update) and written by one bulk write per WRITE_BEHIND_BATCH tags.
+# The update record is the bookkeeping of persisted data, which is written before it.
+#   So a lost flush only makes the next update fetch the data again.
+# One flush at a time. The entries being flushed are still visible to the getters until they're written.
+#
+# Empty mark: The collector confirmed that (tags, empty_since - empty_until) has no data at empty_at.
+#   It's stored in the same record (fields: empty_since, empty_until, empty_at). The last write wins.
+#   It's outdated once new data comes (last_update > empty_at). The expiration is decided by the reader.
+# ----------------------------------------------------------------------------------------------------------------------
+
 class UpdateTableEx:
-    def __init__(self, client: MongoClient, database: str = 'StockAnalysisSystem', table: str = 'UpdateTable'):
-        self.__table = ItkvTable(client, database, table, 'tags', 'last_update')
+    WRITE_BEHIND_BATCH = 200
+
+    def __init__(self, client: MongoClient or SqliteClient,
+                 database: str = 'StockAnalysisSystem', table: str = 'UpdateTable'):
+        self.__database = database
+        self.__table_name = table
+        self.__table = self.__build_table(client)
+
+        self.__lock = threading.RLock()
+        self.__write_behind = 0
+        # normalized tags -> {'since': datetime, 'until': datetime, 'last_update': datetime}
+        self.__pending = {}
+        # normalized tags -> {'empty_since': datetime, 'empty_until': datetime, 'empty_at': datetime}
+        self.__pending_marks = {}
+        # The entries being written by flush(), the same layout as above
+        self.__flushing = {}
+        self.__flushing_marks = {}
+        self.__flush_lock = threading.Lock()
+
+    def __build_table(self, client: MongoClient or SqliteClient):
+        if isinstance(client, SqliteClient):
+            return SqliteItkvTable(client, self.__database, self.__table_name, 'tags', 'last_update')
+        else:
+            return ItkvTable(client, self.__database, self.__table_name, 'tags', 'last_update')
+
+    def rebind_client(self, client: MongoClient or SqliteClient):
+        """
+        Switch to a new client (e.g. rebuilt after fork). The buffered updates are kept and written by the new client.
+        """
+        with self.__flush_lock:
+            self.__table = self.__build_table(client)
+
+    # -------------------------------- Write Behind --------------------------------
+
+    def begin_write_behind(self):
+        """
+        Buffer the updates until end_write_behind(). It can be nested (by concurrent tasks).
+        """
+        with self.__lock:
+            self.__write_behind += 1
+
+    def end_write_behind(self) -> bool:
+        with self.__lock:
+            self.__write_behind = max(self.__write_behind - 1, 0)
+        return self.flush()
+
+    def flush(self) -> bool:
+        """
+        Write the buffered updates by one bulk write.
+        """
+        with self.__flush_lock:
+            with self.__lock:
+                pending, pending_marks = self.__pending, self.__pending_marks
+                self.__pending, self.__pending_marks = {}, {}
+                self.__flushing, self.__flushing_marks = pending, pending_marks
+            try:
+                return self.__flush(pending, pending_marks)
+            finally:
+                with self.__lock:
+                    self.__flushing, self.__flushing_marks = {}, {}
+
+    def __flush(self, pending: dict, pending_marks: dict) -> bool:
+        if len(pending) == 0 and len(pending_marks) == 0:
+            return True
+        for tags, mark in pending_marks.items():
+            self.__table.bulk_upsert(tags, None, mark)
+        if isinstance(self.__table, SqliteItkvTable):
+            return self.__flush_by_read_merge(pending)
+        for tags, fields in pending.items():
+            self.__table.bulk_min_max(tags, None,
+                                      {key: fields[key] for key in ['since'] if key in fields},
+                                      {key: fields[key] for key in ['until', 'last_update'] if key in fields})
+        return self.__table.bulk_flush() is not None
+
+    def __flush_by_read_merge(self, pending: dict) -> bool:
+        # The embedded table is accessed only by this process: read existing records by one query then upsert.
+        records = self.__table.query(list(pending.keys()), keys=['tags', 'since', 'until', 'last_update'])
+        existing = {record.get('tags'): record for record in records} if records is not None else {}
+        for tags, fields in pending.items():
+            record = existing.get(tags, {})
+            data = {}
+            for key, value in fields.items():
+                old = record.get(key)
+                if old is None or (value < old if key == 'since' else value > old):
+                    data[key] = value
+            if len(data) > 0:
+                self.__table.bulk_upsert(tags, None, data)
+        self.__table.bulk_flush()
+        return True
+
+    def __buffer_update(self, tags: [str], key: str, value: datetime) -> bool:
+        """
+        :return: False if write-behind is not enabled
+        """
+        with self.__lock:
+            if self.__write_behind == 0:
+                return False
+            fields = self.__pending.setdefault(self.__normalize_tags(tags), {})
+            old = fields.get(key)
+            if old is None or (value < old if key == 'since' else value > old):
+                fields[key] = value
+            full = len(self.__pending) + len(self.__pending_marks) >= UpdateTableEx.WRITE_BEHIND_BATCH
+        if full:
+            self.flush()
+        return True
+
+    def __pending_value(self, tags: [str], key: str, value: datetime or None) -> datetime or None:
+        tags = self.__normalize_tags(tags)
+        with self.__lock:
+            values = [value, self.__flushing.get(tags, {}).get(key), self.__pending.get(tags, {}).get(key)]
+        values = [v for v in values if v is not None]
+        if len(values) == 0:
+            return None
+        return min(values) if key == 'since' else max(values)
 
     # ------------------------------------ Gets ------------------------------------
 
     def get_since(self, tags: [str]):
         record = self.__table.query(self.__normalize_tags(tags), keys=['since'])
-        return record[0].get('since') if record is not None and len(record) > 0 else None
+        return self.__pending_value(tags, 'since',
+                                    record[0].get('since') if record is not None and len(record) > 0 else None)
 
     def get_until(self, tags: [str]):
         record = self.__table.query(self.__normalize_tags(tags), keys=['until'])
-        return record[0].get('until') if record is not None and len(record) > 0 else None
+        return self.__pending_value(tags, 'until',
+                                    record[0].get('until') if record is not None and len(record) > 0 else None)
 
     def get_since_until(self, tags: [str]):
-        record = self.__table.query(self.__normalize_tags(tags), keys=['since', 'until'])
-        return record[0].get('since') if record is not None and len(record) > 0 else None, \
-               record[0].get('until') if record is not None and len(record) > 0 else None
+        since, until, _ = self.get_all_time(tags)
+        return since, until
 
     def get_last_update_time(self, tags: [str]):
         record = self.__table.query(self.__normalize_tags(tags), keys=['last_update'])
-        return record[0].get('last_update') if record is not None and len(record) > 0 else None
+        return self.__pending_value(tags, 'last_update',
+                                    record[0].get('last_update') if record is not None and len(record) > 0 else None)
 
     def get_all_time(self, tags: [str]):
         record = self.__table.query(self.__normalize_tags(tags), keys=['since', 'until', 'last_update'])
-        return record[0].get('since') if record is not None and len(record) > 0 else None, \
-               record[0].get('until') if record is not None and len(record) > 0 else None, \
-               record[0].get('last_update') if record is not None and len(record) > 0 else None
+        record = record[0] if record is not None and len(record) > 0 else {}
+        return self.__pending_value(tags, 'since', record.get('since')), \
+            self.__pending_value(tags, 'until', record.get('until')), \
+            self.__pending_value(tags, 'last_update', record.get('last_update'))
+
+    def get_last_update_times(self, tags_list: [[str]]) -> dict:
+        """
+        Get the last update time of multiple tags by one query.
+        :return: dict - normalized tags -> last update time. The tags without record are not included.
+        """
+        if len(tags_list) == 0:
+            return {}
+        records = self.__table.query([self.__normalize_tags(tags) for tags in tags_list],
+                                     keys=['tags', 'last_update'])
+        result = {record.get('tags'): record.get('last_update') for record in records
+                  if record.get('last_update') is not None} if records is not None else {}
+        with self.__lock:
+            for pending in [self.__flushing, self.__pending]:
+                for tags, fields in pending.items():
+                    if 'last_update' in fields:
+                        result[tags] = max(result.get(tags, fields['last_update']), fields['last_update'])
+        return result
+
+    def get_empty_marks(self, tags_list: [[str]]) -> dict:
+        """
+        Get the empty marks of multiple tags by one query.
+        :return: dict - normalized tags -> {'empty_since', 'empty_until', 'empty_at', 'last_update'}.
+                    The tags without empty mark are not included.
+        """
+        if len(tags_list) == 0:
+            return {}
+        keys = [self.__normalize_tags(tags) for tags in tags_list]
+        records = self.__table.query(keys, keys=['tags', 'last_update', 'empty_since', 'empty_until', 'empty_at'])
+        records = {record.get('tags'): record for record in records} if records is not None else {}
+        with self.__lock:
+            # The newer (pending) mark wins
+            pending_marks = {tags: self.__pending_marks.get(tags, self.__flushing_marks.get(tags)) for tags in keys
+                             if tags in self.__pending_marks or tags in self.__flushing_marks}
+        result = {}
+        for tags in keys:
+            record = dict(records.get(tags, {}), **pending_marks.get(tags, {}))
+            if record.get('empty_at') is None:
+                continue
+            result[tags] = {
+                'empty_since': record.get('empty_since'),
+                'empty_until': record.get('empty_until'),
+                'empty_at': record.get('empty_at'),
+                'last_update': self.__pending_value(tags, 'last_update', record.get('last_update')),
+            }
+        return result
 
     def get_update_record(self, tags: [str]):
         return self.__table.query(self.__normalize_tags(tags))
@@ -42,7 +218,9 @@ class UpdateTableEx:
     def update_since(self, tags: [str], since: datetime or str) -> bool:
         if since is None:
             return False
-        since = text_auto_time(since)
+        since = parse_time(since)
+        if self.__buffer_update(tags, 'since', since):
+            return True
         old_since = self.get_since(tags)
         if old_since is None or since < old_since:
             # print('Update since: ' + str(tags) + ' -> ' + str(since))
@@ -52,7 +230,9 @@ class UpdateTableEx:
     def update_until(self, tags: [str], until: datetime or str) -> bool:
         if until is None:
             return False
-        until = text_auto_time(until)
+        until = parse_time(until)
+        if self.__buffer_update(tags, 'until', until):
+            return True
         old_until = self.get_until(tags)
         if old_until is None or until > old_until:
             # print('Update until: ' + str(tags) + ' -> ' + str(until))
@@ -66,19 +246,54 @@ class UpdateTableEx:
 
     def update_latest_update_time(self, tags: [str]) -> bool:
         # print('Update latest update time: ' + str(tags) + ' -> ' + str(now()))
+        if self.__buffer_update(tags, 'last_update', now()):
+            return True
         self.__table.upsert(self.__normalize_tags(tags), None, data={'last_update': now()})
         return True
 
+    def mark_empty(self, tags: [str], since: datetime or str, until: datetime or str) -> bool:
+        """
+        Record that the range of tags is confirmed empty by collector now.
+        """
+        mark = {
+            'empty_since': parse_time(since) if since is not None else None,
+            'empty_until': parse_time(until) if until is not None else None,
+            'empty_at': now(),
+        }
+        with self.__lock:
+            if self.__write_behind > 0:
+                self.__pending_marks[self.__normalize_tags(tags)] = mark
+                full = len(self.__pending) + len(self.__pending_marks) >= UpdateTableEx.WRITE_BEHIND_BATCH
+            else:
+                full = None
+        if full is None:
+            self.__table.upsert(self.__normalize_tags(tags), None, data=mark)
+        elif full:
+            self.flush()
+        return True
+
     def delete_update_record(self, tags: [str]) -> bool:
-        self.__table.delete(self.__normalize_tags(tags))
+        # Wait for the flush in progress, otherwise it may write the record back after deletion
+        with self.__flush_lock:
+            with self.__lock:
+                self.__pending.pop(self.__normalize_tags(tags), None)
+                self.__pending_marks.pop(self.__normalize_tags(tags), None)
+            self.__table.delete(self.__normalize_tags(tags))
         return True
 
     def clear_update_records(self) -> bool:
-        self.__table.drop()
+        with self.__flush_lock:
+            with self.__lock:
+                self.__pending.clear()
+                self.__pending_marks.clear()
+            self.__table.drop()
         return True
 
     # ------------------------------------------------------------------------------------------------------------------
 
+    def normalize_tags(self, tags: [str]) -> str:
+        return self.__normalize_tags(tags)
+
     def __normalize_tags(self, tags: [str]) -> str:
         return ('.'.join(tags)).replace(' ', '') if isinstance(tags, (list, tuple)) else str(tags).strip()
 
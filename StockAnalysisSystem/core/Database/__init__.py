@@ -1,6 +1,9 @@
 __all__ = [
+    'BucketItkvTable',
     'DatabaseEntry',
+    'LocalColumnarTier',
     'NoSqlRw',
+    'SqliteItkvTable',
     'SqlRw',
     'UpdateTableEx',
     'XListTable',
@@ -104,6 +104,8 @@ class StockAnalysisSystem(metaclass=ThreadSafeSingleton):
         from .AnalyzerEntry import StrategyEntry
         from .Database.DatabaseEntry import DatabaseEntry
         from .Utiltity.plugin_manager import PluginManager
+        from .Utiltity.CollectorUtility import config_ts_rate_limit_tier, TS_RATE_LIMIT_DEFAULT_TIER
+        from .DataHub.CollectorResponseCache import CollectorResponseCache, MODE_CACHE
 
         if not not_load_config:
             if not self.__config.load_config(config_file_path):
@@ -125,6 +127,8 @@ class StockAnalysisSystem(metaclass=ThreadSafeSingleton):
                 os.environ[proxy_protocol] = ''
                 print('Clear proxy: %s' % proxy_protocol)
 
+        config_ts_rate_limit_tier(self.__config.get('TS_RATE_LIMIT_TIER', TS_RATE_LIMIT_DEFAULT_TIER))
+
         self.__database_entry = DatabaseEntry()
 
         if not self.__database_entry.config_sql_db(sqlite_data_path):
@@ -132,13 +136,28 @@ class StockAnalysisSystem(metaclass=ThreadSafeSingleton):
             # Just ignore it.
             # return False
 
-        if not self.__database_entry.config_nosql_db(self.__config.get('NOSQL_DB_HOST'),
-                                                     self.__config.get('NOSQL_DB_PORT'),
-                                                     self.__config.get('NOSQL_DB_USER'),
-                                                     self.__config.get('NOSQL_DB_PASS')):
+        if self.__config.get('NOSQL_DB_BACKEND') == 'sqlite':
+            nosql_db_path = self.__config.get('NOSQL_DB_PATH')
+            if not str_available(nosql_db_path):
+                nosql_db_path = os.path.join(sqlite_data_path, 'NoSql')
+            if not self.__database_entry.config_embedded_db(nosql_db_path):
+                self.__log_errors.append('Config embedded NoSql database fail.')
+                return False
+        elif not self.__database_entry.config_nosql_db(self.__config.get('NOSQL_DB_HOST'),
+                                                       self.__config.get('NOSQL_DB_PORT'),
+                                                       self.__config.get('NOSQL_DB_USER'),
+                                                       self.__config.get('NOSQL_DB_PASS'),
+                                                       self.__config.get_int('NOSQL_DB_POOL_SIZE', 50),
+                                                       self.__config.get_int('NOSQL_DB_IDLE_MS', 60 * 1000),
+                                                       self.__config.get_int('NOSQL_DB_HEALTH_CHECK_S', 0)):
             self.__log_errors.append('Config NoSql database fail.')
             return False
 
+        local_tier_path = self.__config.get('LOCAL_TIER_PATH')
+        if str_available(local_tier_path):
+            if not self.__database_entry.config_local_tier(local_tier_path):
+                self.__log_errors.append('Config local columnar tier fail...Ignore')
+
         factor_plugin = PluginManager()
         strategy_plugin = PluginManager()
         collector_plugin = PluginManager()
@@ -177,6 +196,12 @@ class StockAnalysisSystem(metaclass=ThreadSafeSingleton):
         # extension_plugin.refresh()
 
         self.__data_hub_entry = DataHubEntry(self.__database_entry, collector_plugin)
+        self.__data_hub_entry.get_data_center().set_query_cache_budget(
+            self.__config.get_int('QUERY_CACHE_MB', 256) * 1024 * 1024)
+        response_cache_path = self.__config.get('RESPONSE_CACHE_PATH')
+        if str_available(response_cache_path):
+            self.__data_hub_entry.get_data_center().set_response_cache(CollectorResponseCache(
+                response_cache_path, self.__config.get('RESPONSE_CACHE_MODE', MODE_CACHE)))
         self.__strategy_entry = StrategyEntry(strategy_plugin, self.__data_hub_entry, self.__database_entry)
 
         from .FactorEntry import FactorCenter
@@ -198,6 +223,8 @@ class StockAnalysisSystem(metaclass=ThreadSafeSingleton):
     def finalize(self):
         self.__task_queue.quit()
         self.__task_queue.join(5)
+        if self.__database_entry is not None:
+            self.__database_entry.release()
 
     # -------------------------------------------- Entry --------------------------------------------
 
@@ -5,6 +5,7 @@ import pandas as pd
 from .common import *
 from .df_utility import *
 from .time_utility import *
+from .date_parser import parse_time
 from ..DataHubEntry import DataHubEntry
 from ..Database.DatabaseEntry import DatabaseEntry
 
@@ -92,7 +93,7 @@ class AnalysisResult:
 
     def unpack(self, data: dict):
         period = data.get('period', 'None')
-        self.period = None if period == 'None' else text_auto_time(period)
+        self.period = None if period == 'None' else parse_time(period)
 
         self.method = data.get('analyzer', '')
         self.securities = data.get('stock_identity', '')
@@ -310,27 +311,28 @@ def batch_query_readable_annual_report_pattern(
         fields_income_statement: [str] = None,
         fields_cash_flow_statement: [str] = None) -> (pd.DataFrame, AnalysisResult):
 
-    df = None
-    if fields_balance_sheet is not None and len(fields_balance_sheet) > 0:
-        df_balance, result = query_readable_annual_report_pattern(
-            data_hub, 'Finance.BalanceSheet', securities, time_serial, fields_balance_sheet)
-        if result is not None:
-            return df, result
-        df = df_balance
+    reports = [(uri, fields) for uri, fields in [('Finance.BalanceSheet', fields_balance_sheet),
+                                                 ('Finance.IncomeStatement', fields_income_statement),
+                                                 ('Finance.CashFlowStatement', fields_cash_flow_statement)]
+               if fields is not None and len(fields) > 0]
 
-    if fields_income_statement is not None and len(fields_income_statement) > 0:
-        df_income, result = query_readable_annual_report_pattern(
-            data_hub, 'Finance.IncomeStatement', securities, time_serial, fields_income_statement)
-        if result is not None:
-            return df, result
-        df = df_income if df is None else (pd.merge(df, df_income, how='left', on=['stock_identity', 'period']))
+    data_center = data_hub.get_data_center()
+    for uri, fields in reports:
+        if not data_center.check_readable_name(fields):
+            return None, AnalysisResult(securities, None, AnalysisResult.SCORE_NOT_APPLIED,
+                                        'Unknown readable name detect.')
 
-    if fields_cash_flow_statement is not None and len(fields_cash_flow_statement) > 0:
-        df_cash, result = query_readable_annual_report_pattern(
-            data_hub, 'Finance.CashFlowStatement', securities, time_serial, fields_cash_flow_statement)
+    # Prefetch all reports concurrently
+    dfs = data_center.query_batch([(uri, securities, time_serial,
+                                    {'fields': list(set(fields + ['stock_identity', 'period'])), 'readable': True})
+                                   for uri, fields in reports])
+
+    df = None
+    for df_report in dfs:
+        df_report, result = __annual_report_pattern(df_report, securities, time_serial)
         if result is not None:
             return df, result
-        df = df_cash if df is None else (pd.merge(df, df_cash, how='left', on=['stock_identity', 'period']))
+        df = df_report if df is None else (pd.merge(df, df_report, how='left', on=['stock_identity', 'period']))
     df = df.sort_values('period')
     return df, None
 
@@ -356,6 +358,10 @@ def query_readable_annual_report_pattern(data_hub, uri: str, securities: str, ti
 
     fields_stripped = list(set(fields + ['stock_identity', 'period']))
     df = data_hub.get_data_center().query(uri, securities, time_serial, fields=fields_stripped, readable=True)
+    return __annual_report_pattern(df, securities, time_serial)
+
+
+def __annual_report_pattern(df: pd.DataFrame, securities: str, time_serial: tuple) -> (pd.DataFrame, AnalysisResult):
     if df is None or len(df) == 0:
         return None, AnalysisResult(securities, None, AnalysisResult.SCORE_NOT_APPLIED,
                                     'No data, skipped' + str(time_serial))
@@ -1,3 +1,5 @@
+import time
+import threading
 import pandas as pd
 from os import path
 
@@ -117,6 +119,155 @@ def pickup_bao_code(kwargs: dict) -> str:
     return code_exchange_to_bao_code(code, exchange)
 
 
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                     Rate Limit
+# One shared limiter for all collector plugins, so the plugins using the same account share the quota of each endpoint.
+# ----------------------------------------------------------------------------------------------------------------------
+
+class TokenBucket:
+    """
+    Thread-safe token bucket (implemented as GCRA). The callers are served in the order of acquiring.
+    The calls in any 60 seconds never exceed quota, the first burst calls are not delayed.
+    """
+    def __init__(self, quota_per_minute: int, burst: int = 1):
+        burst = max(min(burst, quota_per_minute - 1), 1)
+        self.__interval = 60.0 / max(quota_per_minute - burst, 1)
+        self.__tolerance = self.__interval * (burst - 1)
+        self.__quota = quota_per_minute
+        self.__burst = burst
+        # Theoretical arrival time of next call
+        self.__tat = 0.0
+        self.__lock = threading.Lock()
+
+        self.__calls = 0
+        self.__throttled = 0
+        self.__wait_seconds = 0.0
+        self.__max_wait = 0.0
+
+    def acquire(self, tokens: int = 1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, tokens: int = 1) -> float:
+        """
+        Reserve the tokens without blocking.
+        :return: The seconds that the caller should wait before the call
+        """
+        with self.__lock:
+            now = time.monotonic()
+            tat = max(self.__tat, now)
+            wait = max(tat + self.__interval * (tokens - 1) - self.__tolerance - now, 0.0)
+            self.__tat = tat + self.__interval * tokens
+
+            self.__calls += tokens
+            if wait > 0:
+                self.__throttled += tokens
+                self.__wait_seconds += wait
+                self.__max_wait = max(self.__max_wait, wait)
+        return wait
+
+    def statistics(self) -> dict:
+        """
+        saturation: The ratio of calls which are throttled. Near 1 means the update runs at the quota ceiling.
+        """
+        with self.__lock:
+            return {
+                'quota': self.__quota,
+                'burst': self.__burst,
+                'calls': self.__calls,
+                'throttled': self.__throttled,
+                'saturation': self.__throttled / self.__calls if self.__calls > 0 else 0.0,
+                'wait_seconds': self.__wait_seconds,
+                'max_wait': self.__max_wait,
+            }
+
+
+class RateLimiter:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__buckets = {}
+
+    def config(self, endpoint: str, quota_per_minute: int or None, burst: int = 1):
+        """
+        :param endpoint: The name of endpoint, like 'pro.daily'
+        :param quota_per_minute: The max calls per minute. None or 0 to remove the limit.
+        :param burst: The calls can be made without delay after idle
+        """
+        with self.__lock:
+            if quota_per_minute is None or quota_per_minute <= 0:
+                self.__buckets.pop(endpoint, None)
+            else:
+                self.__buckets[endpoint] = TokenBucket(quota_per_minute, burst)
+
+    def config_table(self, table: dict):
+        """
+        :param table: endpoint -> (quota_per_minute, burst)
+        """
+        for endpoint, (quota_per_minute, burst) in table.items():
+            self.config(endpoint, quota_per_minute, burst)
+
+    def acquire(self, endpoint: str, tokens: int = 1):
+        """
+        Block until the call of endpoint is allowed. No limit if the endpoint is not configured.
+        """
+        with self.__lock:
+            bucket = self.__buckets.get(endpoint)
+        if bucket is not None:
+            bucket.acquire(tokens)
+
+    def statistics(self) -> dict:
+        with self.__lock:
+            buckets = dict(self.__buckets)
+        return {endpoint: bucket.statistics() for endpoint, bucket in buckets.items()}
+
+
+# The quota of tushare pro endpoints, by the score (tier) of account. endpoint -> (quota_per_minute, burst).
+TS_RATE_LIMIT_TIERS = {
+    '2000': {
+        'pro.daily':                (500, 10),
+        'pro.fina_audit':           (60, 2),
+        'pro.balancesheet':         (60, 2),
+        'pro.income':               (60, 2),
+        'pro.cashflow':             (60, 2),
+        'pro.fina_mainbz':          (60, 2),
+        'pro.stk_holdernumber':     (100, 2),
+        'pro.top10_holders':        (50, 2),
+        'pro.top10_floatholders':   (50, 2),
+        'pro.pledge_stat':          (50, 2),
+        'pro.pledge_detail':        (50, 2),
+    },
+    # Score 5000: pro.daily has no limit
+    '5000': {
+        'pro.daily':                (None, 1),
+    },
+}
+TS_RATE_LIMIT_DEFAULT_TIER = '2000'
+
+rate_limiter = RateLimiter()
+rate_limiter.config_table(TS_RATE_LIMIT_TIERS[TS_RATE_LIMIT_DEFAULT_TIER])
+
+
+def config_ts_rate_limit_tier(tier: str) -> bool:
+    """
+    Apply the quota of account tier. The endpoints not specified by the tier use the quota of default tier.
+    """
+    if not str_available(tier):
+        tier = TS_RATE_LIMIT_DEFAULT_TIER
+    if tier not in TS_RATE_LIMIT_TIERS.keys():
+        print('Unknown tushare rate limit tier: %s, use default tier %s.' % (tier, TS_RATE_LIMIT_DEFAULT_TIER))
+        tier = TS_RATE_LIMIT_DEFAULT_TIER
+    rate_limiter.config_table(TS_RATE_LIMIT_TIERS[TS_RATE_LIMIT_DEFAULT_TIER])
+    rate_limiter.config_table(TS_RATE_LIMIT_TIERS[tier])
+    return True
+
+
+def rate_limit(endpoint: str, tokens: int = 1):
+    rate_limiter.acquire(endpoint, tokens)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
 def path_from_plugin_param(**kwargs) -> str:
     uri = kwargs.get('uri')
     file = uri.replace('.', '_')
@@ -136,6 +287,50 @@ def check_execute_dump_flag(result: pd.DataFrame, **kwargs):
         result.to_csv(uri)
 
 
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def test_token_bucket_burst_and_rate():
+    bucket = TokenBucket(600 + 5, 5)
+    waits = [bucket.reserve() for _ in range(10)]
+    # The burst calls are not delayed, then one call per 0.1s
+    assert all(wait == 0 for wait in waits[:5])
+    assert all(abs(waits[i] - 0.1 * (i - 4)) < 0.01 for i in range(5, 10))
+
+    statistics = bucket.statistics()
+    assert statistics['calls'] == 10 and statistics['throttled'] == 5
+    assert statistics['saturation'] == 0.5
+
+
+def test_rate_limiter_threads():
+    limiter = RateLimiter()
+    limiter.config('test.api', 1200 + 1, 1)
+
+    def call():
+        limiter.acquire('test.api')
+        with lock:
+            timestamps.append(time.monotonic())
+
+    lock = threading.Lock()
+    timestamps = []
+    threads = [threading.Thread(target=call) for _ in range(10)]
+    clock = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 10 calls at 20 calls per second, never faster than the quota
+    timestamps.sort()
+    assert all(timestamps[i + 1] - timestamps[i] > 0.04 for i in range(9))
+    assert time.monotonic() - clock >= 0.45
+    assert limiter.statistics()['test.api']['calls'] == 10
 
+    # The endpoint without limit
+    limiter.config('test.api', None)
+    limiter.acquire('test.api')
+    assert 'test.api' not in limiter.statistics()
 
 
+def test_entry():
+    test_token_bucket_burst_and_rate()
+    test_rate_limiter_threads()
@@ -131,6 +131,10 @@ class FinanceFactorEngine(FactorEngine):
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+# The identities count of each chunk when calculating factors for the whole market
+FACTOR_CALC_CHUNK = 200
+
+
 def dispatch_calculation_pattern(factor: str, identity: str or [str], time_serial: tuple, mapping: dict,
                                  data_hub: DataHubEntry, database: DatabaseEntry, extra: dict,
                                  FACTOR_TABLE) -> pd.DataFrame or None:
@@ -139,10 +143,31 @@ def dispatch_calculation_pattern(factor: str, identity: str or [str], time_seria
             continue
         provides, depends, comments, entry, _, _, _ = prob
         if factor in provides:
-            return entry(identity, time_serial, mapping, data_hub, database, extra)
+            return calculate_in_chunks(entry, identity, time_serial, mapping, data_hub, database, extra)
     return None
 
 
+def calculate_in_chunks(entry, identity: str or [str], time_serial: tuple, mapping: dict,
+                        data_hub: DataHubEntry, database: DatabaseEntry, extra: dict) -> pd.DataFrame or None:
+    """
+    Calculate the factor of multiple stocks chunk by chunk, only the factor result of each chunk is kept.
+    Empty identity means all stocks.
+    """
+    if isinstance(identity, str) and identity != '':
+        return entry(identity, time_serial, mapping, data_hub, database, extra)
+    identities = list(identity) if isinstance(identity, (list, tuple)) else \
+        data_hub.get_data_utility().get_stock_identities()
+    if len(identities) <= FACTOR_CALC_CHUNK:
+        return entry(identities, time_serial, mapping, data_hub, database, extra)
+
+    results = []
+    for i in range(0, len(identities), FACTOR_CALC_CHUNK):
+        df = entry(identities[i:i + FACTOR_CALC_CHUNK], time_serial, mapping, data_hub, database, extra)
+        if df is not None and len(df) > 0:
+            results.append(df)
+    return pd.concat(results, ignore_index=True) if len(results) > 0 else None
+
+
 def query_finance_pattern(data_hub: DataHubEntry, identity: str,
                           time_serial: tuple, fields: list, mapping: dict) -> pd.DataFrame:
     query_fields = [mapping.get(f, f) for f in fields]
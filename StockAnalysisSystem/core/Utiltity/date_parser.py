@@ -0,0 +1,137 @@
+import datetime
+import functools
+import numpy as np
+import pandas as pd
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+#                                                     Date Parser
+#   parse_time()        : Scalar. Memoized - the same texts (quarter ends, trade dates) are parsed only once.
+#   parse_time_series() : Vector. Sniff the format from samples then parse the whole column by one pd.to_datetime().
+# Both accept the TIME_FORMATS and return None / NaT for the value can not be parsed.
+# ----------------------------------------------------------------------------------------------------------------------
+
+# The formats of text time, in the order of trying. NoSqlRw keeps a copy, change both.
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%H:%M:%S', '%Y%m%d']
+
+# The max different texts memoized by parse_time()
+PARSE_CACHE_SIZE = 16384
+# The count of samples to sniff the format of a column
+SNIFF_SAMPLES = 16
+
+
+def parse_time(value: str or datetime.datetime) -> datetime.datetime or None:
+    """
+    Parse text to datetime by TIME_FORMATS. The datetime is returned as it is.
+    :return: None if the value can not be parsed
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if not isinstance(value, str):
+        return None
+    return __parse_text(value)
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def __parse_text(text: str) -> datetime.datetime or None:
+    for time_format in TIME_FORMATS:
+        # noinspection PyBroadException
+        try:
+            return datetime.datetime.strptime(text, time_format)
+        except Exception:
+            pass
+    return None
+
+
+def parse_cache_info():
+    return __parse_text.cache_info()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def sniff_time_format(texts: [str]) -> str or None:
+    """
+    :return: The first format of TIME_FORMATS which can parse all texts. None if no such format.
+    """
+    for time_format in TIME_FORMATS:
+        # noinspection PyBroadException
+        try:
+            for text in texts:
+                datetime.datetime.strptime(text, time_format)
+            return time_format
+        except Exception:
+            pass
+    return None
+
+
+def parse_time_series(values: pd.Series or np.ndarray or list) -> pd.Series:
+    """
+    Parse the values to datetime64 by TIME_FORMATS, the same result as parse_time() for each value.
+    The datetime64 Series is returned as it is.
+    :return: Series of datetime64, NaT for the value can not be parsed. The index is kept if values is a Series.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    parsed = np.full(len(series), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    is_text = series.map(lambda x: isinstance(x, str)).to_numpy(dtype=bool)
+    positions = np.flatnonzero(is_text)
+    if len(positions) > 0:
+        # Most columns have one format: parse all by the sniffed format, then the rest by the other formats in order.
+        # The formats do not overlap, so the order does not change the result.
+        texts = series.iloc[positions]
+        sniffed = sniff_time_format(texts.iloc[:SNIFF_SAMPLES].tolist())
+        formats = TIME_FORMATS if sniffed is None else [sniffed] + [f for f in TIME_FORMATS if f != sniffed]
+        for time_format in formats:
+            result = pd.to_datetime(texts, format=time_format, errors='coerce')
+            ok = result.notna().to_numpy()
+            parsed[positions[ok]] = result.to_numpy()[ok]
+            positions, texts = positions[~ok], texts[~ok]
+            if len(positions) == 0:
+                break
+
+    # The values which are already datetime
+    is_datetime = ~is_text & series.map(lambda x: isinstance(x, datetime.datetime)).to_numpy(dtype=bool)
+    if is_datetime.any():
+        parsed[is_datetime] = pd.to_datetime(series[is_datetime]).to_numpy()
+    return pd.Series(parsed, index=series.index)
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def test_parse_time():
+    assert parse_time('2020-01-02') == datetime.datetime(2020, 1, 2)
+    assert parse_time('20200102') == datetime.datetime(2020, 1, 2)
+    assert parse_time('2020-01-02 15:00:00') == datetime.datetime(2020, 1, 2, 15)
+    assert parse_time('15:00:00') == datetime.datetime(1900, 1, 1, 15)
+    assert parse_time('bad') is None and parse_time(None) is None and parse_time(20200102) is None
+    now = datetime.datetime.now()
+    assert parse_time(now) is now
+
+    parse_time('2020-03-31')
+    hits = parse_cache_info().hits
+    assert parse_time('2020-03-31') == datetime.datetime(2020, 3, 31)
+    assert parse_cache_info().hits == hits + 1
+
+
+def test_parse_time_series():
+    values = ['2020-01-02', '20200103', '2020-01-06 15:00:00', 'bad', None, datetime.datetime(2020, 1, 7), '09:30:00']
+    parsed = parse_time_series(values)
+    assert parsed.dtype == 'datetime64[ns]'
+    for value, result in zip(values, parsed.tolist()):
+        expect = parse_time(value)
+        assert (pd.isna(result) and expect is None) or result == expect
+
+    # Index is kept
+    series = pd.Series(['2020-01-02', '2020-01-03'], index=[10, 20])
+    assert parse_time_series(series).index.tolist() == [10, 20]
+    # datetime64 as it is
+    series = pd.Series(pd.to_datetime(['2020-01-02']))
+    assert parse_time_series(series) is series
+    assert len(parse_time_series([])) == 0
+
+
+def test_entry():
+    test_parse_time()
+    test_parse_time_series()
@@ -4,6 +4,8 @@ import pandas as pd
 import datetime as datetime
 from os import sys, path
 
+from .date_parser import parse_time_series
+
 
 def get_series_item(series: pd.Series, order: int, default: any = None) -> any:
     slice_list = series.tolist()
@@ -145,6 +147,38 @@ def group_as_dict(df: pd.DataFrame, group_by: str or list) -> pd.DataFrame:
     return df.groupby(group_by, as_index=False).agg(lambda x: {k: v for d in x.dropna() for k, v in d.items()})
 
 
+def text_column_to_datetime(column: pd.Series) -> pd.Series:
+    """
+    Parse a text column as text_auto_time() does, see date_parser.parse_time_series().
+    The values can not be parsed are NaT. The non-text column is returned as it is.
+    """
+    if column.dtype != object and not pd.api.types.is_string_dtype(column):
+        return column
+    return parse_time_series(column)
+
+
+def dataframe_to_records(df: pd.DataFrame, datetime_fields: [str] = None) -> [dict]:
+    """
+    Convert DataFrame to the list of dict (one per row) by column, the NaN values are not included.
+    :param datetime_fields: The text columns to parse as datetime, see text_column_to_datetime()
+    """
+    if df is None or len(df) == 0:
+        return []
+    names = list(df.columns)
+    columns = [df.iloc[:, i] for i in range(len(names))]
+    if datetime_fields is not None:
+        columns = [text_column_to_datetime(column) if name in datetime_fields else column
+                   for name, column in zip(names, columns)]
+    valid = np.column_stack([column.notna().to_numpy() for column in columns])
+    complete = valid.all(axis=1)
+    rows = zip(*[column.tolist() for column in columns])
+    if complete.all():
+        return [dict(zip(names, row)) for row in rows]
+    return [dict(zip(names, row)) if row_complete else
+            {name: value for name, value, ok in zip(names, row, row_valid) if ok}
+            for row, row_complete, row_valid in zip(rows, complete.tolist(), valid.tolist())]
+
+
 # ----------------------------------------------------------------
 
 
@@ -1,5 +1,8 @@
 import time
 import datetime
+import threading
+
+from .date_parser import parse_time
 
 
 def now() -> datetime.datetime:
@@ -92,29 +95,7 @@ def to_py_datetime(dt: any) -> datetime.datetime or None:
 
 
 def text_auto_time(text: str) -> datetime.datetime:
-    if isinstance(text, datetime.datetime):
-        return text
-    # noinspection PyBroadException
-    try:
-        return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S')
-    except Exception:
-        pass
-    # noinspection PyBroadException
-    try:
-        return datetime.datetime.strptime(text, '%Y-%m-%d')
-    except Exception:
-        pass
-    # noinspection PyBroadException
-    try:
-        return datetime.datetime.strptime(text, '%H:%M:%S')
-    except Exception:
-        pass
-    # noinspection PyBroadException
-    try:
-        return datetime.datetime.strptime(text, '%Y%m%d')
-    except Exception:
-        pass
-    return None
+    return parse_time(text)
 
 
 def text2date(text: str) -> datetime.datetime:
@@ -229,6 +210,100 @@ class DateTimeIterator:
         return self.data_range()
 
 
+# ---------------------------------------------- AdaptiveDateTimeIterator ----------------------------------------------
+
+class AdaptiveDateTimeIterator:
+    """
+    Iterate [since, until] by the windows sized for the row cap of an endpoint. The windows do not overlap.
+    Call feedback() with the row count of each window:
+        - Hits the cap: the window is split and fetched again (the response may be truncated).
+        - Far below the cap: the next window grows (at most MAX_GROWTH times).
+    The density (rows per day) learned from the non-empty windows is shared by the iterators of the same key.
+    """
+    MAX_GROWTH = 4
+    FILL_RATE = 0.8
+
+    __densities = {}
+    __lock = threading.Lock()
+
+    def __init__(self, since: datetime.datetime, until: datetime.datetime, row_cap: int,
+                 density: float, key: str = None, min_days: int = 1):
+        """
+        :param row_cap: The max rows of one response
+        :param density: The expected rows per day. Used if nothing learned for the key.
+        :param key: The key to share the learned density, like uri or api name. None to not share.
+        :param min_days: The minimal window size
+        """
+        self.__until = until
+        self.__row_cap = row_cap
+        self.__key = key
+        self.__min_days = max(min_days, 1)
+
+        self.__iter_from = since
+        self.__iter_to = None
+        learned = AdaptiveDateTimeIterator.density_of(key)
+        self.__days = self.__days_of(learned if learned is not None else density)
+        self.__calls = 0
+        self.__splits = 0
+
+    def end(self) -> bool:
+        return self.__iter_from > self.__until
+
+    def calls(self) -> int:
+        return self.__calls
+
+    def splits(self) -> int:
+        return self.__splits
+
+    def next_window(self) -> (datetime.datetime, datetime.datetime):
+        self.__iter_to = min(self.__iter_from + datetime.timedelta(days=self.__days - 1), self.__until)
+        return self.__iter_from, self.__iter_to
+
+    def feedback(self, rows: int) -> bool:
+        """
+        :param rows: The row count of the response of the last window
+        :return: True if the window is accepted. False if it should be fetched again by next_window().
+        """
+        self.__calls += 1
+        days = (self.__iter_to - self.__iter_from).days + 1
+        if rows >= self.__row_cap and days > self.__min_days:
+            self.__days = max(days // 2, self.__min_days)
+            self.__splits += 1
+            return False
+        if rows >= self.__row_cap:
+            print('Window %s - %s hits the row cap %d with minimal size.' %
+                  (self.__iter_from.strftime('%Y-%m-%d'), self.__iter_to.strftime('%Y-%m-%d'), self.__row_cap))
+
+        if rows > 0:
+            AdaptiveDateTimeIterator.learn_density(self.__key, rows / days)
+            self.__days = min(self.__days_of(rows / days), days * AdaptiveDateTimeIterator.MAX_GROWTH)
+        else:
+            self.__days = days * AdaptiveDateTimeIterator.MAX_GROWTH
+        self.__iter_from = self.__iter_to + datetime.timedelta(days=1)
+        return True
+
+    # ------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def density_of(key: str) -> float or None:
+        with AdaptiveDateTimeIterator.__lock:
+            return AdaptiveDateTimeIterator.__densities.get(key) if key is not None else None
+
+    @staticmethod
+    def learn_density(key: str, density: float):
+        if key is None:
+            return
+        with AdaptiveDateTimeIterator.__lock:
+            learned = AdaptiveDateTimeIterator.__densities.get(key)
+            AdaptiveDateTimeIterator.__densities[key] = density if learned is None else (learned + density) / 2
+
+    def __days_of(self, density: float) -> int:
+        if density <= 0:
+            # The whole rest range
+            return max((self.__until - self.__iter_from).days + 1, self.__min_days)
+        return max(int(self.__row_cap * AdaptiveDateTimeIterator.FILL_RATE / density), self.__min_days)
+
+
 
 
 
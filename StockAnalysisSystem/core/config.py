@@ -11,11 +11,23 @@ TS_TOKEN = 'TODO: Place holder, for compatibility.'
 
 class Config:
     CONFIG_DICT = {
+        'NOSQL_DB_BACKEND': 'The NoSql database: "mongodb" (service) or "sqlite" (embedded files). Default "mongodb"',
+        'NOSQL_DB_PATH': 'The path of embedded database files (only for sqlite backend). Default "<project>/Data/NoSql"',
         'NOSQL_DB_HOST': 'The service ip or host name of mongodb service. Default "localhost"',
         'NOSQL_DB_PORT': 'The service port of mongodb service. Default "27017"',
         'NOSQL_DB_USER': 'The user name of mongodb service. Default empty',
         'NOSQL_DB_PASS': 'The password of mongodb service. Default empty',
+        'NOSQL_DB_POOL_SIZE': 'The max connection pool size of mongodb client. Default "50"',
+        'NOSQL_DB_IDLE_MS': 'The idle connection in pool will be closed after this time (ms). Default "60000"',
+        'NOSQL_DB_HEALTH_CHECK_S': 'Ping mongodb service with this interval (s), "0" to disable. Default "0"',
+        'QUERY_CACHE_MB': 'The memory budget (MB) of query result cache, "0" to disable. Default "256"',
+        'LOCAL_TIER_PATH': 'The path of local columnar files for daily trade data (requires pyarrow). Empty to disable',
+        'RESPONSE_CACHE_PATH': 'The path of collector response cache. Empty to disable',
+        'RESPONSE_CACHE_MODE': 'The mode of collector response cache: "cache", "record" (always fetch) or "replay" '
+                               '(no network). Default "cache"',
         'TS_TOKEN': 'The tushare token which can get from https://tushare.pro/',
+        'TS_RATE_LIMIT_TIER': 'The score tier of tushare account for the rate limit of APIs: "2000" or "5000". '
+                              'Default "2000"',
         'PROXY_PROTOCOL': 'The proxy type which should be one of HTTP_PROXY and HTTPS_PROXY. Default empty',
         'PROXY_HOST': 'The proxy host and port. Default empty',
     }
@@ -35,6 +47,15 @@ class Config:
     def get(self, key: str, default_value: str = '') -> str:
         return self.__config_dict.get(key, default_value)
 
+    def get_int(self, key: str, default_value: int = 0) -> int:
+        # noinspection PyBroadException
+        try:
+            return int(self.__config_dict.get(key, default_value))
+        except Exception:
+            return default_value
+        finally:
+            pass
+
     def get_all_config(self) -> dict:
         return self.__config_dict
 
@@ -74,7 +95,10 @@ class Config:
 
     def check_config(self) -> (bool, str):
         success, reason = True, []
+        embedded_db = self.get('NOSQL_DB_BACKEND') == 'sqlite'
         for key, tips in Config.MUST_CONFIG:
+            if embedded_db and key.startswith('NOSQL_DB_'):
+                continue
             if self.get(key) == '':
                 success = False
                 reason.append(tips)
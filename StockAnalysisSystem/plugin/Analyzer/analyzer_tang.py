@@ -45,21 +45,15 @@ def analyzer_stock_portrait(securities: str, time_serial: tuple, data_hub: DataH
     if check_industry_in(securities, ['银行', '保险', '房地产', '全国地产', '区域地产'], data_hub, database, context):
         return AnalysisResult(securities, None, AnalysisResult.SCORE_NOT_APPLIED, '不适用于此行业')
 
-    df_balance, result = query_readable_annual_report_pattern(data_hub, 'Finance.BalanceSheet',
-                                                              securities, time_serial,
-                                                              ['资产总计', '负债合计'])
-    if result is not None:
-        return result
-
-    df_cash, result = query_readable_annual_report_pattern(data_hub, 'Finance.CashFlowStatement',
-                                                           securities, time_serial,
-                                                           ['经营活动产生的现金流量净额',
-                                                            '投资活动产生的现金流量净额',
-                                                            '筹资活动产生的现金流量净额'])
+    df, result = batch_query_readable_annual_report_pattern(
+        data_hub, securities, time_serial,
+        fields_balance_sheet=['资产总计', '负债合计'],
+        fields_cash_flow_statement=['经营活动产生的现金流量净额',
+                                    '投资活动产生的现金流量净额',
+                                    '筹资活动产生的现金流量净额'])
     if result is not None:
         return result
-
-    df = pd.merge(df_balance, df_cash, how='left', on=['stock_identity', 'period'])
+    df = df.sort_values('period', ascending=False)
 
     results = []
     for index, row in df.iterrows():
@@ -35,9 +35,6 @@ def plugin_capacities() -> list:
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-delayer_fina_mainbz = Delayer(1000)
-
-
 def __fetch_business_data(**kwargs) -> pd.DataFrame:
     uri = kwargs.get('uri')
     result = check_execute_test_flag(**kwargs)
@@ -61,7 +58,7 @@ def __fetch_business_data(**kwargs) -> pd.DataFrame:
         for year in range(since_year, until_year):
             ts_date = '%02d1231' % year
             # 抱歉，您每分钟最多访问该接口60次
-            delayer_fina_mainbz.delay()
+            rate_limit('pro.fina_mainbz')
             sub_result = pro.fina_mainbz(ts_code=ts_code, start_date=ts_date, end_date=ts_date)
             result = pd.concat([result, sub_result])
         print('%s: [%s] - Network finished, time spending: %sms' % (uri, ts_code, clock.elapsed_ms()))
@@ -346,11 +346,6 @@ def plugin_capacities() -> list:
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-# For the sake of "抱歉，您每分钟最多访问该接口60次"
-
-delayer = Delayer(1000)
-
-
 def __fetch_finance_data(**kwargs) -> pd.DataFrame:
     uri = kwargs.get('uri')
     result = check_execute_test_flag(**kwargs)
@@ -369,19 +364,23 @@ def __fetch_finance_data(**kwargs) -> pd.DataFrame:
         fields_list = list(FIELDS[uri].keys())
         field_joined = ','.join(fields_list)
 
+        # For the sake of "抱歉，您每分钟最多访问该接口60次", the quota is configured in CollectorUtility
         clock = Clock()
-        delayer.delay()
         if uri == 'Finance.Audit':
             # Score 500; Update Na; No limit;
+            rate_limit('pro.fina_audit')
             result = pro.fina_audit(ts_code=ts_code, start_date=ts_since, end_date=ts_until, fields=field_joined)
         elif uri == 'Finance.BalanceSheet':
             # Score 500; Update Na; No limit;
+            rate_limit('pro.balancesheet')
             result = pro.balancesheet(ts_code=ts_code, start_date=ts_since, end_date=ts_until, fields=field_joined)
         elif uri == 'Finance.IncomeStatement':
             # Score 500; Update Na; No limit;
+            rate_limit('pro.income')
             result = pro.income(ts_code=ts_code, start_date=ts_since, end_date=ts_until, fields=field_joined)
         elif uri == 'Finance.CashFlowStatement':
             # Score 500; Update Na; No limit;
+            rate_limit('pro.cashflow')
             result = pro.cashflow(ts_code=ts_code, start_date=ts_since, end_date=ts_until, fields=field_joined)
         else:
             result = None
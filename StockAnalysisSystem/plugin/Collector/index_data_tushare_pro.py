@@ -57,12 +57,12 @@ def __fetch_index_data_daily(**kwargs) -> pd.DataFrame:
         since, until = normalize_time_serial(period, default_since(), today())
 
         pro = ts.pro_api(TS_TOKEN)
-        time_iter = DateTimeIterator(since, until)
+        # 8000 items per one time, about 245 trade days per year
+        time_iter = AdaptiveDateTimeIterator(since, until, row_cap=8000, density=245 / 365, key='pro.index_daily')
 
         result = None
         while not time_iter.end():
-            # 8000 items per one time
-            sub_since, sub_until = time_iter.iter_years(25)
+            sub_since, sub_until = time_iter.next_window()
             ts_since = sub_since.strftime('%Y%m%d')
             ts_until = sub_until.strftime('%Y%m%d')
 
@@ -70,6 +70,9 @@ def __fetch_index_data_daily(**kwargs) -> pd.DataFrame:
             sub_result = pro.index_daily(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
             print('%s: [%s] - Network finished, time spending: %sms' % (uri, ts_code, clock.elapsed_ms()))
 
+            if not time_iter.feedback(len(sub_result) if sub_result is not None else 0):
+                continue
+
             result = pd.concat([result, sub_result], ignore_index=True)
 
     check_execute_dump_flag(result, **kwargs)
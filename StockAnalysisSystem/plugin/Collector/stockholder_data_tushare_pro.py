@@ -62,9 +62,6 @@ def plugin_capacities() -> list:
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-delayer = Delayer(1200)
-
-
 def __fetch_stock_holder_data(**kwargs) -> pd.DataFrame:
     uri = kwargs.get('uri')
     result = check_execute_test_flag(**kwargs)
@@ -104,10 +101,11 @@ def __fetch_stock_holder_data(**kwargs) -> pd.DataFrame:
         #             result.append(result)
 
         clock = Clock()
-        delayer.delay()
         if uri == 'Stockholder.PledgeStatus':
+            rate_limit('pro.pledge_stat')
             result = pro.pledge_stat(ts_code=ts_code)
         elif uri == 'Stockholder.PledgeHistory':
+            rate_limit('pro.pledge_detail')
             result = pro.pledge_detail(ts_code=ts_code)
         else:
             result = None
@@ -138,10 +136,6 @@ def __fetch_stock_holder_data(**kwargs) -> pd.DataFrame:
     return result
 
 
-# stk_holdernumber() : 100 times per 1 min
-delayer_stock_holder_statistics = Delayer(600)
-
-
 def __fetch_stock_holder_statistics_piece(**kwargs) -> pd.DataFrame or None:
     uri = kwargs.get('uri')
     result = check_execute_test_flag(**kwargs)
@@ -160,9 +154,11 @@ def __fetch_stock_holder_statistics_piece(**kwargs) -> pd.DataFrame or None:
         ts_since = since.strftime('%Y%m%d')
         ts_until = until.strftime('%Y%m%d')
 
-        delayer_stock_holder_statistics.delay()
+        rate_limit('pro.stk_holdernumber')
         result_count = pro.stk_holdernumber(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
+        rate_limit('pro.top10_holders')
         result_top10 = pro.top10_holders(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
+        rate_limit('pro.top10_floatholders')
         result_top10_nt = pro.top10_floatholders(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
 
         # 002978.SZ
@@ -269,24 +265,30 @@ def __fetch_stock_holder_statistics_full(**kwargs) -> pd.DataFrame or None:
 
         clock = Clock()
         pro = ts.pro_api(TS_TOKEN)
-        time_iter = DateTimeIterator(since, until)
+        # Top10 api can only fetch 100 items per one time, 10 holders per quarter
+        time_iter = AdaptiveDateTimeIterator(since, until, row_cap=100, density=40 / 365, key='pro.top10_holders')
 
         ts_since = since.strftime('%Y%m%d')
         ts_until = until.strftime('%Y%m%d')
+        rate_limit('pro.stk_holdernumber')
         result_count = pro.stk_holdernumber(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
 
         result_top10 = None
         result_top10_nt = None
         while not time_iter.end():
-            # Top10 api can only fetch 100 items per one time (100 / 10 / 4 = 2.5Years)
-            sub_since, sub_until = time_iter.iter_years(2.4)
+            sub_since, sub_until = time_iter.next_window()
             ts_since = sub_since.strftime('%Y%m%d')
             ts_until = sub_until.strftime('%Y%m%d')
-            delayer.delay()
 
+            rate_limit('pro.top10_holders')
             result_top10_part = pro.top10_holders(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
+            rate_limit('pro.top10_floatholders')
             result_top10_nt_part = pro.top10_floatholders(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
 
+            if not time_iter.feedback(max([len(df) if df is not None else 0
+                                           for df in [result_top10_part, result_top10_nt_part]])):
+                continue
+
             result_top10 = pd.concat([result_top10, result_top10_part])
             result_top10_nt = pd.concat([result_top10_nt, result_top10_nt_part])
 
@@ -69,9 +69,6 @@ def plugin_capacities() -> list:
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-ts_daily_delay = Delayer(int(60 * 1000 / 500))
-
-
 def __fetch_trade_data_daily(**kwargs) -> pd.DataFrame:
     uri = kwargs.get('uri')
     result = check_execute_test_flag(**kwargs)
@@ -83,11 +80,19 @@ def __fetch_trade_data_daily(**kwargs) -> pd.DataFrame:
         since, until = normalize_time_serial(period, default_since(), today())
 
         pro = ts.pro_api(TS_TOKEN)
-        time_iter = DateTimeIterator(since, until)
+
+        if not str_available(ts_code):
+            # Market-wide mode: one query per trade date returns the data of all stocks
+            result = __fetch_trade_data_market(pro, uri, since, until)
+            check_execute_dump_flag(result, **kwargs)
+            return __post_process_trade_data(result)
+
+        # daily() returns at most 5000 rows per query, about 245 trade days per year
+        time_iter = AdaptiveDateTimeIterator(since, until, row_cap=5000, density=245 / 365, key='pro.daily')
 
         result = None
         while not time_iter.end():
-            sub_since, sub_until = time_iter.iter_years(20)
+            sub_since, sub_until = time_iter.next_window()
             ts_since = sub_since.strftime('%Y%m%d')
             ts_until = sub_until.strftime('%Y%m%d')
 
@@ -96,7 +101,7 @@ def __fetch_trade_data_daily(**kwargs) -> pd.DataFrame:
 
             # Score: Na; Update 15:00 ~ 16:00; 500 queries per one min, 5000 data per one time;
             # Score: 5000 - No limit.
-            ts_daily_delay.delay()
+            rate_limit('pro.daily')
             result_daily = pro.daily(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
             # Score: Na; Update: 09:30; No limit
             result_adjust = pro.adj_factor(ts_code=ts_code, start_date=ts_since, end_date=ts_until)
@@ -105,6 +110,11 @@ def __fetch_trade_data_daily(**kwargs) -> pd.DataFrame:
 
             print('%s: [%s] - Network finished, time spending: %sms' % (uri, ts_code, clock.elapsed_ms()))
 
+            if not time_iter.feedback(max([len(df) if df is not None else 0
+                                           for df in [result_daily, result_adjust, result_index]])):
+                # The response may be truncated, fetch again with a smaller window
+                continue
+
             sub_result = None
             sub_result = merge_on_columns(sub_result, result_daily, ['ts_code', 'trade_date'])
             sub_result = merge_on_columns(sub_result, result_adjust, ['ts_code', 'trade_date'])
@@ -114,6 +124,40 @@ def __fetch_trade_data_daily(**kwargs) -> pd.DataFrame:
 
     check_execute_dump_flag(result, **kwargs)
 
+    return __post_process_trade_data(result)
+
+
+def __fetch_trade_data_market(pro, uri: str, since: datetime.datetime, until: datetime.datetime) -> pd.DataFrame:
+    ts_since = since.strftime('%Y%m%d')
+    ts_until = until.strftime('%Y%m%d')
+    calendar = pro.trade_cal(exchange='SSE', start_date=ts_since, end_date=ts_until, is_open='1')
+    if calendar is None:
+        return None
+    if len(calendar) == 0:
+        # Closed days: respond an empty result. None means the fetch fails.
+        return pd.DataFrame(columns=['ts_code', 'trade_date'])
+
+    result = None
+    for trade_date in sorted(calendar['cal_date'].tolist()):
+        clock = Clock()
+
+        rate_limit('pro.daily')
+        result_daily = pro.daily(trade_date=trade_date)
+        result_adjust = pro.adj_factor(trade_date=trade_date)
+        result_index = pro.daily_basic(trade_date=trade_date)
+
+        print('%s: [%s] - Network finished, time spending: %sms' % (uri, trade_date, clock.elapsed_ms()))
+
+        sub_result = None
+        sub_result = merge_on_columns(sub_result, result_daily, ['ts_code', 'trade_date'])
+        sub_result = merge_on_columns(sub_result, result_adjust, ['ts_code', 'trade_date'])
+        sub_result = merge_on_columns(sub_result, result_index, ['ts_code', 'trade_date'])
+
+        result = pd.concat([result, sub_result], ignore_index=True)
+    return result
+
+
+def __post_process_trade_data(result: pd.DataFrame) -> pd.DataFrame:
     if result is not None:
         result['stock_identity'] = result['ts_code']
         result['stock_identity'] = result['stock_identity'].str.replace('.SH', '.SSE')
@@ -336,22 +336,27 @@ class ChartLab(QWidget):
         # df['财务费用正'] = df['减:财务费用'].apply(lambda x: x if x > 0 else 0)
         # df['三费'] = df['减:销售费用'] + df['减:管理费用'] + df['财务费用正']
 
-        df = self.__data_utility.auto_query('', period,
-                                            ['减:财务费用', '减:销售费用', '减:管理费用',
-                                             '营业总收入', '营业收入', '减:营业成本'],
-                                            ['stock_identity', 'period'])
-
-        df['毛利润'] = df['营业收入'] - df['减:营业成本']
-        df['财务费用正'] = df['减:财务费用'].apply(lambda x: x if x > 0 else 0)
-        df['三费'] = df['减:销售费用'] + df['减:管理费用'] + df['财务费用正']
-
-        s1 = df['三费'] / df['营业总收入']
+        # Query and calculate by chunks, only keep the ratios of each chunk
+        s1_chunks, s2_chunks = [], []
+        for df in self.__data_utility.auto_query_iter('', period,
+                                                      ['减:财务费用', '减:销售费用', '减:管理费用',
+                                                       '营业总收入', '营业收入', '减:营业成本'],
+                                                      ['stock_identity', 'period']):
+            df['毛利润'] = df['营业收入'] - df['减:营业成本']
+            df['财务费用正'] = df['减:财务费用'].apply(lambda x: x if x > 0 else 0)
+            df['三费'] = df['减:销售费用'] + df['减:管理费用'] + df['财务费用正']
+            s1_chunks.append(df['三费'] / df['营业总收入'])
+            s2_chunks.append(df['三费'] / df['毛利润'])
+        if len(s1_chunks) == 0:
+            return
+
+        s1 = pd.concat(s1_chunks, ignore_index=True)
         s1 = s1.apply(lambda x: (x if x < 1 else 1) if x > -0.1 else -0.1)
         plt.subplot(2, 1, 1)
         s1.hist(bins=100)
         plt.title('三费/营业总收入')
 
-        s2 = df['三费'] / df['毛利润']
+        s2 = pd.concat(s2_chunks, ignore_index=True)
         s2 = s2.apply(lambda x: (x if x < 1 else 1) if x > -0.1 else -0.1)
         plt.subplot(2, 1, 2)
         s2.hist(bins=100)
@@ -17,6 +17,7 @@ from PyQt5.QtWidgets import QHeaderView
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
 
 from StockAnalysisSystem.core.DataHubEntry import *
+from StockAnalysisSystem.core.DataHub.UpdateEngine import UpdateEngine
 from StockAnalysisSystem.core.Utiltity.common import *
 from StockAnalysisSystem.core.Utiltity.ui_utility import *
 from StockAnalysisSystem.core.Utiltity.task_queue import *
@@ -42,13 +43,7 @@ class UpdateTask(TaskQueue.Task):
         self.__force = force
         self.__data_hub = data_hub
         self.__data_center = data_center
-        self.__quit = False
-
-        # Thread pool
-        self.__patch_count = 0
-        self.__apply_count = 0
-        self.__future = None
-        self.__pool = ThreadPoolExecutor(max_workers=1)
+        self.__engine = UpdateEngine(data_center, data_hub.get_data_utility())
 
         # Parameters
         self.agent = None
@@ -67,93 +62,25 @@ class UpdateTask(TaskQueue.Task):
 
     def run(self):
         print('Update task start.')
-
-        self.__patch_count = 0
-        self.__apply_count = 0
+        self.clock.reset()
+        self.progress.reset()
         try:
-            # Catch "pymongo.errors.ServerSelectionTimeoutError: No servers found yet" exception and continue.
-            self.__execute_update()
+            self.__engine.update(self.agent, self.identities, self.__force, self.progress)
         except Exception as e:
             print('Update got Exception: ')
             print(e)
             print(traceback.format_exc())
             print('Continue...')
         finally:
-            if self.__future is not None:
-                self.__future.cancel()
+            self.clock.freeze()
         print('Update task finished.')
 
     def quit(self):
-        self.__quit = True
+        self.__engine.quit()
 
     def identity(self) -> str:
         return self.agent.base_uri() if self.agent is not None else ''
 
-    # ------------------------------------- Task -------------------------------------
-
-    def __execute_update(self):
-        # Get identities here to ensure we can get the new list after stock info updated
-        update_list = self.identities if self.identities is not None and len(self.identities) > 0 else \
-                      self.agent.update_list()
-        if update_list is None or len(update_list) == 0:
-            update_list = [None]
-        progress = len(update_list)
-
-        self.clock.reset()
-        self.progress.reset()
-        self.progress.set_progress(self.agent.base_uri(), 0, progress)
-
-        for identity in update_list:
-            while (self.__patch_count - self.__apply_count > 20) and not self.__quit:
-                time.sleep(0.5)
-                continue
-            if self.__quit:
-                break
-
-            print('------------------------------------------------------------------------------------')
-
-            if identity is not None:
-                # Optimise: Update not earlier than listing date.
-                listing_date = self.__data_hub.get_data_utility().get_securities_listing_date(identity, default_since())
-
-                if self.__force:
-                    since, until = listing_date, now()
-                else:
-                    since, until = self.__data_center.calc_update_range(self.agent.base_uri(), identity)
-                    since = max(listing_date, since)
-                time_serial = (since, until)
-            else:
-                time_serial = None
-
-            patch = self.__data_center.build_local_data_patch(
-                self.agent.base_uri(), identity, time_serial, force=self.__force)
-            self.__patch_count += 1
-            print('Patch count: ' + str(self.__patch_count))
-
-            self.__future = self.__pool.submit(self.__execute_persistence,
-                                               self.agent.base_uri(), identity, patch)
-
-        if self.__future is not None:
-            print('Waiting for persistence task finish...')
-            self.__future.result()
-        self.clock.freeze()
-        # self.__ui.task_finish_signal[UpdateTask].emit(self)
-
-    def __execute_persistence(self, uri: str, identity: str, patch: tuple) -> bool:
-        try:
-            if patch is not None:
-                self.__data_center.apply_local_data_patch(patch)
-            if identity is not None:
-                self.progress.set_progress([uri, identity], 1, 1)
-            self.progress.increase_progress(uri)
-        except Exception as e:
-            print('e')
-            return False
-        finally:
-            self.__apply_count += 1
-            print('Persistence count: ' + str(self.__apply_count))
-        return True
-
 
 # ---------------------------------- RefreshTask ----------------------------------
 
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import datetime
+import numpy as np
+import pandas as pd
+
+project_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_path)
+
+from StockAnalysisSystem.core.Utiltity.date_parser import parse_time, parse_time_series
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Micro benchmark of date parsing. Run: python Test/manual/test_date_parser_benchmark.py
+# ----------------------------------------------------------------------------------------------------------------------
+
+def strptime_auto_time(text: str) -> datetime.datetime or None:
+    # The previous text_auto_time(): try the formats by exception, no memoization
+    for time_format in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%H:%M:%S', '%Y%m%d']:
+        # noinspection PyBroadException
+        try:
+            return datetime.datetime.strptime(text, time_format)
+        except Exception:
+            pass
+    return None
+
+
+def measure(name: str, func, repeat: int = 3) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        clock = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - clock)
+    print('%-48s %10.2f ms' % (name, min(elapsed) * 1000))
+    return min(elapsed)
+
+
+def benchmark(rows: int = 100000):
+    days = pd.bdate_range('1991-01-01', periods=rows // 10).strftime('%Y%m%d').tolist()
+    trade_dates = (days * 10)[:rows]
+    # Analyzer results: few different periods (quarter ends) repeated many times
+    quarter_ends = pd.date_range('2000-03-31', periods=80, freq='QE').strftime('%Y-%m-%d').tolist()
+    periods = [quarter_ends[i % len(quarter_ends)] for i in range(rows)]
+
+    print('Parse %d trade dates (%%Y%%m%%d, the last format to try):' % rows)
+    base = measure('  strptime by exception per value', lambda: [strptime_auto_time(t) for t in trade_dates])
+    memo = measure('  parse_time() per value (memoized)', lambda: [parse_time(t) for t in trade_dates])
+    vector = measure('  parse_time_series()', lambda: parse_time_series(trade_dates))
+    print('  speedup: memoized %.1fx, vectorized %.1fx' % (base / memo, base / vector))
+
+    print('Parse %d quarter ends (80 different texts):' % rows)
+    base = measure('  strptime by exception per value', lambda: [strptime_auto_time(t) for t in periods])
+    memo = measure('  parse_time() per value (memoized)', lambda: [parse_time(t) for t in periods])
+    print('  speedup: memoized %.1fx' % (base / memo))
+
+    assert parse_time_series(trade_dates).tolist() == [pd.Timestamp(strptime_auto_time(t)) for t in trade_dates]
+    assert np.all([parse_time(t) == strptime_auto_time(t) for t in periods])
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+project_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_path)
+
+from StockAnalysisSystem.core.Utiltity.df_utility import dataframe_to_records
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Micro benchmark of DataFrame to records. Run: python Test/manual/test_df_utility_benchmark.py
+# ----------------------------------------------------------------------------------------------------------------------
+
+def measure(name: str, func, repeat: int = 3) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        clock = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - clock)
+    print('%-48s %10.2f ms' % (name, min(elapsed) * 1000))
+    return min(elapsed)
+
+
+def benchmark(rows: int = 20000, columns: int = 20):
+    df = pd.DataFrame(np.random.rand(rows, columns), columns=['f%d' % i for i in range(columns)])
+    df.loc[::7, 'f3'] = np.nan
+
+    print('Convert DataFrame (%d x %d) to records:' % (rows, columns))
+    # The previous conversion of merge2(): row by row
+    base = measure('  row by row', lambda: df.T.apply(lambda x: x.dropna().to_dict()).tolist())
+    by_column = measure('  dataframe_to_records() by column', lambda: dataframe_to_records(df))
+    print('  speedup: %.1fx' % (base / by_column))
+
+    assert dataframe_to_records(df) == df.T.apply(lambda x: x.dropna().to_dict()).tolist()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+project_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_path)
+
+from StockAnalysisSystem.core.Database.NoSqlRw import documents_to_dataframe
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Micro benchmark of documents to DataFrame. Run: python Test/manual/test_nosql_rw_benchmark.py
+# The documents are decoded dicts, which is what the cursor of pymongo yields.
+# ----------------------------------------------------------------------------------------------------------------------
+
+def measure(name: str, func, repeat: int = 3) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        clock = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - clock)
+    print('%-48s %10.2f ms' % (name, min(elapsed) * 1000))
+    return min(elapsed)
+
+
+def scatter_to_columns(documents: list) -> pd.DataFrame:
+    # The previous conversion of ItkvTable query: scatter each field of each document into columns in python
+    count = 0
+    columns = {}
+    for document in documents:
+        for field, value in document.items():
+            column = columns.get(field)
+            if column is None:
+                column = columns[field] = ([], [])
+            column[0].append(count)
+            column[1].append(value)
+        count += 1
+    data = {}
+    for field, (indexes, values) in columns.items():
+        data[field] = pd.Series(values) if len(indexes) == count else \
+            pd.Series(values, index=indexes).reindex(range(count))
+    return pd.DataFrame(data, index=range(count), columns=list(columns.keys()))
+
+
+def benchmark(rows: int = 100000, fields: int = 20):
+    base = datetime(2000, 1, 1)
+    values = np.random.rand(rows, fields)
+    documents = [dict({'Identity': '000001.SZSE', 'DateTime': base + timedelta(days=i)},
+                      **{'f%d' % j: values[i][j] for j in range(fields)}) for i in range(rows)]
+
+    print('Convert %d documents (%d fields) to DataFrame:' % (rows, fields + 2))
+    scatter = measure('  scatter to columns (previous)', lambda: scatter_to_columns(documents))
+    plain = measure('  pd.DataFrame(list)', lambda: pd.DataFrame(list(documents)))
+    current = measure('  documents_to_dataframe()', lambda: documents_to_dataframe(iter(documents)))
+    print('  speedup over previous: %.1fx, overhead over pd.DataFrame: %.2fx' % (scatter / current, current / plain))
+
+    assert documents_to_dataframe(iter(documents)).equals(scatter_to_columns(documents))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,48 @@
+import traceback
+from os import sys, path
+root_path = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+sys.path.append(root_path)
+
+from StockAnalysisSystem.core.DataHub.CollectorResponseCache import test_entry as test_entry_collector_response_cache
+
+
+def test_entry():
+    test_entry_collector_response_cache()
+
+
+def main():
+    test_entry()
+    print('All Test Passed.')
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def exception_hook(type, value, tback):
+    # log the exception here
+    print('Exception hook triggered.')
+    print(type)
+    print(value)
+    print(tback)
+    # then call the default handler
+    sys.__excepthook__(type, value, tback)
+
+
+if __name__ == "__main__":
+    sys.excepthook = exception_hook
+    try:
+        main()
+    except Exception as e:
+        print('Error =>', e)
+        print('Error =>', traceback.format_exc())
+        exit()
+    finally:
+        pass
+
+
+
+
+
+
+
+
+
@@ -0,0 +1,65 @@
+import datetime
+import traceback
+from os import sys, path
+root_path = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+sys.path.append(root_path)
+
+from StockAnalysisSystem.core.Utiltity import date_parser
+from StockAnalysisSystem.core.Utiltity.date_parser import test_entry as test_entry_date_parser
+from StockAnalysisSystem.core.Utiltity.time_utility import text_auto_time
+from StockAnalysisSystem.core.Database import NoSqlRw
+
+
+def test_parsers_in_sync():
+    # NoSqlRw keeps its own copy of the parser, it must give the same results as date_parser
+    assert NoSqlRw.TIME_FORMATS == date_parser.TIME_FORMATS
+    now = datetime.datetime.now()
+    values = ['2020-01-02', '20200102', '2020-01-02 15:00:00', '15:00:00', '2020/01/02', 'bad', '',
+              now, datetime.date(2020, 1, 2), 20200102, None]
+    for value in values:
+        expect = date_parser.parse_time(value)
+        assert NoSqlRw.text_auto_time(value) == expect
+        assert text_auto_time(value) == expect
+
+
+def test_entry():
+    test_entry_date_parser()
+    test_parsers_in_sync()
+
+
+def main():
+    test_entry()
+    print('All Test Passed.')
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+
+def exception_hook(type, value, tback):
+    # log the exception here
+    print('Exception hook triggered.')
+    print(type)
+    print(value)
+    print(tback)
+    # then call the default handler
+    sys.__excepthook__(type, value, tback)
+
+
+if __name__ == "__main__":
+    sys.excepthook = exception_hook
+    try:
+        main()
+    except Exception as e:
+        print('Error =>', e)
+        print('Error =>', traceback.format_exc())
+        exit()
+    finally:
+        pass
+
+
+
+
+
+
+
+
+
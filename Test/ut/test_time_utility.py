@@ -0,0 +1,112 @@
+import traceback
+from os import sys, path
+root_path = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+sys.path.append(root_path)
+
+from StockAnalysisSystem.core.Utiltity.time_utility import *
+
+
+# ----------------------------------------------------- Test Code ------------------------------------------------------
+
+def __simulated_endpoint(days: [datetime.datetime], row_cap: int):
+    # Like tushare: returns at most row_cap rows of the range, the latest first
+    def fetch(since: datetime.datetime, until: datetime.datetime) -> [datetime.datetime]:
+        rows = [day for day in days if since <= day <= until]
+        return sorted(rows, reverse=True)[:row_cap]
+    return fetch
+
+
+def __fetch_all(fetch, since: datetime.datetime, until: datetime.datetime, row_cap: int,
+                density: float, key: str = None) -> ([datetime.datetime], AdaptiveDateTimeIterator):
+    result = []
+    time_iter = AdaptiveDateTimeIterator(since, until, row_cap, density, key)
+    while not time_iter.end():
+        sub_since, sub_until = time_iter.next_window()
+        rows = fetch(sub_since, sub_until)
+        if time_iter.feedback(len(rows)):
+            result.extend(rows)
+    return result, time_iter
+
+
+def test_adaptive_iterator_no_lost_rows():
+    # Listed in 2010, 5 rows per day (denser than expected)
+    days = [datetime.datetime(2010, 1, 1) + datetime.timedelta(days=i // 5) for i in range(5 * 3650)]
+    fetch = __simulated_endpoint(days, 5000)
+
+    result, time_iter = __fetch_all(fetch, datetime.datetime(1990, 1, 1), datetime.datetime(2020, 1, 1), 5000, 0.7)
+    assert sorted(result) == days
+    # Split when the window hits the cap
+    assert time_iter.splits() > 0
+    # 18250 rows need at least 4 calls, the empty years before listing take few
+    assert time_iter.calls() <= 12
+
+
+def test_adaptive_iterator_learn_density():
+    days = [datetime.datetime(2000, 1, 1) + datetime.timedelta(days=i) for i in range(7300)]
+    fetch = __simulated_endpoint(days, 1000)
+    # The learned density is shared by key in process, use a new key for each run
+    key = 'test.learn_density.%d' % time.time_ns()
+
+    result, time_iter = __fetch_all(fetch, datetime.datetime(2000, 1, 1), datetime.datetime(2019, 12, 31),
+                                    1000, 100, key)
+    assert sorted(result) == days
+    first_calls = time_iter.calls()
+
+    # The density learned by the first iteration makes the windows fit
+    result, time_iter = __fetch_all(fetch, datetime.datetime(2000, 1, 1), datetime.datetime(2019, 12, 31),
+                                    1000, 100, key)
+    assert sorted(result) == days
+    assert time_iter.splits() == 0 and time_iter.calls() < first_calls
+
+
+def test_adaptive_iterator_windows():
+    time_iter = AdaptiveDateTimeIterator(datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 10), 10, 1)
+    since, until = time_iter.next_window()
+    assert (since, until) == (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 8))
+    assert not time_iter.feedback(10)
+    # Split and retry from the same day
+    assert time_iter.next_window() == (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 4))
+    assert time_iter.feedback(4)
+    # Not overlapped, clipped by until
+    assert time_iter.next_window() == (datetime.datetime(2020, 1, 5), datetime.datetime(2020, 1, 10))
+    assert time_iter.feedback(6)
+    assert time_iter.end()
+
+
+def test_entry():
+    test_adaptive_iterator_windows()
+    test_adaptive_iterator_no_lost_rows()
+    test_adaptive_iterator_learn_density()
+
+
+# ----------------------------------------------------- File Entry -----------------------------------------------------
+
+def main():
+    test_entry()
+
+    # If program reaches here, all test passed.
+    print('All test passed.')
+
+
+# ------------------------------------------------- Exception Handling -------------------------------------------------
+
+def exception_hook(type, value, tback):
+    # log the exception here
+    print('Exception hook triggered.')
+    print(type)
+    print(value)
+    print(tback)
+    # then call the default handler
+    sys.__excepthook__(type, value, tback)
+
+
+if __name__ == "__main__":
+    sys.excepthook = exception_hook
+    try:
+        main()
+    except Exception as e:
+        print('Error =>', e)
+        print('Error =>', traceback.format_exc())
+        exit()
+    finally:
+        pass
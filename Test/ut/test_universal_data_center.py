@@ -34,6 +34,382 @@ def test_update():
     data_center.update_local_data('test.entry1', 'identity_test1')
 
 
+def test_batch_query():
+    import tempfile
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, PluginManager())
+    data_center.register_data_agent(DataAgentSecurityDaily(
+        uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+        identity_field='stock_identity', datetime_field='trade_date',
+        query_declare={'stock_identity': ([str], [], True, '')}))
+
+    identities = ['%06d.SZSE' % i for i in range(DataAgentSecurityDaily.BATCH_QUERY_CHUNK + 10)]
+    dates = pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-03'])
+    df = pd.DataFrame({
+        'stock_identity': [identity for identity in identities for _ in dates],
+        'trade_date': list(dates) * len(identities),
+        'close': [float(i) for i in range(len(identities) * len(dates))],
+    })
+    # Split by identity and persist to the collection of each identity
+    data_center.get_data_agent('Test.Daily').merge('Test.Daily', None, df)
+
+    result = data_center.query('Test.Daily', identities)
+    assert len(result) == len(df)
+    assert set(result['stock_identity'].unique()) == set(identities)
+
+    wide = data_center.query_pivot('Test.Daily', identities, 'close')
+    assert wide.shape == (len(dates), len(identities))
+    assert wide[identities[1]].tolist() == [3.0, 4.0, 5.0]
+
+    async def query_all():
+        return await asyncio.gather(*[data_center.query_async('Test.Daily', identity) for identity in identities[:3]])
+    results = asyncio.run(query_all())
+    assert [result['close'].tolist() for result in results] == [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0], [6.0, 7.0, 8.0]]
+
+
+def test_shared_table_object():
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+
+    # The concurrent queries of a table get the same table object (with the same bulk buffer)
+    with ThreadPoolExecutor(8) as executor:
+        tables = list(executor.map(lambda _: database_entry.query_nosql_table('Test', 'Test_Daily'), range(64)))
+    assert all(table is tables[0] for table in tables)
+
+
+def test_cross_section():
+    import tempfile
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, PluginManager())
+    agent = DataAgentSecurityDaily(
+        uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+        identity_field='stock_identity', datetime_field='trade_date', cross_section=True)
+    data_center.register_data_agent(agent)
+
+    identities = ['000001.SZSE', '000002.SZSE', '600000.SSE']
+    dates = pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-03'])
+    for i, identity in enumerate(identities):
+        df = pd.DataFrame({'stock_identity': identity, 'trade_date': dates, 'close': [i + 0.1, i + 0.2, i + 0.3]})
+        data_center.merge_local_data('Test.Daily', identity, df)
+
+    # Not served until a complete rebuild is recorded
+    assert not agent.cross_section_ready('Test.Daily')
+    agent.rebuild_cross_section('Test.Daily', identities[:1])
+    assert not agent.cross_section_ready('Test.Daily')
+    agent.update_list = lambda: identities
+    agent.rebuild_cross_section('Test.Daily')
+    assert agent.cross_section_ready('Test.Daily')
+
+    day = datetime.datetime(2020, 1, 2)
+    result = data_center.query('Test.Daily', None, (day, day))
+    assert len(result) == 3
+    assert sorted(result['close'].tolist()) == [0.2, 1.2, 2.2]
+
+    # The per-security query is not affected
+    result = data_center.query('Test.Daily', '000002.SZSE')
+    assert result['close'].tolist() == [1.1, 1.2, 1.3]
+
+    # Other agents have no cross section
+    other = DataAgent(uri='Test.Other', database_entry=database_entry, depot_name='Test')
+    assert not other.cross_section_ready('Test.Other')
+
+
+def test_plan_market_update():
+    import tempfile
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    agent = DataAgentSecurityDaily(
+        uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+        identity_field='stock_identity', datetime_field='trade_date', market_wide=True)
+
+    identities = ['%06d.SZSE' % i for i in range(5)]
+    for identity in identities:
+        df = pd.DataFrame({'stock_identity': identity, 'trade_date': pd.to_datetime(['2020-01-02', '2020-01-03'])})
+        agent.merge('Test.Daily', identity, df)
+    # Suspended for a long time
+    agent.merge('Test.Daily', '600000.SSE', pd.DataFrame({'stock_identity': '600000.SSE',
+                                                         'trade_date': pd.to_datetime(['2019-06-28'])}))
+
+    # Wed: 3 trade dates for 5 securities, the suspended and the new one are updated one by one
+    until = datetime.datetime(2020, 1, 8)
+    trade_dates, day_identities, per_identity = \
+        agent.plan_market_update('Test.Daily', identities + ['600000.SSE', '600001.SSE'], until)
+    assert trade_dates == [datetime.datetime(2020, 1, d) for d in (6, 7, 8)]
+    assert sorted(day_identities) == identities
+    assert sorted(per_identity) == ['600000.SSE', '600001.SSE']
+
+    # Fewer fetches one by one
+    trade_dates, day_identities, per_identity = agent.plan_market_update('Test.Daily', identities[:2], until)
+    assert trade_dates == [] and day_identities == [] and sorted(per_identity) == identities[:2]
+
+    # Up to date on weekend
+    trade_dates, _, per_identity = agent.plan_market_update('Test.Daily', identities, datetime.datetime(2020, 1, 5))
+    assert trade_dates == [] and per_identity == []
+
+
+def test_trade_calendar_range():
+    import tempfile
+    from StockAnalysisSystem.core.DataHub.TradeCalendar import TradeCalendar
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, PluginManager())
+    agent = DataAgentSecurityDaily(uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+                                   identity_field='stock_identity', datetime_field='trade_date')
+    data_center.register_data_agent(agent)
+    agent.merge('Test.Daily', '000001.SZSE', pd.DataFrame({'stock_identity': ['000001.SZSE'],
+                                                          'trade_date': pd.to_datetime(['2020-01-03'])}))
+
+    # 2020-01-06 (Mon) is set closed for test
+    trade_calendar = TradeCalendar.from_dataframe(pd.DataFrame({
+        'trade_date': pd.date_range('2019-12-01', '2020-01-31'),
+        'status': [0 if d.weekday() >= 5 or d == pd.Timestamp('2020-01-06') else 1
+                   for d in pd.date_range('2019-12-01', '2020-01-31')]}))
+    trade_calendar_backup = DataAgentUtility.trade_calendar
+    DataAgentUtility.trade_calendar = staticmethod(lambda: trade_calendar)
+    try:
+        # Fri -> Mon: no trading day to fetch
+        since, until = data_center.calc_update_range('Test.Daily', '000001.SZSE',
+                                                     (None, datetime.datetime(2020, 1, 6)))
+        assert date2text(since) == date2text(until)
+        # Fri -> Sat after one trading day: clipped to the trading day
+        assert data_center.calc_update_range('Test.Daily', '000001.SZSE', (None, datetime.datetime(2020, 1, 11))) \
+            == (datetime.datetime(2020, 1, 3), datetime.datetime(2020, 1, 10))
+        # Not clipped out of the calendar
+        assert data_center.calc_update_range('Test.Daily', '000001.SZSE', (None, datetime.datetime(2020, 3, 1))) \
+            == (datetime.datetime(2020, 1, 3), datetime.datetime(2020, 3, 1))
+    finally:
+        DataAgentUtility.trade_calendar = trade_calendar_backup
+
+
+def test_content_diff():
+    import tempfile
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    agent = DataAgent(uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+                      identity_field='stock_identity', datetime_field='trade_date')
+
+    df = pd.DataFrame({'stock_identity': '000001.SZSE',
+                       'trade_date': pd.to_datetime(['2020-01-02', '2020-01-03', '2020-01-06']),
+                       'close': [1.1, 1.2, 1.3], 'volume': [100, 200, None]})
+    assert sum(agent.merge2('Test.Daily', '000001.SZSE', df)) == 3
+
+    # Re-fetch: nothing changed
+    assert sum(agent.merge2('Test.Daily', '000001.SZSE', df)) == 0
+
+    # One changed, one new
+    df = pd.concat([df, pd.DataFrame({'stock_identity': ['000001.SZSE'],
+                                      'trade_date': pd.to_datetime(['2020-01-07']),
+                                      'close': [1.4], 'volume': [400]})], ignore_index=True)
+    df.loc[1, 'close'] = 1.25
+    assert sum(agent.merge2('Test.Daily', '000001.SZSE', df)) == 2
+    result = agent.query('Test.Daily', '000001.SZSE', None, {}, None)
+    assert result['close'].tolist() == [1.1, 1.25, 1.3, 1.4]
+
+
+def test_response_cache():
+    import types
+    import tempfile
+    from StockAnalysisSystem.core.DataHub.CollectorResponseCache import \
+        CollectorResponseCache, MODE_CACHE, MODE_REPLAY
+
+    calls = []
+
+    def query(**kwargs) -> pd.DataFrame:
+        calls.append(kwargs)
+        return pd.DataFrame({'stock_identity': [kwargs.get('stock_identity')],
+                             'trade_date': pd.to_datetime(['2020-01-02']), 'close': [1.1]})
+
+    class TestPluginManager(PluginManager):
+        def find_module_has_capacity(self, capacity: str) -> [object]:
+            return [types.SimpleNamespace(__name__='test_plugin', query=query)]
+
+        def execute_module_function(self, modules: object, _function: str, parameters: dict,
+                                    end_if_success: bool = True) -> [object]:
+            return [getattr(modules, _function)(**parameters)]
+
+    database_entry = DatabaseEntry()
+    data_center = UniversalDataCenter(database_entry, TestPluginManager())
+    data_center.register_data_agent(DataAgentSecurityDaily(
+        uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+        identity_field='stock_identity', datetime_field='trade_date'))
+    response_cache = CollectorResponseCache(tempfile.mkdtemp(), MODE_CACHE)
+    data_center.set_response_cache(response_cache)
+
+    time_serial = (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 3))
+    df = data_center.query_from_plugin('Test.Daily', '000001.SZSE', time_serial)
+    assert data_center.query_from_plugin('Test.Daily', '000001.SZSE', time_serial).equals(df)
+    assert len(calls) == 1
+
+    # Replay: nothing goes to the plugin
+    response_cache.set_mode(MODE_REPLAY)
+    assert data_center.query_from_plugin('Test.Daily', '000001.SZSE', time_serial).equals(df)
+    assert data_center.query_from_plugin('Test.Daily', '000002.SZSE', time_serial) is None
+    assert len(calls) == 1
+
+
+def test_empty_response():
+    import types
+    import tempfile
+
+    def query(**kwargs) -> pd.DataFrame or None:
+        # 000001 is suspended: the collector responds an empty result. 000002 fails.
+        return pd.DataFrame(columns=['stock_identity', 'trade_date', 'close']) \
+            if kwargs.get('stock_identity') == '000001.SZSE' else None
+
+    class TestPluginManager(PluginManager):
+        def find_module_has_capacity(self, capacity: str) -> [object]:
+            return [types.SimpleNamespace(__name__='test_plugin', query=query)]
+
+        def execute_module_function(self, modules: object, _function: str, parameters: dict,
+                                    end_if_success: bool = True) -> [object]:
+            return [getattr(modules, _function)(**parameters)]
+
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, TestPluginManager())
+    data_center.register_data_agent(DataAgentSecurityDaily(
+        uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+        identity_field='stock_identity', datetime_field='trade_date'))
+
+    time_serial = (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 3))
+    ret, _, result = data_center.build_local_data_patch('Test.Daily', '000001.SZSE', time_serial)
+    assert ret and result is None
+    ret, _, result = data_center.build_local_data_patch('Test.Daily', '000002.SZSE', time_serial)
+    assert not ret
+
+    marks = data_center.get_update_table().get_empty_marks([['Test', 'Daily', '000001_SZSE'],
+                                                            ['Test', 'Daily', '000002_SZSE']])
+    assert list(marks.keys()) == ['Test.Daily.000001_SZSE']
+    assert marks['Test.Daily.000001_SZSE']['empty_since'] == datetime.datetime(2020, 1, 1)
+
+
+def test_no_newer_data():
+    import types
+    import tempfile
+    from StockAnalysisSystem.core.DataHub.UpdatePlanner import UpdatePlanner
+
+    latest = {'trade_date': datetime.datetime(2020, 1, 3)}
+
+    def query(**kwargs) -> pd.DataFrame:
+        # Suspended after 2020-01-03: the range from the end of local data returns the last local bar only
+        since, until = kwargs.get('trade_date')
+        dates = [d for d in pd.date_range('2020-01-02', latest['trade_date']) if since <= d <= until]
+        return pd.DataFrame({'stock_identity': '000001.SZSE', 'trade_date': dates, 'close': 1.1})
+
+    class TestPluginManager(PluginManager):
+        def find_module_has_capacity(self, capacity: str) -> [object]:
+            return [types.SimpleNamespace(__name__='test_plugin', query=query)]
+
+        def execute_module_function(self, modules: object, _function: str, parameters: dict,
+                                    end_if_success: bool = True) -> [object]:
+            return [getattr(modules, _function)(**parameters)]
+
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, TestPluginManager())
+    agent = DataAgentSecurityDaily(uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+                                   identity_field='stock_identity', datetime_field='trade_date')
+    data_center.register_data_agent(agent)
+    agent.merge('Test.Daily', '000001.SZSE', pd.DataFrame({'stock_identity': '000001.SZSE', 'close': 1.1,
+                                                          'trade_date': pd.to_datetime(['2020-01-02', '2020-01-03'])}))
+
+    planner = UpdatePlanner(data_center)
+    until = datetime.datetime(2020, 1, 8)
+    plan = planner.plan('Test.Daily', ['000001.SZSE'], until=until)
+    assert plan['since'].tolist() == [pd.Timestamp('2020-01-03')]
+
+    # Until today: the data may be not published yet, not confirmed empty
+    ret, _, result = data_center.build_local_data_patch('Test.Daily', '000001.SZSE', (plan['since'][0], now()))
+    assert ret and result is None
+    assert len(data_center.get_update_table().get_empty_marks([['Test', 'Daily', '000001_SZSE']])) == 0
+
+    ret, _, result = data_center.build_local_data_patch('Test.Daily', '000001.SZSE', (plan['since'][0], until))
+    assert ret and result is None
+    marks = data_center.get_update_table().get_empty_marks([['Test', 'Daily', '000001_SZSE']])
+    assert marks['Test.Daily.000001_SZSE']['empty_since'] == datetime.datetime(2020, 1, 3)
+    # Skipped by the next plan of the same range, but not the longer one
+    assert len(planner.plan('Test.Daily', ['000001.SZSE'], until=until)) == 0
+    assert len(planner.plan('Test.Daily', ['000001.SZSE'], until=datetime.datetime(2020, 1, 9))) == 1
+
+    # Resumed: the new bar is fetched
+    latest['trade_date'] = datetime.datetime(2020, 1, 6)
+    ret, _, result = data_center.build_local_data_patch('Test.Daily', '000001.SZSE', (plan['since'][0], until))
+    assert ret and result['trade_date'].max() == pd.Timestamp('2020-01-06')
+
+
+def test_market_data_patch():
+    import types
+    import tempfile
+
+    def query(**kwargs) -> pd.DataFrame or None:
+        # 01-04 is closed: the collector responds an empty result. 01-06 fails.
+        trade_date = kwargs.get('trade_date')[0]
+        if trade_date == datetime.datetime(2020, 1, 4):
+            return pd.DataFrame(columns=['stock_identity', 'trade_date', 'close'])
+        if trade_date == datetime.datetime(2020, 1, 6):
+            return None
+        return pd.DataFrame({'stock_identity': ['000001.SZSE', '000002.SZSE'],
+                             'trade_date': [trade_date] * 2, 'close': [1.1, 2.1]})
+
+    class TestPluginManager(PluginManager):
+        def find_module_has_capacity(self, capacity: str) -> [object]:
+            return [types.SimpleNamespace(__name__='test_plugin', query=query)]
+
+        def execute_module_function(self, modules: object, _function: str, parameters: dict,
+                                    end_if_success: bool = True) -> [object]:
+            return [getattr(modules, _function)(**parameters)]
+
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, TestPluginManager())
+    data_center.register_data_agent(DataAgentSecurityDaily(
+        uri='Test.Daily', database_entry=database_entry, depot_name='Test',
+        identity_field='stock_identity', datetime_field='trade_date', market_wide=True))
+
+    ret, _, result = data_center.build_market_data_patch('Test.Daily', datetime.datetime(2020, 1, 4))
+    assert ret and result is None
+    # Failed, not a closed day
+    ret, _, result = data_center.build_market_data_patch('Test.Daily', datetime.datetime(2020, 1, 6))
+    assert not ret
+
+    patch = data_center.build_market_data_patch('Test.Daily', datetime.datetime(2020, 1, 3), ['000001.SZSE'])
+    assert patch[0] and len(patch[2]) == 1
+    assert data_center.apply_local_data_patch(patch)
+
+    # The identities in the day patch have their update records
+    update_table = data_center.get_update_table()
+    assert update_table.get_last_update_time(['Test', 'Daily', '000001_SZSE']) is not None
+    assert update_table.get_since_until(['Test', 'Daily', '000001_SZSE']) == \
+        (datetime.datetime(2020, 1, 3), datetime.datetime(2020, 1, 3))
+    assert update_table.get_last_update_time(['Test', 'Daily', '000002_SZSE']) is None
+
+
+def test_query_iter():
+    import tempfile
+    database_entry = DatabaseEntry()
+    database_entry.config_embedded_db(tempfile.mkdtemp())
+    data_center = UniversalDataCenter(database_entry, PluginManager())
+    data_center.register_data_agent(DataAgent(
+        uri='Test.Finance', database_entry=database_entry, depot_name='Test',
+        identity_field='stock_identity', datetime_field='period'))
+
+    df = pd.DataFrame({
+        'stock_identity': ['%06d.SZSE' % (i % 7) for i in range(100)],
+        'period': pd.date_range('2000-01-01', periods=100),
+        'value': [float(i) for i in range(100)],
+    })
+    data_center.merge_local_data('Test.Finance', None, df)
+
+    chunks = list(data_center.query_iter('Test.Finance', chunk_rows=30, fields=['stock_identity', 'value']))
+    assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+    assert all(list(chunk.columns) == ['stock_identity', 'value'] for chunk in chunks)
+    assert pd.concat(chunks)['value'].sum() == df['value'].sum()
+
+
 def test_readable_to_fields():
     pass
 
@@ -45,6 +421,17 @@ def test_fields_to_readable():
 def test_entry():
     # test_entry1()
     # test_update()
+    test_batch_query()
+    test_shared_table_object()
+    test_cross_section()
+    test_plan_market_update()
+    test_trade_calendar_range()
+    test_content_diff()
+    test_response_cache()
+    test_empty_response()
+    test_no_newer_data()
+    test_market_data_patch()
+    test_query_iter()
     test_readable_to_fields()
 
 
@@ -148,10 +148,123 @@ def test_until_record_unique_and_increase():
     assert(ut.get_until(['__Trade Calender']) == text_auto_time('20400101'))
 
 
+def test_write_behind(ut: UpdateTableEx = None):
+    if ut is None:
+        import tempfile
+        ut = UpdateTableEx(SqliteClient(tempfile.mkdtemp()), 'TestDB', 'TestTable')
+    ut.update_update_range(['__Trade Data', '000001'], '20000101', '20100101')
+
+    ut.begin_write_behind()
+    assert(ut.update_update_range(['__Trade Data', '000001'], '19990101', '20050101'))
+    assert(ut.update_update_range(['__Trade Data', '000001'], '20010101', '20200101'))
+    assert(ut.update_update_range(['__Trade Data', '000002'], '20010101', '20200101'))
+    assert(ut.update_latest_update_time(['__Trade Data', '000002']))
+
+    # Not written yet, but the getters see the buffered updates
+    assert(len(ut.get_update_record(['__Trade Data', '000002'])) == 0)
+    assert(ut.get_since_until(['__Trade Data', '000001']) ==
+           (text_auto_time('19990101'), text_auto_time('20200101')))
+    assert(ut.get_last_update_time(['__Trade Data', '000002']) is not None)
+
+    assert(ut.end_write_behind())
+    assert(ut.get_since_until(['__Trade Data', '000001']) ==
+           (text_auto_time('19990101'), text_auto_time('20200101')))
+    assert(ut.get_since_until(['__Trade Data', '000002']) ==
+           (text_auto_time('20010101'), text_auto_time('20200101')))
+    assert(len(ut.get_update_record(['__Trade Data', '000002'])) == 1)
+
+    # A smaller until does not override
+    ut.begin_write_behind()
+    ut.update_until(['__Trade Data', '000002'], '20150101')
+    ut.end_write_behind()
+    assert(ut.get_until(['__Trade Data', '000002']) == text_auto_time('20200101'))
+
+
+def test_empty_mark(ut: UpdateTableEx = None):
+    if ut is None:
+        import tempfile
+        ut = UpdateTableEx(SqliteClient(tempfile.mkdtemp()), 'TestDB', 'TestTable')
+    ut.update_update_range(['__Trade Data', '000001'], '20000101', '20100101')
+    assert(ut.mark_empty(['__Trade Data', '000001'], '20100101', '20100201'))
+
+    ut.begin_write_behind()
+    assert(ut.mark_empty(['__Trade Data', '000002'], '20100101', '20100201'))
+    # Buffered mark is visible
+    marks = ut.get_empty_marks([['__Trade Data', '000001'], ['__Trade Data', '000002'], ['__Trade Data', '000003']])
+    assert(sorted(marks.keys()) == ['__TradeData.000001', '__TradeData.000002'])
+    assert(marks['__TradeData.000001']['empty_since'] == text_auto_time('20100101'))
+    assert(ut.end_write_behind())
+
+    marks = ut.get_empty_marks([['__Trade Data', '000002']])
+    assert(marks['__TradeData.000002']['empty_until'] == text_auto_time('20100201'))
+    # The update range is not affected
+    assert(ut.get_since_until(['__Trade Data', '000001']) ==
+           (text_auto_time('20000101'), text_auto_time('20100101')))
+
+
+def test_concurrent_flush(ut: UpdateTableEx = None):
+    import threading
+    if ut is None:
+        import tempfile
+        ut = UpdateTableEx(SqliteClient(tempfile.mkdtemp()), 'TestDB', 'TestTable')
+    ut.begin_write_behind()
+
+    # The entries being flushed are visible until written
+    table = ut._UpdateTableEx__table
+    bulk_flush = table.bulk_flush
+    during_flush = []
+
+    def check_then_flush():
+        during_flush.append(ut.get_until(['__Trade Data', '000001']))
+        return bulk_flush()
+    table.bulk_flush = check_then_flush
+    try:
+        ut.update_until(['__Trade Data', '000001'], '20200101')
+        assert(ut.flush())
+    finally:
+        table.bulk_flush = bulk_flush
+    assert(during_flush[0] == text_auto_time('20200101'))
+
+    # Concurrent updates and flushes lose nothing
+    def update(worker: int):
+        for i in range(50):
+            ut.update_until(['__Trade Data', '%d_%d' % (worker, i)], '20200101')
+            if i % 10 == 0:
+                ut.flush()
+    threads = [threading.Thread(target=update, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert(ut.end_write_behind())
+    for worker in range(4):
+        for i in range(50):
+            assert(len(ut.get_update_record(['__Trade Data', '%d_%d' % (worker, i)])) == 1)
+
+
+def test_rebind_client_keeps_buffer():
+    import tempfile
+    db_path = tempfile.mkdtemp()
+    ut = UpdateTableEx(SqliteClient(db_path), 'TestDB', 'TestTable')
+    ut.begin_write_behind()
+    ut.update_update_range(['__Trade Data', '000001'], '20000101', '20100101')
+
+    # The buffered updates are not dropped and are written by the new client
+    ut.rebind_client(SqliteClient(db_path))
+    assert(ut.end_write_behind())
+    assert(ut.get_since_until(['__Trade Data', '000001']) ==
+           (text_auto_time('20000101'), text_auto_time('20100101')))
+    assert(len(ut.get_update_record(['__Trade Data', '000001'])) == 1)
+
+
 def test_entry():
     test_basic_feature()
     test_since_record_unique_and_decrease()
     test_until_record_unique_and_increase()
+    test_write_behind(__default_prepare_test())
+    test_empty_mark(__default_prepare_test())
+    test_concurrent_flush(__default_prepare_test())
+    test_rebind_client_keeps_buffer()
 
 
 # ----------------------------------------------------- File Entry -----------------------------------------------------
@@ -4,7 +4,7 @@ from os import sys, path
 root_path = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
 sys.path.append(root_path)
 
-from StockAnalysisSystem.core.Utiltity.df_utility import check_date_continuity
+from StockAnalysisSystem.core.Utiltity.df_utility import check_date_continuity, dataframe_to_records
 from StockAnalysisSystem.core.Utiltity.df_utility import test_entry as test_entry_df_utility
 
 
@@ -16,9 +16,35 @@ def test_check_date_continuity():
     print('max_date = ' + str(max_date))
 
 
+def test_dataframe_to_records():
+    import datetime
+    import numpy as np
+    df = pd.DataFrame({
+        'stock_identity': ['000001.SZSE', '000002.SZSE', None, '000004.SZSE'],
+        'trade_date': ['2020-01-02', '20200103', '2020-01-06 15:00:00', 'bad'],
+        'close': [1.1, np.nan, 1.3, 1.4],
+        'volume': [100, 200, 300, 400],
+    })
+    records = dataframe_to_records(df, ['trade_date'])
+    assert records[0] == {'stock_identity': '000001.SZSE', 'trade_date': datetime.datetime(2020, 1, 2),
+                          'close': 1.1, 'volume': 100}
+    assert records[1] == {'stock_identity': '000002.SZSE', 'trade_date': datetime.datetime(2020, 1, 3),
+                          'volume': 200}
+    assert records[2] == {'trade_date': datetime.datetime(2020, 1, 6, 15), 'close': 1.3, 'volume': 300}
+    # Can not parse
+    assert 'trade_date' not in records[3]
+    assert dataframe_to_records(pd.DataFrame(), ['trade_date']) == []
+
+    # The same as the row by row conversion. The timing is in Test/manual/test_df_utility_benchmark.py
+    df = pd.DataFrame(np.random.rand(50, 5), columns=['f%d' % i for i in range(5)])
+    df.loc[::7, 'f3'] = np.nan
+    assert dataframe_to_records(df) == df.T.apply(lambda x: x.dropna().to_dict()).tolist()
+
+
 def test_entry():
     test_entry_df_utility()
     test_check_date_continuity()
+    test_dataframe_to_records()
 
 
 def main():